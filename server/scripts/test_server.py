@@ -1,19 +1,26 @@
 """
 Test script for HonkTTS server.
-Imports constants (VOICES, HOST, PORT) from tts_server.py to stay in sync.
+Imports constants (VOICES, HOST, PORT) and normalize_text from tts_server.py to stay in sync.
 
 Usage:
     python test_server.py              # start server, run tests, kill server
     python test_server.py --play       # also open generated WAVs in default player
     python test_server.py --keep       # keep generated WAV files after test
     python test_server.py --no-start   # skip server lifecycle, test an already-running server
+
+Benchmark mode drives concurrent load from a corpus of game lines instead:
+    python test_server.py --benchmark --fake-model --concurrency 16 --requests 500
+    python test_server.py --benchmark --output new.json --compare baseline.json
 """
 
 import argparse
 import json
+import math
 import os
 import platform
+import random
 import signal
+import socket
 import struct
 import subprocess
 import sys
@@ -21,6 +28,7 @@ import tempfile
 import threading
 import time
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
 # Resolve the directory containing tts_server.py:
 #   - Installed layout: test_server.py and tts_server.py are siblings
@@ -39,9 +47,11 @@ else:
 if _SERVER_DIR not in sys.path:
     sys.path.insert(0, _SERVER_DIR)
 
-from tts_server import HOST, PORT, VOICES  # noqa: E402
+from tts_server import HOST, PIPE_PORT, PORT, VOICES, normalize_text  # noqa: E402
 
 BASE_URL = f"http://{HOST}:{PORT}"
+# The pipelined protocol is opt-in; a server started by this script enables it.
+TEST_PIPE_PORT = PIPE_PORT or PORT + 1
 
 
 
@@ -56,7 +66,16 @@ def find_server_script() -> str:
 
 def is_server_up() -> bool:
     try:
-        with urllib.request.urlopen(f"{BASE_URL}/health", timeout=2):
+        with urllib.request.urlopen(f"{BASE_URL}/health/live", timeout=2):
+            return True
+    except Exception:
+        return False
+
+
+def is_server_ready() -> bool:
+    # /health/ready answers 503 (an HTTPError here) until every engine has loaded.
+    try:
+        with urllib.request.urlopen(f"{BASE_URL}/health/ready", timeout=2):
             return True
     except Exception:
         return False
@@ -77,15 +96,18 @@ def kill_existing_server():
     sys.exit(1)
 
 
-def start_server() -> subprocess.Popen:
+def start_server(env: dict[str, str] | None = None) -> subprocess.Popen:
     script = find_server_script()
     print(f"  Starting server: {sys.executable} {script}")
+    for name, value in (env or {}).items():
+        print(f"    {name}={value}")
 
     proc = subprocess.Popen(
         [sys.executable, script],
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         text=True,
+        env={**os.environ, **(env or {})},
     )
 
     # Drain stdout in a background thread to prevent the pipe buffer from
@@ -101,7 +123,9 @@ def start_server() -> subprocess.Popen:
     drain_thread.start()
 
     print("  Waiting for server to be ready (this may take a minute on first run)...")
-    deadline = time.time() + 120  # 2 minute timeout for model loading
+    started = time.time()
+    deadline = started + 120  # 2 minute timeout for model loading
+    live_at = None
     while time.time() < deadline:
         if proc.poll() is not None:
             drain_thread.join(timeout=2)
@@ -110,11 +134,15 @@ def start_server() -> subprocess.Popen:
                 print(f"    {line}")
             sys.exit(1)
 
-        if is_server_up():
-            print("  Server is ready.")
+        if live_at is None and is_server_up():
+            live_at = time.time()
+            print(f"  Server is listening after {live_at - started:.1f}s, loading engines...")
+
+        if live_at is not None and is_server_ready():
+            print(f"  Server is ready after {time.time() - started:.1f}s.")
             return proc
 
-        time.sleep(1)
+        time.sleep(0.25)
 
     proc.kill()
     print("  FAIL: Server did not become ready within 120 seconds.")
@@ -250,7 +278,7 @@ def test_health(fail_warnings: bool):
 
     for key in ("espeak_binary", "espeak_version", "espeak_data_path",
                 "python_executable", "tts_model", "voices_count", "variant_voices_count",
-                "voices", "variant_voices"):
+                "voices", "variant_voices", "model", "memory", "overload", "threads"):
         val = body.get(key, "MISSING")
         print(f"  {key}: {val}")
 
@@ -282,6 +310,53 @@ def test_health(fail_warnings: bool):
     return True
 
 
+def test_health_static():
+    print("\n=== /health/static ===")
+    with urllib.request.urlopen(f"{BASE_URL}/health/static", timeout=10) as resp:
+        etag = resp.headers.get("ETag")
+        body = json.loads(resp.read())
+    if not etag or "voices" not in body:
+        print(f"  FAIL: missing ETag ({etag!r}) or static fields: {sorted(body)}")
+        return False
+
+    req = urllib.request.Request(f"{BASE_URL}/health/static", headers={"If-None-Match": etag})
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            print(f"  FAIL: revalidation returned {resp.status}, expected 304")
+            return False
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            print(f"  FAIL: revalidation returned {e.code}, expected 304")
+            return False
+
+    print(f"  PASS: ETag {etag} revalidates with 304")
+    return True
+
+
+def test_readiness():
+    print("\n=== /health/live, /health/ready ===")
+    status, body = request_json("GET", "/health/live")
+    if status != 200:
+        print(f"  FAIL: /health/live status {status}: {body}")
+        return False
+
+    status, body = request_json("GET", "/health/ready")
+    if status != 200 or body.get("status") != "ready":
+        print(f"  FAIL: /health/ready status {status}: {body}")
+        return False
+
+    for engine, state in body.get("engines", {}).items():
+        print(f"  {engine}: ready after {state.get('load_seconds')}s")
+
+    status, body = request_json("GET", "/health/ready?engine=robotic")
+    if status != 200 or list(body.get("engines", {})) != ["robotic"]:
+        print(f"  FAIL: /health/ready?engine=robotic status {status}: {body}")
+        return False
+
+    print("  PASS: server is live and ready")
+    return True
+
+
 def test_generate_audio(play: bool, keep: bool):
     print("\n=== /generate-audio (Coqui TTS) ===")
     voice = next(iter(VOICES))
@@ -325,6 +400,464 @@ def test_generate_audio(play: bool, keep: bool):
     return True
 
 
+def test_postprocess_options():
+    print("\n=== /generate-audio (normalize, trim_silence, effects) ===")
+    voice = next(iter(VOICES))
+    body = {"input_string": "Engineering, the engine is on fire.", "voice": voice}
+    status, plain = request_json("POST", "/generate-audio", body)
+    status_trimmed, trimmed = request_json(
+        "POST", "/generate-audio", {**body, "normalize": "loudness", "trim_silence": True})
+
+    if status != 200 or status_trimmed != 200:
+        print(f"  FAIL: status {status} / {status_trimmed}")
+        return False
+    if not isinstance(trimmed, bytes) or validate_wav(trimmed):
+        print(f"  FAIL: invalid WAV: {validate_wav(trimmed) if isinstance(trimmed, bytes) else trimmed}")
+        return False
+
+    # Synthesis is not deterministic, so compare the endings rather than the
+    # lengths: an untrimmed line ends in a sentence gap of digital silence.
+    tail = 2 * 1000
+    print(f"  Untrimmed {len(plain)} bytes, trimmed {len(trimmed)} bytes")
+    if any(plain[-tail:]) or not any(trimmed[-tail:]):
+        print("  FAIL: expected silence at the end of the untrimmed WAV only")
+        return False
+
+    status, radio = request_json("POST", "/generate-audio", {**body, "effects": ["radio", "pitch:-3", "speed:1.2"]})
+    if status != 200 or not isinstance(radio, bytes) or validate_wav(radio):
+        print(f"  FAIL: effects: status {status}: {radio if not isinstance(radio, bytes) else validate_wav(radio)}")
+        return False
+    print(f"  With radio, pitch and speed effects: {len(radio)} bytes")
+
+    for invalid in ({"normalize": "loudest"}, {"effects": ["kazoo"]}, {"effects": ["pitch:40"]}):
+        status, _ = request_json("POST", "/generate-audio", {**body, **invalid})
+        if status != 400:
+            print(f"  FAIL: expected 400 for {invalid}, got {status}")
+            return False
+
+    print("  PASS: post-processed WAVs are valid")
+    return True
+
+
+def test_text_front_end():
+    print("\n=== /generate-audio (normalization, long input) ===")
+    voice = next(iter(VOICES))
+    status, body = request_json("POST", "/generate-audio", {
+        "input_string": "HoP to the bridge, 50% of the crew has 2,500 credits by 12:30, "
+                        "and the supermatter crystal is running hot " + "and getting hotter " * 8,
+        "voice": voice,
+    })
+    if status != 200 or not isinstance(body, bytes) or validate_wav(body):
+        print(f"  FAIL: status {status}: {body if not isinstance(body, bytes) else validate_wav(body)}")
+        return False
+    print(f"  Long sentence with numbers rendered as {len(body)} bytes")
+
+    for text, expected in (
+        ("version 1.2.3 is out", "version one point two point three is out"),
+        ("That's $1.50.", "That's one dollar and fifty cents."),
+        ("$0.05", "five cents"),
+        ("ce n'est pas", "ce n'est pas"),
+        ("The CE and NT", "The chief engineer and Nanotrasen"),
+    ):
+        if normalize_text(text) != expected:
+            print(f"  FAIL: {text!r} normalized to {normalize_text(text)!r}, expected {expected!r}")
+            return False
+
+    status, body = request_json("POST", "/generate-audio", {"input_string": "honk " * 1000, "voice": voice})
+    if status != 400:
+        print(f"  FAIL: expected 400 for oversized input, got {status}")
+        return False
+
+    print("  PASS: normalized and segmented input is valid, oversized input is rejected")
+    return True
+
+
+def test_generate_stream():
+    print("\n=== /generate-audio/stream (Coqui TTS, chunked) ===")
+    voice = next(iter(VOICES))
+    print(f"  Using voice: {voice}")
+
+    started = time.time()
+    req = urllib.request.Request(
+        f"{BASE_URL}/generate-audio/stream",
+        data=json.dumps({
+            "input_string": "Attention, crew. The emergency shuttle has been called, and it will arrive shortly. "
+                            "Please make your way to the departures dock.",
+            "voice": voice,
+        }).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            header = resp.read(44)
+            first_audio = time.time() - started
+            body = resp.read()
+    except urllib.error.HTTPError as e:
+        print(f"  FAIL: status {e.code}")
+        print(f"  {e.read().decode(errors='replace')}")
+        return False
+
+    print(f"  Header after {first_audio:.2f}s, {len(body)} bytes of PCM after {time.time() - started:.2f}s")
+
+    if header[0:4] != b"RIFF" or header[8:12] != b"WAVE" or header[36:40] != b"data":
+        print(f"  FAIL: bad WAV header: {header.hex(' ')}")
+        return False
+    if not body or len(body) % 2:
+        print(f"  FAIL: expected non-empty 16-bit PCM, got {len(body)} bytes")
+        return False
+
+    print("  PASS: streamed WAV is valid")
+    return True
+
+
+def parse_bundle(data: bytes) -> list[tuple[int, str, bytes]]:
+    """Split a /generate-audio/batch response into (status, content_type, payload) items."""
+    if data[0:4] != b"HTB1":
+        raise ValueError(f"Missing bundle magic: got {data[0:4]!r}")
+
+    count = struct.unpack_from("<I", data, 4)[0]
+    pos = 8
+    items = []
+    for _ in range(count):
+        status, type_len = struct.unpack_from("<HH", data, pos)
+        pos += 4
+        content_type = data[pos:pos + type_len].decode("ascii")
+        pos += type_len
+        length = struct.unpack_from("<I", data, pos)[0]
+        pos += 4
+        items.append((status, content_type, data[pos:pos + length]))
+        pos += length
+
+    if pos != len(data):
+        raise ValueError(f"Trailing bytes after bundle: {len(data) - pos}")
+    return items
+
+
+def test_generate_batch():
+    print("\n=== /generate-audio/batch ===")
+    voices = list(VOICES)[:2]
+    items = [
+        {"input_string": "Help!", "voice": voices[0]},
+        {"input_string": "Security to the bridge.", "voice": voices[1]},
+        {"input_string": "Help!", "voice": voices[0]},
+        {"input_string": "Help!", "voice": "Not A Voice"},
+    ]
+    status, body = request_json("POST", "/generate-audio/batch", {"items": items})
+
+    if status != 200 or not isinstance(body, bytes):
+        print(f"  FAIL: status {status}")
+        print(f"  {body}")
+        return False
+
+    try:
+        parts = parse_bundle(body)
+    except (ValueError, struct.error) as e:
+        print(f"  FAIL: malformed bundle: {e}")
+        return False
+
+    if len(parts) != len(items):
+        print(f"  FAIL: expected {len(items)} items, got {len(parts)}")
+        return False
+
+    for i, (item_status, content_type, payload) in enumerate(parts[:3]):
+        issues = validate_wav(payload) if item_status == 200 else [f"status {item_status}: {payload[:200]!r}"]
+        if issues:
+            print(f"  FAIL: item {i} is not a valid WAV:")
+            for issue in issues:
+                print(f"    - {issue}")
+            return False
+
+    if parts[3][0] != 400:
+        print(f"  FAIL: invalid voice item should fail with 400, got {parts[3][0]}")
+        return False
+
+    print(f"  PASS: {len(parts)} items, per-item error reported")
+    return True
+
+
+def test_jobs():
+    print("\n=== /jobs (async submit + long-poll) ===")
+    voice = next(iter(VOICES))
+    status, body = request_json("POST", "/jobs", {
+        "input_string": "All hands, this is your captain speaking.",
+        "voice": voice,
+        "priority": "announcement",
+        "deadline_ms": 60000,
+    })
+    if status != 202 or not isinstance(body, dict) or "job_id" not in body:
+        print(f"  FAIL: submit returned status {status}: {body}")
+        return False
+
+    job_id = body["job_id"]
+    print(f"  Submitted job {job_id} ({body.get('status')})")
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        status, body = request_json("GET", f"/jobs/{job_id}?wait=5")
+        if status != 202:
+            break
+        print(f"  ...{body.get('status') if isinstance(body, dict) else body}")
+
+    if status != 200 or not isinstance(body, bytes):
+        print(f"  FAIL: status {status}: {body}")
+        return False
+
+    issues = validate_wav(body)
+    if issues:
+        print("  FAIL: WAV validation errors:")
+        for issue in issues:
+            print(f"    - {issue}")
+        return False
+
+    status, body = request_json("POST", "/jobs", {"input_string": "Hello.", "voice": voice, "priority": {}})
+    if status != 400:
+        print(f"  FAIL: a non-string priority returned {status}, expected 400")
+        return False
+
+    print("  PASS: job completed with a valid WAV")
+    return True
+
+
+def test_prefetch():
+    print("\n=== /prefetch ===")
+    voice = next(iter(VOICES))
+    line = f"Prefetched announcement {random.randint(0, 10 ** 9)}."
+    status, body = request_json("POST", "/prefetch", {"items": [
+        {"input_string": line, "voice": voice},
+        {"input_string": line + " Cancelled.", "voice": voice},
+    ]})
+    if status != 202 or not isinstance(body, dict):
+        print(f"  FAIL: status {status}: {body}")
+        return False
+    hints = body["hints"]
+    print(f"  Hints: {[hint['status'] for hint in hints]}")
+
+    cancelled = hints[1].get("id")
+    status, _ = request_json("DELETE", f"/prefetch/{cancelled}")
+    if status not in (200, 404):  # 404 if the server was idle enough to start it already
+        print(f"  FAIL: cancel returned {status}")
+        return False
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        _, health = request_json("GET", "/health")
+        stats = health["prefetch"]
+        if stats["queued"] == 0 and stats["running"] == 0:
+            break
+        time.sleep(0.25)
+    hits_before = stats["hits"]
+
+    started = time.time()
+    status, audio = request_json("POST", "/generate-audio", {"input_string": line, "voice": voice})
+    elapsed = time.time() - started
+    _, health = request_json("GET", "/health")
+    print(f"  Hinted line served in {elapsed * 1000:.0f}ms, prefetch stats: {health['prefetch']}")
+    if status != 200 or not isinstance(audio, bytes) or validate_wav(audio):
+        print(f"  FAIL: status {status}")
+        return False
+    if health["prefetch"]["hits"] != hits_before + 1:
+        print("  FAIL: the hinted line was not served from the prefetched entry")
+        return False
+
+    print("  PASS: hinted line was rendered ahead of time")
+    return True
+
+
+def test_engine_routing():
+    print("\n=== /engines ===")
+    voice = next(iter(VOICES))
+    status, body = request_json("PATCH", "/engines", {"routes": {"vits": {"chatter": "robotic"}}})
+    if status != 200 or body.get("routes") != {"vits": {"chatter": "robotic"}}:
+        print(f"  FAIL: status {status}: {body}")
+        return False
+    rerouted = body.get("rerouted", {}).get("vits->robotic", 0)
+
+    try:
+        line = f"Routed chatter {random.randint(0, 10 ** 9)}."
+        status, audio = request_json("POST", "/generate-audio",
+                                     {"input_string": line, "voice": voice, "priority": "chatter"})
+        if status != 200 or not isinstance(audio, bytes) or validate_wav(audio):
+            print(f"  FAIL: routed line returned {status}")
+            return False
+        _, body = request_json("GET", "/engines")
+        if body.get("rerouted", {}).get("vits->robotic", 0) != rerouted + 1:
+            print(f"  FAIL: chatter was not routed to the robotic engine: {body}")
+            return False
+        for name, state in body["engines"].items():
+            print(f"  {name}: cost {state['cost']}, observed RTF {state['observed_rtf']}, "
+                  f"max concurrency {state['max_concurrency']}")
+    finally:
+        request_json("PATCH", "/engines", {"routes": {"vits": {"chatter": None}}})
+
+    status, body = request_json("PATCH", "/engines", {"max_concurrency": {"nope": 1}})
+    if status != 400:
+        print(f"  FAIL: unknown engine accepted ({status})")
+        return False
+    status, body = request_json("POST", "/generate-audio", {"input_string": "Hello.", "voice": voice, "priority": []})
+    if status != 400:
+        print(f"  FAIL: a list priority returned {status}, expected 400")
+        return False
+    status, body = request_json("POST", "/generate-audio/batch", {"items": [
+        {"input_string": "Hello.", "voice": voice}, {"input_string": "Hello.", "voice": voice, "priority": {}}]})
+    parts = parse_bundle(body) if status == 200 and isinstance(body, bytes) else []
+    if [part[0] for part in parts] != [200, 400]:
+        print(f"  FAIL: a batch item with a bad priority was not a per-item 400 ({status})")
+        return False
+    status, body = request_json("PATCH", "/engines", {"routes": {"vits": {"chatter": []}}})
+    if status != 400:
+        print(f"  FAIL: a list route target returned {status}, expected 400")
+        return False
+
+    print("  PASS: chatter was routed to the robotic engine and the route removed")
+    return True
+
+
+def test_router():
+    print("\n=== router ===")
+    port = PORT + 10
+    base_url = f"http://{HOST}:{port}"
+    env = {**os.environ, "HONKTTS_PORT": str(port), "HONKTTS_FAKE_MODEL": "1", "HONKTTS_CACHE_DIR": "",
+           "HONKTTS_ROUTER_CHECK_MS": "250"}
+    proc = subprocess.Popen([sys.executable, find_server_script(), "router", "--spawn", "2"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+
+    def generate(line: str) -> tuple[int, str | None]:
+        body = json.dumps({"input_string": line, "voice": next(iter(VOICES))}).encode()
+        req = urllib.request.Request(f"{base_url}/generate-audio", data=body,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                resp.read()
+                return resp.status, resp.headers.get("X-HonkTTS-Backend")
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                with urllib.request.urlopen(f"{base_url}/health/ready", timeout=2) as resp:
+                    if json.loads(resp.read())["healthy_backends"] == 2:
+                        break
+            except (urllib.error.URLError, OSError):
+                pass
+            if time.time() > deadline or proc.poll() is not None:
+                print("  FAIL: router with two backends did not become ready")
+                return False
+            time.sleep(0.25)
+
+        lines = [f"Routed line number {i}." for i in range(32)]
+        owners = {line: generate(line)[1] for line in lines}
+        if any(generate(line)[1] != owner for line, owner in owners.items()):
+            print("  FAIL: a repeated line went to a different backend")
+            return False
+        if len(set(owners.values())) != 2:
+            print(f"  FAIL: lines were not spread over both backends: {owners}")
+            return False
+
+        # Kill the backend owning the first line; it should move to the sibling.
+        ejected = owners[lines[0]]
+        with urllib.request.urlopen(f"{ejected}/health", timeout=10) as resp:
+            os.kill(json.loads(resp.read())["pid"], signal.SIGTERM)
+        time.sleep(1)
+        status, backend = generate(lines[0])
+        if status != 200 or backend in (None, ejected):
+            print(f"  FAIL: line was not retried on the sibling ({status}, {backend})")
+            return False
+        with urllib.request.urlopen(f"{base_url}/health", timeout=10) as resp:
+            routing = json.loads(resp.read())["routing"]
+        if routing["backends"][ejected]["healthy"]:
+            print(f"  FAIL: dead backend {ejected} is still in the ring")
+            return False
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    print(f"  PASS: lines kept their backend, and moved to {backend} when {ejected} died")
+    return True
+
+
+def read_pipe_frame(sock: socket.socket) -> tuple[int, int, str, bytes]:
+    def read_exact(size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("connection closed mid-frame")
+            data += chunk
+        return data
+
+    length = struct.unpack("<I", read_exact(4))[0]
+    frame = read_exact(length)
+    request_id, status, content_type_length = struct.unpack_from("<IHH", frame)
+    content_type = frame[8:8 + content_type_length].decode("ascii")
+    return request_id, status, content_type, frame[8 + content_type_length:]
+
+
+def test_pipe():
+    print("\n=== Pipelined TCP protocol ===")
+    _, health = request_json("GET", "/health")
+    if not isinstance(health, dict) or health.get("pipe") is None:
+        print("  SKIP: the pipelined protocol is not enabled (HONKTTS_PIPE_PORT)")
+        return True
+    pipe_port = health["pipe"]["port"]
+
+
+    variant_voices = health.get("variant_voices", [])
+    voice = next(iter(VOICES))
+    requests = {
+        1: {"input_string": "Cargo, please send a shuttle.", "voice": voice},
+        2: {"input_string": "Beep boop.", "voice": variant_voices[0] if variant_voices else "", "engine": "robotic"},
+        3: {"input_string": "Nobody home.", "voice": "No Such Voice"},
+        4: {"input_string": "Cargo, please send a shuttle.", "voice": voice, "sample_rate": 16000},
+        5: {"input_string": "Bad priority.", "voice": voice, "priority": []},
+    }
+    expected = {1: 200, 2: 200 if variant_voices else 400, 3: 400, 4: 200, 5: 400}
+
+    try:
+        with socket.create_connection((HOST, pipe_port), timeout=60) as sock:
+            if sock.recv(4) != b"HTP1":
+                print("  FAIL: missing HTP1 greeting")
+                return False
+
+            # Send everything up front; answers come back as each finishes.
+            started = time.time()
+            for request_id, body in requests.items():
+                frame = json.dumps({"id": request_id, **body}).encode()
+                sock.sendall(struct.pack("<I", len(frame)) + frame)
+            answers = {}
+            for _ in requests:
+                request_id, status, content_type, payload = read_pipe_frame(sock)
+                answers[request_id] = (status, content_type, payload)
+                print(f"  id {request_id}: {status} {content_type}, {len(payload)} bytes "
+                      f"after {time.time() - started:.2f}s")
+    except OSError as e:
+        print(f"  FAIL: {e}")
+        return False
+
+    for request_id, status in expected.items():
+        if request_id not in answers or answers[request_id][0] != status:
+            print(f"  FAIL: id {request_id}: expected {status}, got {answers.get(request_id, (None,))[0]}")
+            return False
+    for request_id in (1, 4):
+        issues = validate_wav(answers[request_id][2])
+        if issues:
+            print(f"  FAIL: id {request_id}: {issues}")
+            return False
+
+    # Every answered request gave its slot back, so the connection winds down.
+    deadline = time.time() + 10
+    while request_json("GET", "/health")[1]["pipe"]["open_connections"]:
+        if time.time() > deadline:
+            print("  FAIL: the pipe connection was never closed on the server side")
+            return False
+        time.sleep(0.1)
+
+    print("  PASS: pipelined requests were answered by id")
+    return True
+
+
 def test_generate_robotic(play: bool, keep: bool):
     print("\n=== /generate_audio_robotic (eSpeak) ===")
 
@@ -341,7 +874,8 @@ def test_generate_robotic(play: bool, keep: bool):
     voice = variant_voices[0]
     print(f"  Using variant voice: {voice}")
     status, body = request_json("POST", "/generate_audio_robotic", {
-        "input_string": "I'm sorry, Dave. I'm afraid I can't do that. I think you know what the problem is just as well as I do.",
+        "input_string": "I'm sorry, Dave. I'm afraid I can't do that. "
+                        "I think you know what the problem is just as well as I do.",
         "voice": voice,
     })
 
@@ -377,27 +911,357 @@ def test_generate_robotic(play: bool, keep: bool):
 
 
 
+# Lines in the style of in-game announcements, radio chatter and emotes.
+BENCHMARK_CORPUS = [
+    "Attention: the emergency shuttle has been called. It will arrive in ten minutes.",
+    "Security, report to the bridge immediately.",
+    "Help! Medbay, someone's been stabbed in the maintenance tunnels!",
+    "Engineering to command, the singularity containment field is failing.",
+    "Clown's on the loose again. Somebody grab him.",
+    "Cargo, where's my order of forty crates of bananas?",
+    "I need a doctor in the bar, now.",
+    "Captain, the nuclear authentication disk is missing from your office.",
+    "All crew, evacuate the station. This is not a drill.",
+    "Hello?",
+    "Can anyone hear me? My suit sensors are broken and I'm floating near the solars.",
+    "Atmospherics reports a plasma leak in the northern hallway.",
+    "Who keeps stealing the insulated gloves from the tool storage?",
+    "The janitor has slipped on his own wet floor sign. Again.",
+    "Research has finished the bluespace crystals. Come pick them up.",
+    "Stop right there, criminal scum!",
+    "Chef, the kitchen is on fire.",
+    "AI, open the door to the armory, please.",
+    "Warning. Hull breach detected in the arrivals wing. Seal the area.",
+    "I'm a mime. I'm not supposed to be talking.",
+    "Botany has grown something that is definitely not a tomato.",
+    "The station has entered a radiation storm. Seek shelter in the maintenance tunnels.",
+    "Mining team heading down to lavaland, wish us luck.",
+    "Who ordered a pizza to the brig?",
+    "Ok.",
+    "Medical emergency in the chapel. The chaplain fainted during the sermon.",
+    "Command staff, meeting in the conference room in five minutes.",
+    "The supermatter crystal is at ninety percent integrity and dropping.",
+    "Quartermaster, we have a shipment of unknown origin at the docking bay.",
+    "Thank you for flying with Nanotrasen. Please remain seated until the shuttle has docked.",
+]
+
+
+def load_corpus(path: str | None) -> list[str]:
+    if not path:
+        return BENCHMARK_CORPUS
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if not lines:
+        print(f"  ERROR: corpus {path} is empty")
+        sys.exit(1)
+    return lines
+
+
+def wav_seconds(data: bytes) -> float:
+    """Duration of a PCM WAV, 0.0 if it can't be parsed."""
+    pos = 12
+    sample_rate = channels = bits_per_sample = 0
+    while pos < len(data) - 8:
+        chunk_id = data[pos:pos + 4]
+        chunk_size = struct.unpack_from("<I", data, pos + 4)[0]
+        if chunk_id == b"fmt ":
+            channels = struct.unpack_from("<H", data, pos + 10)[0]
+            sample_rate = struct.unpack_from("<I", data, pos + 12)[0]
+            bits_per_sample = struct.unpack_from("<H", data, pos + 22)[0]
+        if chunk_id == b"data" and sample_rate and channels and bits_per_sample:
+            return chunk_size / (sample_rate * channels * (bits_per_sample // 8))
+        pos += 8 + chunk_size
+    return 0.0
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Linearly interpolated percentile of an unsorted list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def read_peak_rss(pids: list[int]) -> int | None:
+    """Sum of the peak resident set size (VmHWM) of the given processes, in bytes."""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            return None  # not Linux, or not our machine
+    return total
+
+
+def read_metric_totals(names: tuple[str, ...]) -> dict[str, float]:
+    """Sum every series of the named counters from /metrics."""
+    totals = {name: 0.0 for name in names}
+    try:
+        with urllib.request.urlopen(f"{BASE_URL}/metrics", timeout=10) as resp:
+            text = resp.read().decode()
+    except Exception:
+        return totals
+
+    for line in text.splitlines():
+        name = line.split("{", 1)[0].split(" ", 1)[0]
+        if name in totals:
+            totals[name] += float(line.rsplit(" ", 1)[1])
+    return totals
+
+
+def cache_delta(before: dict, after: dict) -> tuple[int, int]:
+    """(hits, misses) a cache's /health stats gained between two snapshots."""
+    hits = sum(after.get(key, 0) - before.get(key, 0) for key in ("hits", "disk_hits"))
+    return hits, after.get("misses", 0) - before.get("misses", 0)
+
+
+def benchmark_request(engine: str, voice: str, text: str) -> dict:
+    path = "/generate_audio_robotic" if engine == "robotic" else "/generate-audio"
+    body = json.dumps({"input_string": text, "voice": voice}).encode()
+    req = urllib.request.Request(f"{BASE_URL}{path}", data=body,
+                                 headers={"Content-Type": "application/json"}, method="POST")
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            data = resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        data, status = e.read(), e.code
+    except Exception as e:
+        data, status = str(e).encode(), 0
+    latency = time.perf_counter() - started
+
+    ok = status == 200
+    return {
+        "engine": engine,
+        "status": status,
+        "latency": latency,
+        "chars": len(text),
+        "audio_seconds": wav_seconds(data) if ok else 0.0,
+    }
+
+
+def summarize_samples(samples: list[dict], wall: float) -> dict:
+    ok = [sample for sample in samples if sample["status"] == 200]
+    latencies = [sample["latency"] for sample in ok]
+    rtfs = [sample["latency"] / sample["audio_seconds"] for sample in ok if sample["audio_seconds"] > 0]
+    audio = sum(sample["audio_seconds"] for sample in ok)
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "throughput_rps": round(len(ok) / wall, 3) if wall else 0.0,
+        "audio_seconds_per_second": round(audio / wall, 3) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 2),
+        "rtf_p50": round(percentile(rtfs, 50), 4),
+    }
+
+
+def run_benchmark(args) -> dict:
+    print("\n=== Benchmark ===")
+    _, health = request_json("GET", "/health")
+    if not isinstance(health, dict):
+        print("  FAIL: could not query /health")
+        sys.exit(1)
+
+    engines = [engine.strip() for engine in args.engines.split(",") if engine.strip()]
+    voices = {"vits": list(VOICES), "robotic": sorted(health.get("variant_voices", []))}
+    for engine in engines:
+        if engine not in voices:
+            print(f"  ERROR: unknown engine {engine!r} (expected vits or robotic)")
+            sys.exit(1)
+        if not voices[engine]:
+            print(f"  ERROR: server reports no voices for {engine}")
+            sys.exit(1)
+
+    corpus = load_corpus(args.corpus)
+    rng = random.Random(args.seed)
+    plan = [
+        (engine, rng.choice(voices[engine]), rng.choice(corpus))
+        for engine in (engines[i % len(engines)] for i in range(args.warmup + args.requests))
+    ]
+
+    print(f"  Model: {health.get('tts_model')}, engines: {', '.join(engines)}, "
+          f"concurrency: {args.concurrency}, requests: {args.requests} (+{args.warmup} warmup)")
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda item: benchmark_request(*item), plan[:args.warmup]))
+
+        counters = ("honktts_synthesis_seconds_total", "honktts_output_audio_seconds_total")
+        health_before = request_json("GET", "/health")[1]
+        metrics_before = read_metric_totals(counters)
+        started = time.perf_counter()
+        samples = list(pool.map(lambda item: benchmark_request(*item), plan[args.warmup:]))
+        wall = time.perf_counter() - started
+
+    _, health = request_json("GET", "/health")
+    metrics_after = read_metric_totals(counters)
+    pids = [health["pid"]] if "pid" in health else []
+    pids += [worker["pid"] for worker in health.get("workers", []) if worker.get("pid")]
+
+    synthesis = metrics_after[counters[0]] - metrics_before[counters[0]]
+    audio = metrics_after[counters[1]] - metrics_before[counters[1]]
+    hits, misses = cache_delta(health_before.get("cache", {}), health.get("cache", {}))
+    segment_hits, segment_misses = cache_delta(health_before.get("segment_cache", {}), health.get("segment_cache", {}))
+    peak_rss = read_peak_rss(pids) if pids else None
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "tts_model": health.get("tts_model"),
+            "engines": engines,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "corpus_lines": len(corpus),
+            "seed": args.seed,
+            "cache": not args.no_cache,
+        },
+        "wall_seconds": round(wall, 3),
+        "overall": summarize_samples(samples, wall),
+        "by_engine": {
+            engine: summarize_samples([sample for sample in samples if sample["engine"] == engine], wall)
+            for engine in engines
+        },
+        "server": {
+            "rtf": round(synthesis / audio, 4) if audio else None,
+            "cache_hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None,
+            "segment_cache_hit_ratio": (round(segment_hits / (segment_hits + segment_misses), 3)
+                                        if segment_hits + segment_misses else None),
+            "peak_rss_mb": round(peak_rss / (1024 * 1024), 1) if peak_rss else None,
+        },
+    }
+
+    print(f"\n  {'':10} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'RTF p50':>8} {'errors':>7}")
+    for name, row in [("overall", results["overall"])] + list(results["by_engine"].items()):
+        print(f"  {name:10} {row['throughput_rps']:>8} {row['p50_ms']:>9} {row['p95_ms']:>9} "
+              f"{row['p99_ms']:>9} {row['rtf_p50']:>8} {row['errors']:>7}")
+    server = results["server"]
+    print(f"\n  Server RTF (synthesis/audio): {server['rtf']}, "
+          f"cache hit ratio: {server['cache_hit_ratio']} (segments: {server['segment_cache_hit_ratio']}), "
+          f"peak RSS: {server['peak_rss_mb']} MB")
+    return results
+
+
+COMPARED_METRICS = [
+    ("overall", "throughput_rps", True),
+    ("overall", "p50_ms", False),
+    ("overall", "p95_ms", False),
+    ("overall", "p99_ms", False),
+    ("overall", "rtf_p50", False),
+    ("server", "rtf", False),
+    ("server", "peak_rss_mb", False),
+]
+
+
+def result_value(results: dict, section: str, key: str):
+    value = results
+    for part in section.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value.get(key) if isinstance(value, dict) else None
+
+
+def compare_results(current: dict, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    print(f"\n=== Compared with {baseline_path} ({baseline.get('timestamp', '?')}) ===")
+    rows = list(COMPARED_METRICS)
+    rows += [(f"by_engine.{engine}", "p95_ms", False) for engine in current.get("by_engine", {})]
+
+    for section, key, higher_is_better in rows:
+        old, new = result_value(baseline, section, key), result_value(current, section, key)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        if abs(change) < 1:
+            verdict = "same"
+        else:
+            verdict = "better" if (change > 0) == higher_is_better else "worse"
+        print(f"  {section + '.' + key:28} {old:>10} -> {new:<10} ({change:+.1f}%, {verdict})")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Test HonkTTS server")
     parser.add_argument("--play", action="store_true", help="Open generated WAV files in default player")
     parser.add_argument("--keep", action="store_true", help="Save generated WAV files to temp dir")
-    parser.add_argument("--no-start", action="store_true", help="Don't manage the server — test an already-running one")
+    parser.add_argument("--no-start", action="store_true",
+                        help="Don't manage the server — test an already-running one")
     parser.add_argument("--fail-warnings", action="store_true",
                         help="Treat health warnings as failures (useful for CI)")
+
+    bench = parser.add_argument_group("benchmark")
+    bench.add_argument("--benchmark", action="store_true", help="Run the load benchmark instead of the tests")
+    bench.add_argument("--fake-model", action="store_true",
+                       help="Start the server with HONKTTS_FAKE_MODEL (no VITS weights needed)")
+    bench.add_argument("--concurrency", type=int, default=8, help="Concurrent clients (default: 8)")
+    bench.add_argument("--requests", type=int, default=200, help="Measured requests (default: 200)")
+    bench.add_argument("--warmup", type=int, default=8, help="Unmeasured warmup requests (default: 8)")
+    bench.add_argument("--engines", default="vits,robotic", help="Comma-separated engines (default: vits,robotic)")
+    bench.add_argument("--corpus", help="Text file with one line per request (default: built-in game lines)")
+    bench.add_argument("--seed", type=int, default=1, help="Seed for picking lines and voices (default: 1)")
+    bench.add_argument("--no-cache", action="store_true", help="Start the server with the synthesis caches disabled")
+    bench.add_argument("--output", help="Write results as JSON to this file")
+    bench.add_argument("--compare", help="Compare results against a previous --output file")
     args = parser.parse_args()
 
-    print(f"Testing HonkTTS server at {BASE_URL}")
+    print(f"{'Benchmarking' if args.benchmark else 'Testing'} HonkTTS server at {BASE_URL}")
+
+    server_env = {"HONKTTS_PIPE_PORT": str(TEST_PIPE_PORT)}
+    if args.fake_model:
+        server_env.update({"HONKTTS_FAKE_MODEL": "1", "HONKTTS_CACHE_DIR": ""})
+    if args.no_cache:
+        server_env.update({"HONKTTS_CACHE_MAX_BYTES": "0", "HONKTTS_CACHE_DIR": "",
+                           "HONKTTS_SEGMENT_CACHE_MAX_BYTES": "0", "HONKTTS_PHONEME_CACHE_ENTRIES": "0"})
 
     server_proc = None
     if not args.no_start:
         kill_existing_server()
-        server_proc = start_server()
+        server_proc = start_server(server_env)
+    elif args.fake_model or args.no_cache:
+        print("  NOTE: --fake-model/--no-cache only apply to a server started by this script")
+
+    if args.benchmark:
+        try:
+            results = run_benchmark(args)
+        finally:
+            if server_proc is not None:
+                stop_server(server_proc)
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print(f"\n  Results written to {args.output}")
+        if args.compare:
+            compare_results(results, args.compare)
+        sys.exit(0 if results["overall"]["errors"] == 0 else 1)
 
     try:
         results = {}
         results["health"] = test_health(args.fail_warnings)
+        results["readiness"] = test_readiness()
+        results["health_static"] = test_health_static()
         results["generate_audio"] = test_generate_audio(args.play, args.keep or args.play)
+        results["postprocess_options"] = test_postprocess_options()
+        results["text_front_end"] = test_text_front_end()
+        results["generate_stream"] = test_generate_stream()
+        results["generate_batch"] = test_generate_batch()
+        results["jobs"] = test_jobs()
         results["generate_robotic"] = test_generate_robotic(args.play, args.keep or args.play)
+        results["prefetch"] = test_prefetch()
+        results["engine_routing"] = test_engine_routing()
+        results["pipe"] = test_pipe()
+        if server_proc is not None:
+            results["router"] = test_router()
     finally:
         if server_proc is not None:
             stop_server(server_proc)
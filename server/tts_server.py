@@ -1,19 +1,52 @@
+import argparse
+import bisect
+import ctypes
+import ctypes.util
+import gc
+import hashlib
+import heapq
+import http.client
 import io
+import json
+import math
+import mmap
+import multiprocessing
 import os
+import queue
 import re
 import shutil
+import signal
+import socket
 import struct
 import subprocess
 import sys
+import tempfile
+import threading
 import time
-from dataclasses import dataclass
-from typing import Any
+import urllib.parse
+import uuid
+import warnings
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from fractions import Fraction
+from typing import TYPE_CHECKING, Any, Callable, Collection
 
 import numpy as np
-from flask import Flask, jsonify, request, send_file
-from scipy.io.wavfile import write as write_wav
-from TTS.api import TTS
-from waitress import serve
+from flask import Flask, Response, jsonify, request
+from waitress import create_server
+
+# torch, scipy and TTS are imported where they are first used: TTS.api alone
+# takes seconds to import, and test_server.py imports this module for its
+# constants.
+if TYPE_CHECKING:
+    from TTS.api import TTS
+
+try:
+    import soundfile
+except ImportError:  # only needed for FLAC/Opus output
+    soundfile = None
 
 app = Flask(__name__)
 
@@ -86,13 +119,301 @@ VOICES: dict[str, str] = {
 }
 
 
+# Output formats and the MIME type each is served as.
+AUDIO_FORMATS: dict[str, str] = {
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "opus": "audio/ogg",
+}
+
+ACCEPT_FORMATS: dict[str, str] = {
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/wave": "wav",
+    "audio/flac": "flac",
+    "audio/x-flac": "flac",
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+}
+
+# libopus only runs at these rates; others are rejected for "opus".
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+OPUS_DEFAULT_SAMPLE_RATE = 24000
+
+# Gain applied before 16-bit conversion: "peak" scales the loudest sample to
+# full scale, "loudness" scales the RMS level to LOUDNESS_TARGET_DBFS (never
+# past full-scale peaks).
+NORMALIZE_MODES = ("peak", "loudness")
+LOUDNESS_TARGET_DBFS = -20.0
+
+# Silence trimming: samples quieter than this relative to the peak count as
+# silence, and this much of it is kept around the speech.
+TRIM_SILENCE_DB = -40.0
+TRIM_PAD_MS = 20
+
+# Server-side voice effects, applied in request order. Parameterized effects
+# are written "name:value" and take a value in the given range; "speed" is a
+# time-stretch factor and "pitch" a shift in semitones.
+EFFECT_RANGES: dict[str, tuple[float, float] | None] = {
+    "radio": None,
+    "robot": None,
+    "speed": (0.5, 2.0),
+    "pitch": (-12.0, 12.0),
+}
+MAX_EFFECTS = 4
+
+# Request priorities, used by the job queue and engine routes. Lower value =
+# served first.
+PRIORITIES: dict[str, int] = {
+    "announcement": 0,
+    "normal": 1,
+    "chatter": 2,
+}
+
+
+def parse_priority(value: Any) -> str:
+    if not isinstance(value, str) or value not in PRIORITIES:
+        raise ValueError(f"priority must be one of: {list(PRIORITIES)}")
+    return value
+
+
 @dataclass(frozen=True)
 class AudioRequest:
     input_string: str
     voice: str
+    format: str = "wav"
+    sample_rate: int | None = None
+    normalize: str = "peak"
+    trim_silence: bool = False
+    effects: tuple[str, ...] = ()
+    priority: str = "normal"
+    # "fast" is set by the overload controller, never by clients.
+    quality: str = "full"
+
+    @property
+    def processing(self) -> tuple[str, ...]:
+        # Post-processing options that change the rendered WAV itself.
+        if self.normalize == "peak" and not self.trim_silence and not self.effects and self.quality == "full":
+            return ()
+        return (self.normalize, "trim" if self.trim_silence else "", *self.effects,
+                *((self.quality,) if self.quality != "full" else ()))
+
+    @property
+    def encoding(self) -> tuple[str, ...]:
+        # Encoding options applied on top of the rendered WAV.
+        if self.format == "wav" and self.sample_rate is None:
+            return ()
+        return (self.format, str(self.sample_rate or ""))
+
+    @property
+    def variant(self) -> tuple[str, ...]:
+        # Everything that makes the bytes differ from the canonical WAV.
+        return self.processing + self.encoding
+
+
+# Text normalization: spoken forms for abbreviations and station jargon,
+# matched as whole words regardless of case. Titles also swallow their
+# trailing period so it is not taken for the end of a sentence.
+TITLE_ABBREVIATIONS: dict[str, str] = {
+    "mr": "mister",
+    "mrs": "missus",
+    "dr": "doctor",
+    "capt": "captain",
+    "cpt": "captain",
+    "sgt": "sergeant",
+    "lt": "lieutenant",
+    "prof": "professor",
+}
+
+ABBREVIATIONS: dict[str, str] = {
+    "approx": "approximately",
+    "etc": "et cetera",
+    "vs": "versus",
+    "pls": "please",
+    "plz": "please",
+    "thx": "thanks",
+    "brb": "be right back",
+    "afk": "away from keyboard",
+    "idk": "I don't know",
+    "omg": "oh my god",
+    "asap": "as soon as possible",
+    "hos": "head of security",
+    "hop": "head of personnel",
+    "cmo": "chief medical officer",
+    "rd": "research director",
+    "ce": "chief engineer",
+    "qm": "quartermaster",
+    "nt": "Nanotrasen",
+    "ai": "ay eye",
+    "pda": "pee dee ay",
+    "eva": "ee vee ay",
+    "sm": "supermatter",
+    "syndi": "syndicate",
+    "syndie": "syndicate",
+    "ling": "changeling",
+    "engi": "engineer",
+    "sci": "science",
+}
+
+# Station acronyms that are also everyday words (or words in other
+# languages), only expanded when written with capitals after the first
+# letter, as they are in-game: "HoP", "CE", "EVA", but not "hop on",
+# "ce n'est pas" or "Eva".
+STATION_ACRONYMS = {"hos", "hop", "cmo", "rd", "ce", "qm", "nt", "ai", "pda", "eva", "sm", "ling"}
+
+NUMBER_ONES = (
+    "zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+    "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen",
+)
+NUMBER_TENS = ("", "", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety")
+NUMBER_SCALES = ((10 ** 12, "trillion"), (10 ** 9, "billion"), (10 ** 6, "million"), (1000, "thousand"))
+ORDINAL_WORDS = {"one": "first", "two": "second", "three": "third", "five": "fifth", "eight": "eighth",
+                 "nine": "ninth", "twelve": "twelfth"}
+
+TITLE_PATTERN = re.compile(rf"\b({'|'.join(TITLE_ABBREVIATIONS)})\b\.?", re.IGNORECASE)
+ABBREVIATION_PATTERN = re.compile(rf"\b({'|'.join(ABBREVIATIONS)})\b", re.IGNORECASE)
+
+
+def expand_abbreviation(match: re.Match) -> str:
+    word = match.group(1)
+    if word.lower() in STATION_ACRONYMS and word[1:].islower():
+        return word
+    return ABBREVIATIONS[word.lower()]
+
+
+def number_to_words(n: int) -> str:
+    if n < 0:
+        return f"minus {number_to_words(-n)}"
+    if n < 20:
+        return NUMBER_ONES[n]
+    if n < 100:
+        tens, ones = divmod(n, 10)
+        return NUMBER_TENS[tens] + (f" {NUMBER_ONES[ones]}" if ones else "")
+    if n < 1000:
+        hundreds, rest = divmod(n, 100)
+        return f"{NUMBER_ONES[hundreds]} hundred" + (f" {number_to_words(rest)}" if rest else "")
+    if n >= 1000 * NUMBER_SCALES[0][0]:
+        # Serial numbers and the like are read out digit by digit.
+        return " ".join(NUMBER_ONES[int(digit)] for digit in str(n))
+
+    words = []
+    for scale, name in NUMBER_SCALES:
+        count, n = divmod(n, scale)
+        if count:
+            words.append(f"{number_to_words(count)} {name}")
+    if n:
+        words.append(number_to_words(n))
+    return " ".join(words)
 
 
-def parse_audio_request(payload: Any) -> AudioRequest:
+def decimal_to_words(number: str) -> str:
+    whole, _, fraction = number.partition(".")
+    words = number_to_words(int(whole))
+    if fraction:
+        words += " point " + " ".join(NUMBER_ONES[int(digit)] for digit in fraction)
+    return words
+
+
+def dotted_number_to_words(number: str) -> str:
+    # Versions and addresses ("1.2.3") are one token, not a decimal and a
+    # sentence end.
+    return " point ".join(number_to_words(int(part)) for part in number.split("."))
+
+
+def currency_to_words(amount: str) -> str:
+    dollars, _, cents = amount.partition(".")
+    if len(cents) > 2:
+        return f"{decimal_to_words(amount)} dollars"
+    dollars, cents = int(dollars), int(cents.ljust(2, "0")) if cents else 0
+    words = []
+    if dollars or not cents:
+        words.append(f"{number_to_words(dollars)} {'dollar' if dollars == 1 else 'dollars'}")
+    if cents:
+        words.append(f"{number_to_words(cents)} {'cent' if cents == 1 else 'cents'}")
+    return " and ".join(words)
+
+
+def ordinal_to_words(n: int) -> str:
+    words = number_to_words(n).split(" ")
+    last = words[-1]
+    if last in ORDINAL_WORDS:
+        words[-1] = ORDINAL_WORDS[last]
+    elif last.endswith("y"):
+        words[-1] = last[:-1] + "ieth"
+    else:
+        words[-1] = last + "th"
+    return " ".join(words)
+
+
+def time_to_words(hours: int, minutes: int) -> str:
+    if minutes == 0:
+        return f"{number_to_words(hours)} o'clock" if hours <= 12 else f"{number_to_words(hours)} hundred"
+    if minutes < 10:
+        return f"{number_to_words(hours)} oh {number_to_words(minutes)}"
+    return f"{number_to_words(hours)} {number_to_words(minutes)}"
+
+
+def normalize_text(text: str) -> str:
+    """Rewrite numbers, symbols, abbreviations and jargon as spoken words.
+
+    Runs before the character filter in ``parse_audio_request``, which would
+    otherwise drop symbols like ``%`` and glue hyphenated words together.
+    """
+    text = TITLE_PATTERN.sub(lambda m: TITLE_ABBREVIATIONS[m.group(1).lower()], text)
+    text = ABBREVIATION_PATTERN.sub(expand_abbreviation, text)
+
+    text = re.sub(r"(?<=\d),(?=\d{3}\b)", "", text)
+    text = re.sub(r"\b(\d{1,2}):(\d{2})\b",
+                  lambda m: time_to_words(int(m.group(1)), int(m.group(2))), text)
+    text = re.sub(r"\b\d+(?:\.\d+){2,}\b", lambda m: f" {dotted_number_to_words(m.group(0))} ", text)
+    text = re.sub(r"\$(\d+(?:\.\d+)?)", lambda m: f" {currency_to_words(m.group(1))} ", text)
+    text = re.sub(r"(\d)\s*%", r"\1 percent", text)
+    text = re.sub(r"\b(\d+)\s*-\s*(\d+)\b", r"\1 to \2", text)
+    text = re.sub(r"\b(\d+)(?:st|nd|rd|th)\b", lambda m: ordinal_to_words(int(m.group(1))), text, flags=re.IGNORECASE)
+    text = re.sub(r"#(?=\d)", "number ", text)
+    text = re.sub(r"(?<![\w.])-(?=\d)", "minus ", text)
+    text = re.sub(r"\d+(?:\.\d+)?", lambda m: f" {decimal_to_words(m.group(0))} ", text)
+
+    text = text.replace("&", " and ").replace("+", " plus ").replace("=", " equals ")
+    text = re.sub(r"[-/_]+", " ", text)
+    text = re.sub(r"\s+([,.;:!?])", r"\1", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def parse_effects(value: Any) -> tuple[str, ...]:
+    """Validate an ``effects`` list and return it in canonical form."""
+    if not isinstance(value, list) or len(value) > MAX_EFFECTS:
+        raise ValueError(f"effects must be a list of at most {MAX_EFFECTS} effects.")
+
+    effects = []
+    for effect in value:
+        name, sep, raw = effect.partition(":") if isinstance(effect, str) else ("", "", "")
+        if name not in EFFECT_RANGES:
+            raise ValueError(f"Unknown effect {effect!r}. Valid effects are: {list(EFFECT_RANGES)}")
+
+        bounds = EFFECT_RANGES[name]
+        if bounds is None:
+            if sep:
+                raise ValueError(f"Effect {name!r} takes no value.")
+            effects.append(name)
+            continue
+
+        try:
+            amount = float(raw)
+        except ValueError:
+            amount = math.nan
+        if not bounds[0] <= amount <= bounds[1]:
+            raise ValueError(f"Effect {name!r} needs a value between {bounds[0]:g} and {bounds[1]:g}, "
+                             f"written as \"{name}:<value>\".")
+        effects.append(f"{name}:{amount:g}")
+    return tuple(effects)
+
+
+def negotiate_format(accept) -> str:
+    return ACCEPT_FORMATS.get(accept.best_match(list(ACCEPT_FORMATS)) or "", "wav")
+
+
+def parse_audio_request(payload: Any, default_format: str = "wav") -> AudioRequest:
     if not isinstance(payload, dict):
         raise ValueError("Request body must be a JSON object.")
 
@@ -104,11 +425,47 @@ def parse_audio_request(payload: Any) -> AudioRequest:
     if not isinstance(voice, str) or not voice.strip():
         raise ValueError("voice cannot be empty.")
 
-    sanitized_input = re.sub(r"[^a-zA-Z0-9?!,.;@'\" ]", "", input_string)
+    sanitized_input = re.sub(r"[^a-zA-Z0-9?!,.;@'\" ]", "", normalize_text(input_string)).strip()
     if not sanitized_input:
         raise ValueError("input_string cannot be empty.")
+    if len(sanitized_input) > MAX_INPUT_CHARS:
+        raise ValueError(f"input_string is too long ({len(sanitized_input)} characters after normalization, "
+                         f"at most {MAX_INPUT_CHARS}).")
+
+    audio_format = payload.get("format", default_format)
+    if not isinstance(audio_format, str) or audio_format.lower() not in AUDIO_FORMATS:
+        raise ValueError(f"format must be one of: {list(AUDIO_FORMATS)}")
+    audio_format = audio_format.lower()
 
-    return AudioRequest(input_string=sanitized_input, voice=voice.strip())
+    sample_rate = payload.get("sample_rate")
+    if sample_rate is not None:
+        if isinstance(sample_rate, bool) or not isinstance(sample_rate, int) or not 8000 <= sample_rate <= 48000:
+            raise ValueError("sample_rate must be an integer between 8000 and 48000.")
+        if audio_format == "opus" and sample_rate not in OPUS_SAMPLE_RATES:
+            raise ValueError(f"opus sample_rate must be one of: {list(OPUS_SAMPLE_RATES)}")
+
+    normalize = payload.get("normalize", "peak")
+    if normalize not in NORMALIZE_MODES:
+        raise ValueError(f"normalize must be one of: {list(NORMALIZE_MODES)}")
+
+    trim_silence = payload.get("trim_silence", False)
+    if not isinstance(trim_silence, bool):
+        raise ValueError("trim_silence must be a boolean.")
+
+    effects = parse_effects(payload.get("effects", []))
+
+    priority = parse_priority(payload.get("priority", "normal"))
+
+    return AudioRequest(
+        input_string=sanitized_input,
+        voice=voice.strip(),
+        format=audio_format,
+        sample_rate=sample_rate,
+        normalize=normalize,
+        trim_silence=trim_silence,
+        effects=effects,
+        priority=priority,
+    )
 
 
 def get_espeak_binary() -> str:
@@ -140,136 +497,4218 @@ def load_variant_voices(espeak_bin: str) -> set[str]:
     return voices
 
 
-def generate_wav(text: str, voice: str) -> io.BytesIO:
-    code = VOICES[voice]
-    wav = tts.tts(text=text, speaker=code)
-    sample_rate = int(tts.synthesizer.output_sample_rate)
+def cache_key(endpoint: str, model: str, voice: str, text: str, *variant: str) -> str:
+    raw = "\0".join((endpoint, model, voice, text, *variant))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
-    wav = np.array(wav)
-    wav_norm = (wav * 32767 / max(0.01, np.max(np.abs(wav)))).astype(np.int16)
 
-    wav_io = io.BytesIO()
-    write_wav(wav_io, sample_rate, wav_norm)
-    wav_io.seek(0)
-    return wav_io
+class SynthesisCache:
+    """Two-tier cache of rendered WAV bytes keyed by ``cache_key``.
 
+    The memory tier is an LRU bounded by total payload bytes. The optional
+    disk tier stores one file per key and survives restarts; disk hits are
+    promoted back into memory. It is bounded by ``disk_max_bytes`` (0 = no
+    limit): once over budget, the least recently used files (by mtime, which
+    a hit refreshes) are deleted until it is back under 90% of the budget.
+    """
 
-def generate_robotic_wav(text: str, voice: str) -> io.BytesIO:
-    # Write to a temp file instead of --stdout to avoid Windows pipe
-    # binary/text mode corruption of PCM data.
-    import tempfile as _tempfile
+    DISK_PRUNE_TO = 0.9
 
-    with _tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-        tmp_path = tmp.name
+    def __init__(self, max_bytes: int, disk_dir: str | None = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: OrderedDict[str, bytes | memoryview] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.disk_bytes = 0
+        self._prune_lock = threading.Lock()
 
-    try:
-        proc = subprocess.run(
-            [ESPEAK_BINARY, "-v", f"en+{voice}", "-w", tmp_path, text],
-            check=False,
-            capture_output=True,
-        )
-        if proc.returncode != 0:
-            stderr = proc.stderr.decode(errors="replace").strip()
-            raise RuntimeError(stderr or "espeak failed to generate audio")
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self.disk_bytes = sum(size for _, _, size in self._disk_files())
 
-        with open(tmp_path, "rb") as f:
-            wav_io = io.BytesIO(f.read())
-        wav_io.seek(0)
-        return wav_io
-    finally:
+    def _disk_path(self, key: str) -> str:
+        assert self.disk_dir is not None
+        return os.path.join(self.disk_dir, key[:2], f"{key}.wav")
+
+    def get(self, key: str, count: bool = True) -> bytes | memoryview | None:
+        """Return the cached bytes for ``key`` or None.
+
+        ``count=False`` leaves the hit/miss stats alone, for checks whose
+        outcome is counted by a later lookup of the same key.
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += count
+                return data
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                # Mark the entry as recently used for pruning.
+                os.utime(path)
+            except OSError:
+                data = None
+            if data is not None:
+                with self._lock:
+                    self.disk_hits += count
+                self._insert(key, data)
+                return data
+
+        with self._lock:
+            self.misses += count
+        return None
+
+    def put(self, key: str, data: bytes | memoryview):
+        self._insert(key, data)
+        if self.disk_dir:
+            self._write_disk(key, data)
+
+    def _insert(self, key: str, data: bytes | memoryview):
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = data
+            self._bytes += len(data)
+
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def _write_disk(self, key: str, data: bytes | memoryview):
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+
+        # Write to a sibling temp file and rename so a crash or a concurrent
+        # reader never sees a truncated entry.
         try:
-            os.unlink(tmp_path)
-        except OSError:
-            pass
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to write cache entry {key}: {e}")
+            return
 
+        with self._lock:
+            self.disk_bytes += len(data)
+            over = self.disk_max_bytes and self.disk_bytes > self.disk_max_bytes
+        if over:
+            self._prune_disk()
 
-@app.route("/generate-audio", methods=["POST"])
-def generate_audio():
-    start_time = time.time()
+    def _disk_files(self) -> list[tuple[float, str, int]]:
+        # (mtime, path, size) of every finished entry.
+        files = []
+        for directory in os.scandir(self.disk_dir):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.endswith(".wav"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # removed meanwhile
+                    files.append((stat.st_mtime, entry.path, stat.st_size))
+        return files
+
+    def _prune_disk(self):
+        # One pruner at a time; other writers carry on. The directory is
+        # rescanned, so entries written by other processes sharing it count.
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            files = sorted(self._disk_files())
+            total = sum(size for _, _, size in files)
+            target = self.disk_max_bytes * self.DISK_PRUNE_TO
+            removed = 0
+            for _, path, size in files:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"Failed to prune cache entry {path}: {e}")
+                    continue
+                total -= size
+                removed += 1
+            with self._lock:
+                self.disk_bytes = total
+                self.disk_evictions += removed
+        finally:
+            self._prune_lock.release()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_dir": self.disk_dir,
+                "disk_bytes": self.disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes,
+                "disk_evictions": self.disk_evictions,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def audio_response(data: bytes | memoryview, audio_format: str, download_name: str) -> Response:
+    extension = "ogg" if audio_format == "opus" else audio_format
+    headers = {"Content-Disposition": f"attachment; filename={download_name}.{extension}"}
+    mimetype = AUDIO_FORMATS[audio_format]
+    if isinstance(data, memoryview):
+        # Phrase bank slices point into the mmap; pass them through as a
+        # one-item body instead of materialising a bytes copy.
+        headers["Content-Length"] = str(data.nbytes)
+        return Response([data], mimetype=mimetype, headers=headers)
+    return Response(data, mimetype=mimetype, headers=headers)
+
+
+def mark_degraded(response: Response, engine: str, degraded: str | None) -> Response:
+    response.headers["X-HonkTTS-Engine"] = engine
+    if degraded:
+        response.headers["X-HonkTTS-Degraded"] = degraded
+    return response
+
+
+def item_content_type(audio_format: str, degraded: str | None) -> str:
+    # Bundle and pipe items have no headers; the flag rides on the content type.
+    content_type = AUDIO_FORMATS[audio_format]
+    return f"{content_type}; degraded={degraded}" if degraded else content_type
+
+
+def encode_audio(wav_bytes: bytes | memoryview, audio_format: str, sample_rate: int | None) -> bytes:
+    from scipy.io.wavfile import read as read_wav
+
+    source_rate, pcm = read_wav(io.BytesIO(wav_bytes))
+    if audio_format == "opus" and sample_rate is None:
+        sample_rate = OPUS_DEFAULT_SAMPLE_RATE
+
+    if sample_rate is not None and sample_rate != source_rate:
+        from scipy.signal import resample_poly
+
+        divisor = math.gcd(sample_rate, source_rate)
+        resampled = resample_poly(pcm.astype(np.float32), sample_rate // divisor, source_rate // divisor)
+        pcm = np.clip(resampled, -32768, 32767).astype(np.int16)
+    else:
+        sample_rate = source_rate
+
+    if audio_format == "wav":
+        return wav_header(sample_rate, pcm.nbytes) + pcm.tobytes()
+
+    if soundfile is None:
+        raise ValueError(f"{audio_format} output requires the soundfile package.")
+
+    out = io.BytesIO()
+    if audio_format == "flac":
+        soundfile.write(out, pcm, sample_rate, format="FLAC", subtype="PCM_16")
+    else:
+        soundfile.write(out, pcm, sample_rate, format="OGG", subtype="OPUS")
+    return out.getvalue()
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        for value in values
+    )
+    return "{" + ",".join(f"{name}=\"{value}\"" for name, value in zip(names, escaped)) + "}"
+
+
+class Counter:
+    """Monotonic counter in the Prometheus text format, keyed by label values."""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values: tuple[str, ...], amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value:g}")
+        return lines
 
-    try:
-        parsed = parse_audio_request(request.get_json(silent=True))
-    except ValueError as e:
-        return jsonify({"error": str(e)}), 400
 
-    if parsed.voice not in VOICES:
-        return jsonify({"error": f"Invalid voice. Valid options are: {list(VOICES.keys())}"}), 400
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus text format."""
 
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> (per-bucket counts with a trailing +Inf slot, sum)
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple[str, ...], value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(label_values, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        bucket_labels = self.labels + ("le",)
+        with self._lock:
+            for label_values, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else f"{bound:g}"
+                    lines.append(f"{self.name}_bucket{format_labels(bucket_labels, label_values + (le,))} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {total[0]:g}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "honktts_stage_seconds",
+    "Wall time spent in each request stage.",
+    ("endpoint", "voice", "stage"), LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "honktts_request_seconds",
+    "End-to-end request time, including sending the response.",
+    ("endpoint", "voice", "cached"), LATENCY_BUCKETS,
+)
+REAL_TIME_FACTOR = Histogram(
+    "honktts_real_time_factor",
+    "Synthesis time divided by the duration of the audio produced (cache misses only).",
+    ("endpoint", "voice"), RTF_BUCKETS,
+)
+INPUT_CHARACTERS = Counter(
+    "honktts_input_characters_total",
+    "Characters of input text received.",
+    ("endpoint", "voice"),
+)
+OUTPUT_AUDIO_SECONDS = Counter(
+    "honktts_output_audio_seconds_total",
+    "Seconds of audio synthesized (cache misses only).",
+    ("endpoint", "voice"),
+)
+SYNTHESIS_SECONDS = Counter(
+    "honktts_synthesis_seconds_total",
+    "Wall time spent synthesizing audio (cache misses only).",
+    ("endpoint", "voice"),
+)
+METRICS = (STAGE_SECONDS, REQUEST_SECONDS, REAL_TIME_FACTOR, INPUT_CHARACTERS, OUTPUT_AUDIO_SECONDS, SYNTHESIS_SECONDS)
+
+# Stages that make up synthesis proper; the rest are request handling.
+SYNTHESIS_STAGES = ("phonemize", "queue", "inference", "postprocess")
+
+
+class StageTimer:
+    """Per-request wall time by stage, reported to the metrics on completion."""
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+        self.audio_seconds = 0.0
+        # Set by render_audio: the engine that rendered the line and, if the
+        # overload controller stepped in, how the line was degraded.
+        self.engine: str | None = None
+        self.degraded: str | None = None
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def time(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def record(self, endpoint: str, voice: str, text: str, cached: bool, total: float | None = None):
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe((endpoint, voice, stage), seconds)
+        INPUT_CHARACTERS.inc((endpoint, voice), len(text))
+        if total is not None:
+            REQUEST_SECONDS.observe((endpoint, voice, str(cached).lower()), total)
+
+        if self.audio_seconds > 0:
+            synthesis = sum(self.stages.get(stage, 0.0) for stage in SYNTHESIS_STAGES)
+            OUTPUT_AUDIO_SECONDS.inc((endpoint, voice), self.audio_seconds)
+            SYNTHESIS_SECONDS.inc((endpoint, voice), synthesis)
+            REAL_TIME_FACTOR.observe((endpoint, voice), synthesis / self.audio_seconds)
+
+
+def wav_duration(wav: bytes | memoryview) -> float:
+    # Every WAV this server produces is 16-bit mono with a 44-byte header.
+    sample_rate = struct.unpack_from("<I", wav, 24)[0]
+    return (len(wav) - 44) / 2 / sample_rate if sample_rate else 0.0
+
+
+def observe_response(response: Response, timer: StageTimer, endpoint: str, voice: str, text: str,
+                     cached: bool, started: float) -> Response:
+    # The server closes the response once the body is written, which marks
+    # the end of the send stage.
+    handed_off = time.perf_counter()
+
+    def on_close():
+        finished = time.perf_counter()
+        timer.add("send", finished - handed_off)
+        timer.record(endpoint, voice, text, cached, finished - started)
+
+    response.call_on_close(on_close)
+    return response
+
+
+class PhonemeCache:
+    """LRU memo of espeak phonemes for punctuation-free text segments.
+
+    Coqui phonemizes each segment between punctuation marks with its own
+    espeak call, so caching at that level returns exactly what espeak would
+    have; repeated clauses ("Security,", "report to the bridge.") skip the
+    subprocess. Single words are not cached on their own because espeak
+    reduces and links words differently inside a clause.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def phonemize(self, segment: str, phonemize: Callable[[str], str]) -> str:
+        with self._lock:
+            phonemes = self._entries.get(segment)
+            if phonemes is not None:
+                self._entries.move_to_end(segment)
+                self.hits += 1
+                return phonemes
+            self.misses += 1
+
+        phonemes = phonemize(segment)
+        if self.max_entries <= 0:
+            return phonemes
+
+        with self._lock:
+            self._entries[segment] = phonemes
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return phonemes
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def text_to_ids(text: str) -> list[int]:
+    """Coqui's ``TTSTokenizer.text_to_ids`` with per-segment phoneme caching."""
+    tokenizer = tts.synthesizer.tts_model.tokenizer
+    if phoneme_cache is None or not tokenizer.use_phonemes:
+        return tokenizer.text_to_ids(text)
+
+    if tokenizer.text_cleaner is not None:
+        text = tokenizer.text_cleaner(text)
+    phonemizer = tokenizer.phonemizer
+    segments, punctuations = phonemizer._phonemize_preprocess(text)
+    phonemized = [
+        phoneme_cache.phonemize(segment, lambda s: phonemizer._phonemize(s, ""))
+        for segment in segments
+    ]
+    ids = tokenizer.encode(phonemizer._phonemize_postprocess(phonemized, punctuations))
+    if tokenizer.add_blank:
+        ids = tokenizer.intersperse_blank_char(ids, True)
+    if tokenizer.use_eos_bos:
+        ids = tokenizer.pad_with_bos_eos(ids)
+    return ids
+
+
+def phoneme_stats() -> dict[str, Any] | None:
+    return phoneme_cache.stats() if phoneme_cache is not None else None
+
+
+def resolve_speaker_ids() -> dict[str, int]:
+    # Resolve every voice once at load so a model without one of our VCTK
+    # speakers fails at startup instead of on the first request for it.
+    name_to_id = tts.synthesizer.tts_model.speaker_manager.name_to_id
+    missing = sorted(speaker for speaker in VOICES.values() if speaker not in name_to_id)
+    if missing:
+        raise RuntimeError(f"{TTS_MODEL} has no speakers {missing}")
+    return {voice: name_to_id[speaker] for voice, speaker in VOICES.items()}
+
+
+def speaker_index(voice: str) -> int:
+    return SPEAKER_IDS[voice]
+
+
+def synthesize_batch(items: list[tuple[str, str, float]]) -> tuple[list[np.ndarray], dict[str, float]]:
+    """Run several (sentence, voice, length scale) items through VITS.
+
+    Mirrors what ``Synthesizer.tts`` does for a single sentence, but pads the
+    token sequences so the whole batch shares one encoder/flow/decoder call
+    (one per distinct length scale, which the model only takes per call).
+    Returns the waveforms and the batch's phonemize/inference wall times.
+    """
+    if FAKE_MODEL:
+        return fake_synthesize_batch(items)
+
+    model = tts.synthesizer.tts_model
+    started = time.perf_counter()
+    sequences = [text_to_ids(text) for text, _, _ in items]
+    phonemized = time.perf_counter()
+
+    samples_per_frame = int(np.prod(model.args.upsample_rates_decoder))
+    audio_config = tts.synthesizer.tts_config.audio
+    trim = "do_trim_silence" in audio_config and audio_config["do_trim_silence"]
+
+    groups: dict[float, list[int]] = {}
+    for i, (_, _, length_scale) in enumerate(items):
+        groups.setdefault(length_scale, []).append(i)
+
+    wavs: list[np.ndarray] = [np.empty(0, dtype=np.float32)] * len(items)
+    for length_scale, indices in groups.items():
+        lengths = np.array([len(sequences[i]) for i in indices], dtype=np.int64)
+        tokens = np.zeros((len(indices), int(lengths.max())), dtype=np.int64)
+        for row, i in enumerate(indices):
+            tokens[row, :len(sequences[i])] = sequences[i]
+        speakers = np.array([speaker_index(items[i][1]) for i in indices], dtype=np.int64)
+
+        scales = vits_scales(model)
+        scales[1] *= length_scale
+        audio, frames = vits_forward(model, tokens, lengths, speakers, scales, backend=vits_backend)
+        for row, (i, frame_count) in enumerate(zip(indices, frames)):
+            wav = audio[row, :min(frame_count * samples_per_frame, audio.shape[-1])]
+            if trim:
+                wav = wav[:model.ap.find_endpoint(wav)]
+            wavs[i] = wav
+    return wavs, {"phonemize": phonemized - started, "inference": time.perf_counter() - phonemized}
+
+
+ONNX_EXPORT_VERSION = 1
+
+
+def vits_scales(model) -> np.ndarray:
+    return np.array(
+        [model.inference_noise_scale, model.length_scale, model.inference_noise_scale_dp], dtype=np.float32)
+
+
+def vits_forward(model, tokens: np.ndarray, lengths: np.ndarray, speakers: np.ndarray,
+                 scales: np.ndarray | None = None,
+                 backend: "OnnxVitsBackend | None" = None) -> tuple[np.ndarray, list[int]]:
+    """One padded VITS forward pass: (audio [B, samples], valid frames per item).
+
+    Runs on ``backend`` (ONNX Runtime) when given, otherwise on torch.
+    """
+    if scales is None:
+        scales = vits_scales(model)
+    if backend is not None:
+        return backend.infer(tokens, lengths, speakers, scales)
+
+    import torch
+
+    saved = (model.inference_noise_scale, model.length_scale, model.inference_noise_scale_dp)
+    model.inference_noise_scale, model.length_scale, model.inference_noise_scale_dp = (float(x) for x in scales)
     try:
-        wav_io = generate_wav(parsed.input_string, parsed.voice)
-    except Exception as e:
-        return jsonify({"error": f"Error generating audio: {str(e)}"}), 500
+        with torch.inference_mode():
+            outputs = model.inference(torch.from_numpy(tokens), aux_input={
+                "x_lengths": torch.from_numpy(lengths), "speaker_ids": torch.from_numpy(speakers)})
+    finally:
+        model.inference_noise_scale, model.length_scale, model.inference_noise_scale_dp = saved
+    return outputs["model_outputs"][:, 0].cpu().numpy(), outputs["y_mask"].sum(dim=(1, 2)).long().tolist()
 
-    duration = time.time() - start_time
-    print(f"Generated audio in {duration:.4f}s")
 
-    return send_file(wav_io, mimetype="audio/wav", as_attachment=True, download_name="output.wav")
+class OnnxVitsBackend:
+    """Runs the exported VITS generator through ONNX Runtime.
 
+    Sessions own native thread pools that don't survive fork, so each
+    process builds its own session on first use.
+    """
 
-@app.route("/generate_audio_robotic", methods=["POST"])
-def generate_audio_robotic():
-    start_time = time.time()
+    def __init__(self, model_path: str, intra_threads: int, inter_threads: int, quantized: bool):
+        self.model_path = model_path
+        self.intra_threads = intra_threads
+        self.inter_threads = inter_threads
+        self.quantized = quantized
+        self.parity_error: float | None = None
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                import onnxruntime
+
+                options = onnxruntime.SessionOptions()
+                options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                if self.intra_threads > 0:
+                    options.intra_op_num_threads = self.intra_threads
+                if self.inter_threads > 1:
+                    options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+                    options.inter_op_num_threads = self.inter_threads
+                self._session = onnxruntime.InferenceSession(
+                    self.model_path, sess_options=options, providers=["CPUExecutionProvider"])
+                self._pid = os.getpid()
+            return self._session
+
+    def infer(self, tokens: np.ndarray, lengths: np.ndarray, speakers: np.ndarray,
+              scales: np.ndarray) -> tuple[np.ndarray, list[int]]:
+        audio, frames = self.session.run(None, {
+            "input": tokens, "input_lengths": lengths, "scales": scales, "sid": speakers})
+        return audio[:, 0], frames.astype(np.int64).tolist()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "name": "onnx",
+            "model_path": self.model_path,
+            "quantized": self.quantized,
+            "intra_op_threads": self.intra_threads,
+            "inter_op_threads": self.inter_threads,
+            "parity_error": self.parity_error,
+        }
+
+
+def export_vits_onnx(model, path: str):
+    """Trace the VITS generator (text to waveform and frame counts) into ONNX."""
+    import torch
 
+    class Generator(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, tokens, lengths, scales, speakers):
+            # The noise and length scales become graph inputs.
+            model.inference_noise_scale, model.length_scale, model.inference_noise_scale_dp = (
+                scales[0], scales[1], scales[2])
+            outputs = model.inference(tokens, aux_input={"x_lengths": lengths, "speaker_ids": speakers})
+            return outputs["model_outputs"], outputs["y_mask"].sum(dim=(1, 2))
+
+    # The exporter restores the wrapper's training flag onto every submodule
+    # afterwards, so the wrapper itself must be in eval mode.
+    generator = Generator().eval()
+    saved = (model.inference_noise_scale, model.length_scale, model.inference_noise_scale_dp)
+    dummy = (
+        torch.randint(1, 50, (2, 64), dtype=torch.long),
+        torch.tensor([64, 40], dtype=torch.long),
+        torch.from_numpy(vits_scales(model)),
+        torch.tensor([0, 1], dtype=torch.long),
+    )
+    fd, tmp_path = tempfile.mkstemp(suffix=".onnx", dir=os.path.dirname(path))
+    os.close(fd)
     try:
-        parsed = parse_audio_request(request.get_json(silent=True))
-    except ValueError as e:
-        return jsonify({"error": str(e)}), 400
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            torch.onnx.export(
+                generator, dummy, tmp_path, opset_version=17, dynamo=False,
+                input_names=["input", "input_lengths", "scales", "sid"],
+                output_names=["output", "output_lengths"],
+                dynamic_axes={
+                    "input": {0: "batch", 1: "phonemes"},
+                    "input_lengths": {0: "batch"},
+                    "sid": {0: "batch"},
+                    "output": {0: "batch", 2: "samples"},
+                    "output_lengths": {0: "batch"},
+                },
+            )
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    finally:
+        model.inference_noise_scale, model.length_scale, model.inference_noise_scale_dp = saved
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-    if parsed.voice not in VARIANT_VOICES:
-        return jsonify({"error": f"Invalid voice. Valid options are: {sorted(VARIANT_VOICES)}"}), 400
 
+def quantize_vits_onnx(source: str, path: str):
+    """Dynamic int8 quantization of the exported generator's weights."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    fd, tmp_path = tempfile.mkstemp(suffix=".onnx", dir=os.path.dirname(path))
+    os.close(fd)
+    prepared = tmp_path + ".pre"
     try:
-        wav_io = generate_robotic_wav(parsed.input_string, parsed.voice)
-    except Exception as e:
-        return jsonify({"error": f"Error generating audio: {str(e)}"}), 500
+        # Folds the weight-norm subgraphs so the conv weights become plain
+        # initializers the quantizer can rewrite.
+        quant_pre_process(source, prepared, skip_symbolic_shape=True)
+        quantize_dynamic(prepared, tmp_path, weight_type=QuantType.QInt8)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    finally:
+        for leftover in (tmp_path, prepared):
+            if os.path.exists(leftover):
+                os.remove(leftover)
 
-    duration = time.time() - start_time
-    print(f"Generated robotic audio in {duration:.4f}s")
 
-    return send_file(wav_io, mimetype="audio/wav", as_attachment=True, download_name="output_robotic.wav")
+def onnx_parity_error(model, backend: OnnxVitsBackend) -> float:
+    """Relative RMS difference between torch and ONNX output, with noise off."""
+    sequences = [text_to_ids(text) for text in ONNX_PARITY_TEXTS]
+    lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+    tokens = np.zeros((len(sequences), int(lengths.max())), dtype=np.int64)
+    for i, seq in enumerate(sequences):
+        tokens[i, :len(seq)] = seq
+    speakers = np.array([speaker_index(voice) for voice in list(VOICES)[:len(sequences)]], dtype=np.int64)
+    scales = np.array([0.0, model.length_scale, 0.0], dtype=np.float32)
 
+    reference, reference_frames = vits_forward(model, tokens, lengths, speakers, scales)
+    audio, frames = vits_forward(model, tokens, lengths, speakers, scales, backend)
+    if frames != reference_frames:
+        return math.inf
 
-@app.route("/health", methods=["GET"])
-def health():
-    espeak_path = shutil.which(ESPEAK_BINARY) or ESPEAK_BINARY
-    espeak_data = os.environ.get("ESPEAK_DATA_PATH", "not set")
+    samples = min(audio.shape[-1], reference.shape[-1])
+    diff = audio[:, :samples] - reference[:, :samples]
+    return float(np.sqrt(np.mean(diff ** 2)) / max(1e-9, np.sqrt(np.mean(reference ** 2))))
 
-    version_proc = subprocess.run(
-        [ESPEAK_BINARY, "--version"],
-        capture_output=True, text=True, check=False,
-    )
-    espeak_version = version_proc.stdout.strip() or version_proc.stderr.strip() or "unknown"
 
-    return jsonify({
-        "status": "ok",
-        "espeak_binary": espeak_path,
-        "espeak_version": espeak_version,
-        "espeak_data_path": espeak_data,
-        "python_executable": sys.executable,
-        "tts_model": "tts_models/en/vctk/vits",
-        "voices": sorted(VOICES.keys()),
-        "voices_count": len(VOICES),
-        "variant_voices": sorted(VARIANT_VOICES),
-        "variant_voices_count": len(VARIANT_VOICES),
-    })
+def onnx_model_path(quantized: bool) -> str:
+    # Cached next to the downloaded checkpoint, so it is shared by every
+    # server using this model and re-exported when the checkpoint changes.
+    model_dir = os.path.dirname(tts.synthesizer.tts_checkpoint)
+    suffix = ".int8" if quantized else ""
+    return os.path.join(model_dir, f"honktts-vits-v{ONNX_EXPORT_VERSION}{suffix}.onnx")
 
 
-TTS_MODEL = "tts_models/en/vctk/vits"
-HOST = "127.0.0.1"
-PORT = 5234
+def is_stale(path: str, source: str) -> bool:
+    return not os.path.isfile(path) or os.path.getmtime(path) < os.path.getmtime(source)
 
-tts: TTS | None = None
-ESPEAK_BINARY: str | None = None
-VARIANT_VOICES: set[str] = set()
 
+def load_onnx_backend(intra_threads: int, inter_threads: int, quantized: bool) -> OnnxVitsBackend:
+    """Export (once) and load the ONNX generator, then check it against torch."""
+    model = tts.synthesizer.tts_model
+    fp32_path = onnx_model_path(False)
+    if is_stale(fp32_path, tts.synthesizer.tts_checkpoint):
+        print(f"Exporting the VITS generator to {fp32_path}...")
+        export_vits_onnx(model, fp32_path)
+
+    path = fp32_path
+    if quantized:
+        path = onnx_model_path(True)
+        if is_stale(path, fp32_path):
+            print(f"Quantizing the VITS generator to {path}...")
+            quantize_vits_onnx(fp32_path, path)
+
+    backend = OnnxVitsBackend(path, intra_threads, inter_threads, quantized)
+    backend.parity_error = round(onnx_parity_error(model, backend), 6)
+    limit = ONNX_PARITY_MAX_ERROR_INT8 if quantized else ONNX_PARITY_MAX_ERROR
+    if not backend.parity_error <= limit:
+        raise RuntimeError(f"ONNX output differs from torch by {backend.parity_error} (limit {limit})")
+    print(f"Using ONNX Runtime for VITS ({path}, parity error {backend.parity_error})")
+    return backend
+
+
+class FakeSynthesizer:
+    output_sample_rate = 22050
+
+    def split_into_sentences(self, text: str) -> list[str]:
+        return [sentence for sentence in re.split(r"(?<=[.!?])\s+", text.strip()) if sentence] or [text]
+
+
+class FakeTTS:
+    """Stands in for the Coqui model when HONKTTS_FAKE_MODEL is set."""
+
+    def __init__(self):
+        self.synthesizer = FakeSynthesizer()
+
+
+def fake_synthesize_batch(items: list[tuple[str, str, float]]) -> tuple[list[np.ndarray], dict[str, float]]:
+    # A tone per line, as long as real speech would roughly be, after
+    # sleeping as long as a forward pass of the longest line would take.
+    started = time.perf_counter()
+    sample_rate = FakeSynthesizer.output_sample_rate
+    wavs = []
+    for text, voice, length_scale in items:
+        pitch = 100 + int(VOICES.get(voice, "p225")[1:]) % 100
+        samples = int(len(text) * FAKE_SECONDS_PER_CHAR * length_scale * sample_rate)
+        t = np.arange(samples, dtype=np.float32) / sample_rate
+        wavs.append(0.5 * np.sin(2 * np.pi * pitch * t))
+    phonemized = time.perf_counter()
+
+    longest = max(len(wav) for wav in wavs) / sample_rate
+    time.sleep(longest * FAKE_MODEL_COST_MS / 1000)
+    return wavs, {"phonemize": phonemized - started, "inference": time.perf_counter() - phonemized}
+
+
+@contextmanager
+def mmap_checkpoint_loading():
+    """Make Coqui memory-map VITS checkpoints instead of reading them.
+
+    The state dict is loaded with ``mmap=True`` and assigned to the model
+    rather than copied into it, so the weights stay backed by the checkpoint
+    file: only pages inference touches become resident (the discriminator
+    stored alongside the generator never does), forked or spawned workers
+    share them through the page cache, and a reload is mostly page faults.
+    """
+    import torch
+    from TTS.tts.models import vits
+
+    load_fsspec = vits.load_fsspec
+    load_state_dict = vits.Vits.load_state_dict
+
+    def load_mapped(path, map_location=None, **kwargs):
+        if not os.path.isfile(path):
+            return load_fsspec(path, map_location=map_location, **kwargs)
+        return torch.load(os.fspath(path), map_location=map_location, mmap=True, weights_only=True)
+
+    def assign_state_dict(self, state_dict, strict=True, assign=False):
+        return load_state_dict(self, state_dict, strict=strict, assign=True)
+
+    vits.load_fsspec = load_mapped
+    vits.Vits.load_state_dict = assign_state_dict
+    try:
+        yield
+    finally:
+        vits.load_fsspec = load_fsspec
+        vits.Vits.load_state_dict = load_state_dict
+
+
+def load_tts():
+    if FAKE_MODEL:
+        print("Using the fake model (HONKTTS_FAKE_MODEL); VITS voices will be tones.")
+        return FakeTTS()
+    from TTS.api import TTS
+
+    if not MMAP_WEIGHTS:
+        return TTS(TTS_MODEL, progress_bar=False, gpu=False)
+    with mmap_checkpoint_loading():
+        return TTS(TTS_MODEL, progress_bar=False, gpu=False)
+
+
+def release_memory():
+    # Collect the dropped model and hand freed heap pages back to the OS, so
+    # an unload actually shows up in RSS.
+    gc.collect()
+    if sys.platform.startswith("linux"):
+        try:
+            ctypes.CDLL(None).malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+
+class ModelResidency:
+    """Loads the VITS model on demand and drops it once it has sat idle.
+
+    Everything that needs the model runs inside ``use()``, which reloads it
+    first if it was unloaded. Once there have been no users (and no batches)
+    for ``idle_s`` seconds, a background thread unloads it; 0 keeps the
+    model resident.
+    """
+
+    def __init__(self, load: Callable[[], None], unload: Callable[[], None], idle_s: float):
+        self._load = load
+        self._unload = unload
+        self.idle_s = idle_s
+        self._lock = threading.Lock()
+        # Held for a whole load or unload, so users wait for a reload in
+        # progress and an unload never races one.
+        self._load_lock = threading.Lock()
+        self.resident = False
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.loads = 0
+        self.unloads = 0
+        self.last_reload_seconds: float | None = None
+        self.last_unload_freed_bytes: int | None = None
+
+    def start(self):
+        if self.idle_s > 0:
+            threading.Thread(target=self._loop, name="idle-unload", daemon=True).start()
+
+    @contextmanager
+    def use(self):
+        with self._lock:
+            self.users += 1
+        try:
+            # Safe without the lock: nothing unloads while users > 0.
+            if not self.resident:
+                self.load()
+            yield
+        finally:
+            with self._lock:
+                self.users -= 1
+                self.last_used = time.monotonic()
+
+    def load(self):
+        with self._load_lock:
+            if self.resident:
+                return
+            started = time.perf_counter()
+            self._load()
+            seconds = round(time.perf_counter() - started, 3)
+            with self._lock:
+                self.resident = True
+                self.loads += 1
+                if self.loads > 1:
+                    self.last_reload_seconds = seconds
+        if self.loads > 1:
+            print(f"Reloaded the VITS model in {seconds:.2f}s")
+
+    def idle_for(self) -> float:
+        with self._lock:
+            if self.users:
+                return 0.0
+            idle = time.monotonic() - self.last_used
+        # Segments of an abandoned request may still be queued.
+        return min(idle, synthesis_batcher.quiet_for())
+
+    def _loop(self):
+        while True:
+            time.sleep(min(60.0, max(1.0, self.idle_s / 4)))
+            self.unload_if_idle()
+
+    def unload_if_idle(self):
+        with self._load_lock:
+            idle = self.idle_for()
+            with self._lock:
+                if not self.resident or self.users or idle < self.idle_s:
+                    return
+                self.resident = False
+            rss = process_memory()["rss_bytes"]
+            self._unload()
+            release_memory()
+            after = process_memory()["rss_bytes"]
+            with self._lock:
+                self.unloads += 1
+                self.last_unload_freed_bytes = rss - after if rss is not None and after is not None else None
+        print(f"Unloaded the VITS model after {idle:.0f}s idle")
+
+    def stats(self) -> dict[str, Any]:
+        idle = self.idle_for()
+        with self._lock:
+            return {
+                "resident": self.resident,
+                "users": self.users,
+                "idle_seconds": round(idle, 3),
+                "idle_unload_seconds": self.idle_s or None,
+                "mmap_weights": MMAP_WEIGHTS and not FAKE_MODEL,
+                "loads": self.loads,
+                "unloads": self.unloads,
+                "last_reload_seconds": self.last_reload_seconds,
+                "last_unload_freed_bytes": self.last_unload_freed_bytes,
+            }
+
+
+class BatchScheduler:
+    """Coalesces concurrent synthesis requests into batched model calls.
+
+    Requests arriving within ``window_s`` of the first queued one (up to
+    ``max_items``) are handed to ``run_batch`` together. Only the scheduler
+    threads (one per model replica) touch the model, so request threads never
+    contend for it.
+    """
+
+    def __init__(self, run_batch: Callable[[list[tuple[str, str, float]]], tuple[list[np.ndarray], dict[str, float]]],
+                 window_s: float, max_items: int, concurrency: int = 1, cpus: list[int] | None = None):
+        self.run_batch = run_batch
+        self.cpus = cpus or []
+        self.window_s = window_s
+        self.max_items = max(1, max_items)
+        self._queue: queue.Queue[tuple[tuple[str, str, float], Future]] = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._loop, name=f"batch-scheduler-{i}", daemon=True)
+            for i in range(max(1, concurrency))
+        ]
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.running = 0
+        self.last_active = time.monotonic()
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def quiet_for(self) -> float:
+        """Seconds since the scheduler last had work (0 while it has some)."""
+        with self._lock:
+            if self.running or not self._queue.empty():
+                return 0.0
+            return time.monotonic() - self.last_active
+
+    def submit(self, text: str, voice: str, length_scale: float = 1.0) -> Future:
+        future: Future = Future()
+        self._queue.put(((text, voice, length_scale), future))
+        return future
+
+    def _collect(self) -> list[tuple[tuple[str, str, float], Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window_s
+        while len(batch) < self.max_items:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        pin_thread(self.cpus)
+        while True:
+            batch = self._collect()
+            with self._lock:
+                self.running += 1
+            try:
+                wavs, timings = self.run_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.last_active = time.monotonic()
+
+            # Every item in the batch shares (and reports) the batch's timings.
+            for (_, future), wav in zip(batch, wavs):
+                future.set_result((wav, timings))
+
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "window_ms": round(self.window_s * 1000, 3),
+                "max_items": self.max_items,
+                "pending": self._queue.qsize(),
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": round(self.items / self.batches, 3) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+            }
+
+
+def usable_cpus() -> list[int]:
+    """CPUs this process may run on (all of them where affinity is unsupported)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_cpu_list(spec: str) -> list[int]:
+    # "2-5,8" -> [2, 3, 4, 5, 8]
+    cpus: set[int] = set()
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        first, _, last = part.partition("-")
+        try:
+            cpus.update(range(int(first), int(last or first) + 1))
+        except ValueError:
+            raise ValueError(f"expected a CPU list such as 2-5,8, got {spec!r}") from None
+    if not cpus:
+        raise ValueError(f"expected a CPU list such as 2-5,8, got {spec!r}")
+    return sorted(cpus)
+
+
+def pin_thread(cpus: list[int]):
+    # On Linux this pins only the calling thread; the torch/OpenMP threads it
+    # starts afterwards inherit the mask.
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+def lower_priority(nice: int):
+    """Run the whole server below normal priority, so the game keeps the CPU.
+
+    Called before any thread starts; threads and workers inherit it.
+    """
+    if nice <= 0:
+        return
+    if sys.platform == "win32":
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+        kernel32.SetPriorityClass(ctypes.c_void_p(kernel32.GetCurrentProcess()), BELOW_NORMAL_PRIORITY_CLASS)
+    else:
+        os.nice(nice)
+
+
+def tune_threads() -> dict[str, Any]:
+    """Thread counts, inference CPUs and priority, auto-picked where unset.
+
+    Inference gets half the usable cores (at most 4: VITS gains little past
+    that) or every CPU it is pinned to, and one inter-op thread since only
+    the batch scheduler calls into the model. Request threads mostly wait on
+    the scheduler, so serving gets one per core, between 4 and 8. The rest is
+    left to the game.
+    """
+    usable = usable_cpus()
+    cores = len(usable)
+    try:
+        inference_cpus = parse_cpu_list(INFERENCE_CPUS) if INFERENCE_CPUS.strip() else []
+    except ValueError as e:
+        raise RuntimeError(f"HONKTTS_INFERENCE_CPUS: {e}") from None
+    if inference_cpus:
+        inference_cpus = [cpu for cpu in inference_cpus if cpu in usable]
+        if not inference_cpus:
+            raise RuntimeError(f"HONKTTS_INFERENCE_CPUS: none of {INFERENCE_CPUS!r} is usable; CPUs are {usable}")
+    settings = {
+        "cores": cores,
+        "torch_threads": TORCH_THREADS or len(inference_cpus) or max(1, min(4, cores // 2)),
+        "torch_interop_threads": TORCH_INTEROP_THREADS or 1,
+        "serve_threads": SERVE_THREADS or max(4, min(8, cores)),
+        "inference_cpus": inference_cpus or None,
+        "nice": NICE,
+    }
+    settings["auto"] = [name for name, value in (
+        ("torch_threads", TORCH_THREADS), ("torch_interop_threads", TORCH_INTEROP_THREADS),
+        ("serve_threads", SERVE_THREADS)) if not value]
+    if WORKER_PROCESSES > 0:
+        settings["threads_per_worker"] = THREADS_PER_WORKER
+    return settings
+
+
+def apply_torch_threads(threads: int, interop_threads: int):
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # Only settable before torch's first parallel work; keep what it has.
+        pass
+
+
+def _worker_main(conn, threads: int, cpus: list[int], onnx_path: str | None = None, quantized: bool = False):
+    global tts, vits_backend, phoneme_cache
+    apply_torch_threads(threads, 1)
+    pin_thread(cpus)
+
+    # A forked worker inherits its siblings' pipe ends and the listening
+    # socket, so it never sees EOF when the server is killed; exit when
+    # reparented instead of holding the port open.
+    parent = os.getppid()
+
+    def _watch_parent():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=_watch_parent, name="parent-watch", daemon=True).start()
+
+    # Forked workers inherit the parent's model; spawned ones load their own.
+    if tts is None:
+        tts = load_tts()
+        SPEAKER_IDS.update(resolve_speaker_ids())
+    # A fresh phoneme cache: the inherited one's lock may have been held by a
+    # server thread at fork time.
+    phoneme_cache = PhonemeCache(PHONEME_CACHE_ENTRIES)
+    # Each worker gets its own ONNX session sized to its own cores.
+    vits_backend = OnnxVitsBackend(onnx_path, threads, 1, quantized) if onnx_path else None
+    conn.send(os.getpid())
+
+    while True:
+        try:
+            items = conn.recv()
+        except EOFError:
+            break
+        if items is None:
+            break
+
+        try:
+            conn.send((True, synthesize_batch(items), phoneme_stats()))
+        except Exception as e:
+            conn.send((False, str(e), phoneme_stats()))
+
+
+@dataclass
+class WorkerHandle:
+    index: int
+    process: Any
+    conn: Any
+    cpus: list[int]
+    pid: int = 0
+    busy: bool = False
+    batches: int = 0
+    items: int = 0
+    busy_seconds: float = 0.0
+    restarts: int = 0
+    phoneme_cache: dict[str, Any] | None = None
+
+
+class SynthesisWorkerPool:
+    """Runs synthesis batches in separate processes.
+
+    Each worker has its own torch intra-op thread pool and, where supported,
+    is pinned to its own set of cores. On Linux the workers are forked after
+    the parent has loaded the model, so the weights are shared copy-on-write;
+    elsewhere each spawned worker loads its own copy. A worker that dies, or
+    that takes longer than ``item_timeout`` seconds per item of a batch, is
+    replaced by a fresh one.
+    """
+
+    def __init__(self, workers: int, threads_per_worker: int, cpus: list[int] | None = None,
+                 item_timeout: float = 30.0):
+        # fork is only safe with torch (and Apple's frameworks) on Linux.
+        self._context = multiprocessing.get_context("fork" if sys.platform.startswith("linux") else "spawn")
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.item_timeout = item_timeout
+        self.cpus = cpus or usable_cpus()
+        self._workers = [WorkerHandle(i, None, None, self._cpus_for(i)) for i in range(workers)]
+        self._idle: queue.Queue[WorkerHandle] = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _cpus_for(self, index: int) -> list[int]:
+        if not hasattr(os, "sched_setaffinity"):
+            return []
+        first = index * self.threads_per_worker
+        if first + self.threads_per_worker > len(self.cpus):
+            return []
+        return self.cpus[first:first + self.threads_per_worker]
+
+    def start(self):
+        # Keep the parent's long-lived objects out of the collector so the
+        # children don't dirty (and copy) shared pages during GC passes.
+        gc.freeze()
+        for worker in self._workers:
+            self._spawn(worker)
+            self._idle.put(worker)
+
+    def stop(self):
+        # Only called with every worker idle, when the model is unloaded.
+        while not self._idle.empty():
+            self._idle.get_nowait()
+        for worker in self._workers:
+            if worker.conn is not None:
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                worker.conn.close()
+            if worker.process is not None:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            worker.process = worker.conn = None
+            worker.pid = 0
+        gc.unfreeze()
+
+    def _spawn(self, worker: WorkerHandle):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(
+                child_conn, self.threads_per_worker, worker.cpus,
+                vits_backend.model_path if vits_backend is not None else None,
+                vits_backend.quantized if vits_backend is not None else False,
+            ),
+            name=f"tts-worker-{worker.index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker.process = process
+        worker.conn = parent_conn
+        worker.pid = parent_conn.recv()
+
+    def _restart(self, worker: WorkerHandle):
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join(timeout=5)
+        if worker.conn is not None:
+            worker.conn.close()
+        with self._lock:
+            worker.restarts += 1
+        self._spawn(worker)
+
+    def run_batch(self, items: list[tuple[str, str, float]]) -> tuple[list[np.ndarray], dict[str, float]]:
+        worker = self._idle.get()
+        started = time.perf_counter()
+        with self._lock:
+            worker.busy = True
+
+        try:
+            worker.conn.send(items)
+            # A hung worker never answers; give up on it rather than block
+            # this dispatch thread and the batch's futures forever.
+            if not worker.conn.poll(self.item_timeout * len(items)):
+                self._restart(worker)
+                raise RuntimeError(f"Synthesis worker {worker.index} timed out and was restarted")
+            ok, payload, worker.phoneme_cache = worker.conn.recv()
+        except (EOFError, OSError):
+            self._restart(worker)
+            raise RuntimeError(f"Synthesis worker {worker.index} died and was restarted")
+        finally:
+            with self._lock:
+                worker.busy = False
+                worker.busy_seconds += time.perf_counter() - started
+            self._idle.put(worker)
+
+        if not ok:
+            raise RuntimeError(payload)
+
+        with self._lock:
+            worker.batches += 1
+            worker.items += len(items)
+        return payload
+
+    def stats(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "index": worker.index,
+                    "pid": worker.pid,
+                    "alive": worker.process is not None and worker.process.is_alive(),
+                    "busy": worker.busy,
+                    "threads": self.threads_per_worker,
+                    "cpus": worker.cpus,
+                    "batches": worker.batches,
+                    "items": worker.items,
+                    "busy_seconds": round(worker.busy_seconds, 3),
+                    "restarts": worker.restarts,
+                    "rss_bytes": process_memory(worker.pid)["rss_bytes"] if worker.pid else None,
+                    "phoneme_cache": worker.phoneme_cache,
+                }
+                for worker in self._workers
+            ]
+
+
+def add_batch_timings(timer: StageTimer, timings: list[dict[str, float]], waited: float | None = None):
+    # Sentences that shared a batch share one timings dict; count it once.
+    # Whatever the batches don't account for was spent queued for the model.
+    unique = {id(batch): batch for batch in timings}.values()
+    busy = 0.0
+    for batch in unique:
+        for stage, seconds in batch.items():
+            timer.add(stage, seconds)
+            busy += seconds
+    if waited is not None:
+        timer.add("queue", max(0.0, waited - busy))
+
+
+_scratch = threading.local()
+
+
+def scratch_buffer(size: int) -> np.ndarray:
+    """Return this thread's float32 work buffer, grown to at least ``size``.
+
+    The buffer is reused by the next request on the same thread, so callers
+    must be done with it before they synthesize again.
+    """
+    buffer = getattr(_scratch, "buffer", None)
+    if buffer is None or len(buffer) < size:
+        buffer = np.empty(max(size, 2 * len(buffer) if buffer is not None else 0), dtype=np.float32)
+        _scratch.buffer = buffer
+    return buffer[:size]
+
+
+def split_words(clause: str, max_chars: int) -> list[str]:
+    # Cut a clause with no punctuation left into roughly equal word runs.
+    if len(clause) <= max_chars:
+        return [clause]
+    target = len(clause) / math.ceil(len(clause) / max_chars)
+    pieces = []
+    current = ""
+    for word in clause.split():
+        if current and len(current) + 1 + len(word) > target:
+            pieces.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_segments(text: str, max_chars: int) -> list[tuple[str, bool]]:
+    """Split text into (segment, ends_sentence) pairs of at most ``max_chars``.
+
+    Sentences that fit are kept whole. Longer ones are cut at clause
+    punctuation, and clauses that are still too long at word boundaries
+    into roughly equal pieces, so no single forward pass grows unbounded.
+    """
+    segments = []
+    for sentence in tts.synthesizer.split_into_sentences(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            segments.append((sentence, True))
+            continue
+
+        pieces = [piece for clause in re.split(r"(?<=[,;])\s+", sentence) for piece in split_words(clause, max_chars)]
+        current = ""
+        for piece in pieces:
+            if current and len(current) + 1 + len(piece) > max_chars:
+                segments.append((current, False))
+                current = piece
+            else:
+                current = f"{current} {piece}" if current else piece
+        segments.append((current, True))
+    return segments
+
+
+def submit_segment(segment: str, voice: str, length_scale: float = 1.0) -> Future:
+    """Queue a segment for synthesis, or answer it from the segment cache."""
+    key = cache_key("segment", VITS_MODEL_ID, voice, segment, *((f"{length_scale:g}",) if length_scale != 1.0 else ()))
+    data = segment_cache.get(key)
+    if data is not None:
+        future: Future = Future()
+        future.set_result((np.frombuffer(data, dtype=np.float32), {}))
+        return future
+
+    def store(done: Future):
+        if done.exception() is None:
+            segment_cache.put(key, np.ascontiguousarray(done.result()[0], dtype=np.float32).tobytes())
+
+    future = synthesis_batcher.submit(segment, voice, length_scale)
+    future.add_done_callback(store)
+    return future
+
+
+def synthesize_waveform(text: str, voice: str, timer: StageTimer | None = None,
+                        length_scale: float = 1.0) -> np.ndarray:
+    # Coqui splits input into sentences and pads each with silence. Long
+    # sentences are split further; every segment is its own batch item, so
+    # they run in parallel, and pieces of one sentence are crossfaded back
+    # together. The result is assembled in the thread's scratch buffer.
+    started = time.perf_counter()
+    segments = split_segments(text, SEGMENT_MAX_CHARS)
+    futures = [submit_segment(segment, voice, length_scale) for segment, _ in segments]
+
+    parts = []
+    timings = []
+    for future in futures:
+        wav, batch_timings = future.result()
+        parts.append(wav)
+        timings.append(batch_timings)
+
+    if timer is not None:
+        add_batch_timings(timer, timings, time.perf_counter() - started)
+
+    sample_rate = int(tts.synthesizer.output_sample_rate)
+    crossfade = sample_rate * SEGMENT_CROSSFADE_MS // 1000
+    overlaps = [0] * len(parts)
+    for i in range(1, len(parts)):
+        if not segments[i - 1][1]:
+            overlaps[i] = min(crossfade, len(parts[i - 1]), len(parts[i]))
+    gaps = sum(SENTENCE_GAP_SAMPLES for _, ends_sentence in segments if ends_sentence)
+
+    samples = scratch_buffer(sum(len(wav) for wav in parts) + gaps - sum(overlaps))
+    offset = 0
+    for wav, overlap, (_, ends_sentence) in zip(parts, overlaps, segments):
+        if overlap:
+            fade = np.linspace(0.0, 1.0, overlap, dtype=np.float32)
+            offset -= overlap
+            samples[offset:offset + overlap] *= 1.0 - fade
+            samples[offset:offset + overlap] += wav[:overlap] * fade
+        samples[offset + overlap:offset + len(wav)] = wav[overlap:]
+        offset += len(wav)
+        if ends_sentence:
+            samples[offset:offset + SENTENCE_GAP_SAMPLES] = 0.0
+            offset += SENTENCE_GAP_SAMPLES
+    return samples
+
+
+def loud_bounds(samples: np.ndarray, threshold: float, pad: int) -> tuple[int, int]:
+    # Scan inward from both ends a block at a time; leading and trailing
+    # silence is short, so this rarely looks at more than a few blocks.
+    block = 4096
+    n = len(samples)
+    start = end = None
+    for offset in range(0, n, block):
+        loud = np.flatnonzero(np.abs(samples[offset:offset + block]) > threshold)
+        if loud.size:
+            start = offset + int(loud[0])
+            break
+    if start is None:
+        return 0, n
+
+    for offset in range((n - 1) // block * block, start - 1, -block):
+        loud = np.flatnonzero(np.abs(samples[offset:offset + block]) > threshold)
+        if loud.size:
+            end = offset + int(loud[-1]) + 1
+            break
+    return max(0, start - pad), min(n, (end or n) + pad)
+
+
+def pcm16_wav(samples: np.ndarray, sample_rate: int, normalize: str = "peak",
+              trim_silence: bool = False) -> memoryview:
+    """Scale float samples and write them out as a 16-bit mono WAV.
+
+    ``samples`` is scaled in place (it is normally a scratch buffer). The
+    header and PCM are written straight into the returned buffer, which is
+    the only allocation proportional to the audio.
+    """
+    peak = max(float(samples.max(initial=0.0)), -float(samples.min(initial=0.0)))
+    if trim_silence:
+        threshold = peak * 10 ** (TRIM_SILENCE_DB / 20)
+        start, end = loud_bounds(samples, threshold, sample_rate * TRIM_PAD_MS // 1000)
+        samples = samples[start:end]
+
+    gain = 32767 / max(0.01, peak)
+    if normalize == "loudness" and samples.size:
+        rms = math.sqrt(float(np.dot(samples, samples)) / samples.size)
+        if rms > 0:
+            gain = min(gain, 32767 * 10 ** (LOUDNESS_TARGET_DBFS / 20) / rms)
+    samples *= gain
+
+    out = bytearray(44 + 2 * samples.size)
+    out[:44] = wav_header(sample_rate, 2 * samples.size)
+    np.copyto(np.frombuffer(out, dtype=np.int16, offset=44), samples, casting="unsafe")
+    return memoryview(out)
+
+
+def time_stretch(samples: np.ndarray, rate: float) -> np.ndarray:
+    """Phase-vocoder time stretch: ``rate`` > 1 is faster, pitch unchanged."""
+    from scipy.signal import istft, stft
+
+    n_fft, hop = 1024, 256
+    if len(samples) < n_fft:
+        return samples
+    _, _, spec = stft(samples, nperseg=n_fft, noverlap=n_fft - hop)
+
+    # Interpolate magnitudes between neighbouring frames and advance each
+    # bin's phase by its measured instantaneous frequency.
+    steps = np.arange(0, spec.shape[1] - 1, rate)
+    index = steps.astype(np.int64)
+    alpha = (steps - index)[np.newaxis, :]
+    left, right = spec[:, index], spec[:, index + 1]
+    magnitude = (1 - alpha) * np.abs(left) + alpha * np.abs(right)
+
+    expected = (2 * np.pi * hop / n_fft) * np.arange(spec.shape[0])[:, np.newaxis]
+    delta = np.angle(right) - np.angle(left) - expected
+    delta -= 2 * np.pi * np.round(delta / (2 * np.pi))
+    advance = np.cumsum(expected + delta, axis=1)
+    phase = np.angle(spec[:, :1]) + np.concatenate([np.zeros_like(advance[:, :1]), advance[:, :-1]], axis=1)
+
+    _, stretched = istft(magnitude * np.exp(1j * phase), nperseg=n_fft, noverlap=n_fft - hop)
+    return stretched.astype(np.float32)
+
+
+def pitch_shift(samples: np.ndarray, semitones: float) -> np.ndarray:
+    # Stretch by the pitch ratio, then resample back to the original length.
+    from scipy.signal import resample_poly
+
+    ratio = Fraction(2 ** (semitones / 12)).limit_denominator(64)
+    stretched = time_stretch(samples, 1 / float(ratio))
+    return resample_poly(stretched, ratio.denominator, ratio.numerator).astype(np.float32)
+
+
+def radio_effect(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    # Telephone band plus soft clipping, like a cheap headset radio.
+    from scipy.signal import butter, sosfilt
+
+    sos = butter(4, [300, 3400], btype="bandpass", fs=sample_rate, output="sos")
+    filtered = sosfilt(sos, samples)
+    peak = max(1e-3, float(np.max(np.abs(filtered), initial=0.0)))
+    return np.tanh(filtered * (3 / peak)).astype(np.float32)
+
+
+def robot_effect(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    # Ring modulation at 40 Hz, then a sample-and-hold bitcrush to 5 bits.
+    carrier = np.sin(np.arange(len(samples), dtype=np.float32) * np.float32(2 * np.pi * 40 / sample_rate))
+    modulated = samples * carrier
+    held = np.repeat(modulated[::3], 3)[:len(samples)]
+    peak = max(1e-3, float(np.max(np.abs(held), initial=0.0)))
+    levels = 16
+    return (np.round(held * (levels / peak)) * (peak / levels)).astype(np.float32)
+
+
+def apply_effects(samples: np.ndarray, sample_rate: int, effects: tuple[str, ...]) -> np.ndarray:
+    for effect in effects:
+        name, _, value = effect.partition(":")
+        if name == "radio":
+            samples = radio_effect(samples, sample_rate)
+        elif name == "robot":
+            samples = robot_effect(samples, sample_rate)
+        elif name == "speed":
+            samples = time_stretch(samples, float(value))
+        elif name == "pitch":
+            samples = pitch_shift(samples, float(value))
+    return samples
+
+
+def reprocess_wav(wav: bytes | memoryview, normalize: str, trim_silence: bool,
+                  effects: tuple[str, ...] = ()) -> memoryview:
+    # Apply post-processing to an already rendered 16-bit WAV (robotic voices).
+    sample_rate = struct.unpack_from("<I", wav, 24)[0]
+    pcm = np.frombuffer(wav, dtype=np.int16, offset=44)
+    samples = scratch_buffer(len(pcm))
+    np.multiply(pcm, 1 / 32768, out=samples)
+    samples = apply_effects(samples, sample_rate, effects)
+    return pcm16_wav(samples, sample_rate, normalize, trim_silence)
+
+
+def generate_wav(text: str, voice: str, timer: StageTimer | None = None, normalize: str = "peak",
+                 trim_silence: bool = False, effects: tuple[str, ...] = (), length_scale: float = 1.0) -> memoryview:
+    timer = timer or StageTimer()
+    samples = synthesize_waveform(text, voice, timer, length_scale)
+    sample_rate = int(tts.synthesizer.output_sample_rate)
+
+    with timer.time("postprocess"):
+        samples = apply_effects(samples, sample_rate, effects)
+        return pcm16_wav(samples, sample_rate, normalize, trim_silence)
+
+
+STREAMING_SIZE = 0xFFFFFFFF
+
+
+def wav_header(sample_rate: int, data_size: int) -> bytes:
+    # 16-bit mono PCM. Streaming responses pass STREAMING_SIZE for the
+    # unknown RIFF and data lengths.
+    riff_size = STREAMING_SIZE if data_size == STREAMING_SIZE else 36 + data_size
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", data_size,
+    )
+
+
+def split_stream_chunks(text: str) -> list[tuple[str, bool]]:
+    """Split text into (chunk, ends_sentence) pairs for incremental synthesis.
+
+    Sentences are split further at clause punctuation once they exceed
+    ``STREAM_CLAUSE_CHARS``; clauses shorter than that are merged with their
+    neighbour so the model still gets enough context for natural prosody.
+    Clauses over ``SEGMENT_MAX_CHARS`` are cut at word boundaries.
+    """
+    chunks = []
+    for sentence in tts.synthesizer.split_into_sentences(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+
+        current = ""
+        clauses = [piece for clause in re.split(r"(?<=[,;])\s+", sentence)
+                   for piece in split_words(clause, SEGMENT_MAX_CHARS)]
+        for clause in clauses:
+            current = f"{current} {clause}" if current else clause
+            if len(current) >= STREAM_CLAUSE_CHARS:
+                chunks.append((current, False))
+                current = ""
+
+        if current:
+            chunks.append((current, True))
+        elif chunks:
+            chunks[-1] = (chunks[-1][0], True)
+    return chunks
+
+
+def stream_wav(text: str, voice: str, on_complete: Callable[[bytes], None], timer: StageTimer | None = None):
+    with ENGINES["vits"].slot(), vits_residency.use():
+        yield from _stream_wav(text, voice, on_complete, timer)
+
+
+def _stream_wav(text: str, voice: str, on_complete: Callable[[bytes], None], timer: StageTimer | None = None):
+    timer = timer or StageTimer()
+    sample_rate = int(tts.synthesizer.output_sample_rate)
+    chunks = split_stream_chunks(text)
+    yield wav_header(sample_rate, STREAMING_SIZE)
+
+    # The first chunk is submitted on its own so time-to-first-audio is one
+    # short synthesis; the rest are submitted together and batch up while the
+    # first chunk is being sent.
+    futures = [submit_segment(chunks[0][0], voice)] if chunks else []
+    silence = np.zeros(SENTENCE_GAP_SAMPLES, dtype=np.int16).tobytes()
+    peak = 0.01
+    pcm_parts = []
+    timings = []
+    postprocess = 0.0
+
+    for i, (_, ends_sentence) in enumerate(chunks):
+        wav, batch_timings = futures[i].result()
+        timings.append(batch_timings)
+        chunk_started = time.perf_counter()
+        if i == 0:
+            futures += [submit_segment(chunk, voice) for chunk, _ in chunks[1:]]
+
+        # A running peak keeps the gain stable across chunks; it can only
+        # turn the volume down for louder later chunks, never clip them.
+        peak = max(peak, float(np.max(np.abs(wav))) if wav.size else 0.0)
+        pcm = (wav * (32767 / peak)).astype(np.int16).tobytes()
+        if ends_sentence:
+            pcm += silence
+        postprocess += time.perf_counter() - chunk_started
+
+        pcm_parts.append(pcm)
+        yield pcm
+
+    # Waiting on the client overlaps with synthesis of later chunks, so a
+    # stream reports no queue or send stage.
+    add_batch_timings(timer, timings)
+    timer.add("postprocess", postprocess)
+    data = b"".join(pcm_parts)
+    timer.audio_seconds = len(data) / 2 / sample_rate
+    on_complete(wav_header(sample_rate, len(data)) + data)
+
+
+class EspeakLibrary:
+    """In-process espeak-ng synthesis through libespeak-ng.
+
+    The library runs in synchronous mode with a callback that collects PCM
+    in memory, so a robotic request costs no fork/exec and no temp file.
+    libespeak-ng keeps global state, so calls are serialized with a lock.
+    """
+
+    AUDIO_OUTPUT_SYNCHRONOUS = 2
+    INITIALIZE_DONT_EXIT = 0x8000
+    CHARS_UTF8 = 1
+    ENDPAUSE = 0x1000
+    POS_CHARACTER = 1
+
+    SYNTH_CALLBACK = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(ctypes.c_short), ctypes.c_int, ctypes.c_void_p)
+
+    def __init__(self, library_path: str):
+        lib = ctypes.CDLL(library_path)
+        lib.espeak_Initialize.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        lib.espeak_Initialize.restype = ctypes.c_int
+        lib.espeak_SetSynthCallback.argtypes = [self.SYNTH_CALLBACK]
+        lib.espeak_SetSynthCallback.restype = None
+        lib.espeak_SetVoiceByName.argtypes = [ctypes.c_char_p]
+        lib.espeak_SetVoiceByName.restype = ctypes.c_int
+        lib.espeak_Synth.argtypes = [
+            ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint, ctypes.c_int,
+            ctypes.c_uint, ctypes.c_uint, ctypes.c_void_p, ctypes.c_void_p,
+        ]
+        lib.espeak_Synth.restype = ctypes.c_int
+        lib.espeak_Synchronize.argtypes = []
+        lib.espeak_Synchronize.restype = ctypes.c_int
+        lib.espeak_Info.argtypes = [ctypes.POINTER(ctypes.c_char_p)]
+        lib.espeak_Info.restype = ctypes.c_char_p
+
+        # NULL data path: the library honours ESPEAK_DATA_PATH like the CLI.
+        sample_rate = lib.espeak_Initialize(self.AUDIO_OUTPUT_SYNCHRONOUS, 0, None, self.INITIALIZE_DONT_EXIT)
+        if sample_rate <= 0:
+            raise RuntimeError(f"espeak_Initialize failed ({sample_rate})")
+
+        self.library_path = library_path
+        self.sample_rate = sample_rate
+        self._lib = lib
+        self._lock = threading.Lock()
+        self._chunks: list[bytes] = []
+        # Keep a reference so the callback isn't garbage collected.
+        self._callback = self.SYNTH_CALLBACK(self._on_audio)
+        lib.espeak_SetSynthCallback(self._callback)
+
+        data_path = ctypes.c_char_p()
+        version = lib.espeak_Info(ctypes.byref(data_path))
+        self.version = version.decode(errors="replace") if version else "unknown"
+
+    def _on_audio(self, wav, num_samples: int, events) -> int:
+        if num_samples > 0 and wav:
+            self._chunks.append(ctypes.string_at(wav, num_samples * 2))
+        return 0
+
+    def synthesize(self, text: str, voice: str) -> bytes:
+        data = text.encode("utf-8")
+        with self._lock:
+            if self._lib.espeak_SetVoiceByName(f"en+{voice}".encode("utf-8")) != 0:
+                raise RuntimeError(f"espeak could not select voice en+{voice}")
+
+            self._chunks = []
+            error = self._lib.espeak_Synth(
+                data, len(data) + 1, 0, self.POS_CHARACTER, 0,
+                self.CHARS_UTF8 | self.ENDPAUSE, None, None,
+            )
+            if error != 0:
+                raise RuntimeError(f"espeak_Synth failed ({error})")
+            self._lib.espeak_Synchronize()
+            pcm = b"".join(self._chunks)
+            self._chunks = []
+
+        return wav_header(self.sample_rate, len(pcm)) + pcm
+
+
+def espeak_library_disabled() -> bool:
+    return os.environ.get("HONKTTS_ESPEAK_LIBRARY", "").strip().lower() in ("none", "off", "0")
+
+
+def find_espeak_library(espeak_bin: str) -> str | None:
+    override = os.environ.get("HONKTTS_ESPEAK_LIBRARY", "").strip()
+    if espeak_library_disabled():
+        return None
+    if override:
+        return override
+
+    # Prefer the library shipped next to the binary we already use (the
+    # installer's portable espeak-ng dir, or <prefix>/lib for brew/apt).
+    binary_dir = os.path.dirname(shutil.which(espeak_bin) or "")
+    names = (
+        "libespeak-ng.dll", "espeak-ng.dll",
+        "libespeak-ng.so.1", "libespeak-ng.so",
+        "libespeak-ng.1.dylib", "libespeak-ng.dylib",
+    )
+    if binary_dir:
+        for directory in (binary_dir, os.path.join(binary_dir, "..", "lib")):
+            for name in names:
+                candidate = os.path.normpath(os.path.join(directory, name))
+                if os.path.isfile(candidate):
+                    return candidate
+
+    return ctypes.util.find_library("espeak-ng")
+
+
+def load_espeak_library(espeak_bin: str) -> EspeakLibrary | None:
+    if espeak_library_disabled():
+        print("libespeak-ng disabled by HONKTTS_ESPEAK_LIBRARY, robotic voices will use the espeak subprocess")
+        return None
+    library_path = find_espeak_library(espeak_bin)
+    if library_path is None:
+        print("libespeak-ng not found, robotic voices will use the espeak subprocess")
+        return None
+
+    try:
+        library = EspeakLibrary(library_path)
+    except (OSError, AttributeError, RuntimeError) as e:
+        print(f"Failed to load {library_path} ({e}), robotic voices will use the espeak subprocess")
+        return None
+
+    print(f"Using in-process espeak-ng from {library_path}")
+    return library
+
+
+def generate_robotic_wav(text: str, voice: str) -> io.BytesIO:
+    if ESPEAK_LIBRARY is not None:
+        return io.BytesIO(ESPEAK_LIBRARY.synthesize(text, voice))
+    return generate_robotic_wav_subprocess(text, voice)
+
+
+def generate_robotic_wav_subprocess(text: str, voice: str) -> io.BytesIO:
+    # Write to a temp file instead of --stdout to avoid Windows pipe
+    # binary/text mode corruption of PCM data.
+    import tempfile as _tempfile
+
+    with _tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
+        tmp_path = tmp.name
+
+    try:
+        proc = subprocess.run(
+            [ESPEAK_BINARY, "-v", f"en+{voice}", "-w", tmp_path, text],
+            check=False,
+            capture_output=True,
+        )
+        if proc.returncode != 0:
+            stderr = proc.stderr.decode(errors="replace").strip()
+            raise RuntimeError(stderr or "espeak failed to generate audio")
+
+        with open(tmp_path, "rb") as f:
+            wav_io = io.BytesIO(f.read())
+        wav_io.seek(0)
+        return wav_io
+    finally:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def audio_key(engine: str, voice: str, text: str, *variant: str) -> str:
+    if engine == "robotic":
+        return cache_key("generate_audio_robotic", ESPEAK_BINARY, voice, text, *variant)
+    return cache_key("generate-audio", VITS_MODEL_ID, voice, text, *variant)
+
+
+class PhraseBank:
+    """Read-only archive of pre-rendered lines, memory-mapped at startup.
+
+    The archive is a directory holding ``index.json`` and one data file the
+    index points at. Entries are addressed by the same keys as the synthesis
+    cache, and lookups return memoryview slices of the mapping.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, self.INDEX_FILE), encoding="utf-8") as f:
+            index = json.load(f)
+
+        self.directory = directory
+        self.entries: dict[str, list] = index["entries"]
+        self._file = open(os.path.join(directory, index["data_file"]), "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._view = memoryview(self._mmap) if self._mmap is not None else memoryview(b"")
+        self.hits = 0
+
+    def get(self, key: str, count: bool = True) -> memoryview | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        offset, length = entry[0], entry[1]
+        self.hits += count
+        return self._view[offset:offset + length]
+
+    def close(self):
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "entries": len(self.entries),
+            "bytes": len(self._view),
+            "hits": self.hits,
+        }
+
+
+def load_phrase_manifest(path: str) -> list[tuple[str, str, str]]:
+    """Read (engine, voice, text) entries from a JSON or text manifest.
+
+    JSON manifests are a list of objects with ``voice``, ``input_string`` and
+    an optional ``engine`` ("vits" or "robotic"). Text manifests have one
+    ``voice|text`` VITS line per row; blank lines and ``#`` comments are
+    skipped.
+    """
+    with open(path, encoding="utf-8") as f:
+        raw = f.read()
+
+    entries = []
+    if path.lower().endswith(".json"):
+        for item in json.loads(raw):
+            engine = item.get("engine", "vits")
+            if engine not in ("vits", "robotic"):
+                raise ValueError(f"Unknown engine {engine!r} in {path}")
+            parsed = parse_audio_request(item)
+            entries.append((engine, parsed.voice, parsed.input_string))
+    else:
+        for line_number, line in enumerate(raw.splitlines(), start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            voice, sep, text = line.partition("|")
+            if not sep:
+                raise ValueError(f"{path}:{line_number}: expected 'voice|text'")
+            parsed = parse_audio_request({"voice": voice, "input_string": text})
+            entries.append(("vits", parsed.voice, parsed.input_string))
+    return entries
+
+
+def build_phrase_bank(manifest_path: str, output_dir: str, jobs: int):
+    entries = load_phrase_manifest(manifest_path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    previous = None
+    if os.path.isfile(os.path.join(output_dir, PhraseBank.INDEX_FILE)):
+        previous = PhraseBank(output_dir)
+
+    wanted: dict[str, tuple[str, str, str]] = {}
+    for engine, voice, text in entries:
+        if engine == "vits" and voice not in VOICES:
+            print(f"  Skipping unknown voice {voice!r}: {text}")
+            continue
+        if engine == "robotic" and voice not in VARIANT_VOICES:
+            print(f"  Skipping unknown variant voice {voice!r}: {text}")
+            continue
+        wanted[audio_key(engine, voice, text)] = (engine, voice, text)
+
+    reused = {key for key in wanted if previous is not None and key in previous.entries}
+    missing = [key for key in wanted if key not in reused]
+    print(f"Phrase bank: {len(wanted)} entries, {len(reused)} unchanged, {len(missing)} to render")
+
+    def render(key: str) -> bytes | memoryview:
+        engine, voice, text = wanted[key]
+        if engine == "robotic":
+            return generate_robotic_wav(text, voice).getvalue()
+        return generate_wav(text, voice)
+
+    # Renders run concurrently so VITS lines batch up in the scheduler.
+    rendered: dict[str, bytes | memoryview] = {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {key: executor.submit(render, key) for key in missing}
+        for key, future in futures.items():
+            try:
+                rendered[key] = future.result()
+            except Exception as e:
+                engine, voice, text = wanted[key]
+                print(f"  Failed to render {engine}/{voice}: {text!r} ({e})")
+
+    # Write a new data file next to the old one and swap the index last, so
+    # a server starting mid-build always sees a consistent pair.
+    data_file = f"phrases-{time.time_ns()}.bin"
+    index_entries = {}
+    offset = 0
+    with open(os.path.join(output_dir, data_file), "wb") as f:
+        for key, (engine, voice, text) in wanted.items():
+            data = previous.get(key) if key in reused else rendered.get(key)
+            if data is None:
+                continue
+            f.write(data)
+            index_entries[key] = [offset, len(data), engine, voice, text]
+            offset += len(data)
+            del data
+
+    index_path = os.path.join(output_dir, PhraseBank.INDEX_FILE)
+    with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "model": VITS_MODEL_ID, "data_file": data_file, "entries": index_entries}, f)
+    os.replace(index_path + ".tmp", index_path)
+
+    if previous is not None:
+        previous.close()
+
+    for name in os.listdir(output_dir):
+        if name.startswith("phrases-") and name.endswith(".bin") and name != data_file:
+            try:
+                os.unlink(os.path.join(output_dir, name))
+            except OSError as e:
+                # On Windows a server that still has the old bank mapped
+                # keeps it locked; the next build removes it.
+                print(f"Kept old data file {name}, it is still in use: {e}")
+
+    print(f"Wrote {len(index_entries)} entries ({offset} bytes) to {output_dir}")
+
+
+def lookup_audio(key: str, count: bool = True) -> bytes | memoryview | None:
+    if phrase_bank is not None:
+        data = phrase_bank.get(key, count)
+        if data is not None:
+            return data
+    return synthesis_cache.get(key, count)
+
+
+class EngineLoading(Exception):
+    """Raised for requests that need an engine which is still loading."""
+
+
+def require_engine(engine: str):
+    if not ENGINE_READY[engine].is_set():
+        raise EngineLoading(f"The {engine} engine is still loading. Try again shortly.")
+
+
+class ForegroundActivity:
+    """Counts foreground renders so background work can wait for quiet."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+        self.last_active = time.monotonic()
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.last_active = time.monotonic()
+
+    def quiet_for(self) -> float:
+        with self._lock:
+            return 0.0 if self.active else time.monotonic() - self.last_active
+
+
+foreground_activity = ForegroundActivity()
+
+
+def render_audio(engine: str, parsed: AudioRequest, timer: StageTimer | None = None,
+                 background: bool = False, count: bool = True) -> tuple[bytes | memoryview, bool]:
+    """Return (audio, cached) for a request, synthesizing only on a miss.
+
+    The canonical WAV and each encoded variant are cached separately, so a
+    new format for a known line only costs an encode. ``background`` renders
+    (prefetch hints) are not counted as foreground activity. ``count=False``
+    keeps the first cache lookup out of the hit/miss stats when the caller
+    has already counted it.
+    """
+    timer = timer or StageTimer()
+    timer.engine = engine
+    key = audio_key(engine, parsed.voice, parsed.input_string, *parsed.variant)
+    data = lookup_audio(key, count)
+    if data is not None:
+        if prefetcher is not None:
+            prefetcher.note_hit(key)
+        return data, True
+    if background:
+        return synthesize_audio(engine, parsed, timer, key), False
+
+    with foreground_activity.track():
+        # A prefetch hint may be rendering this very line; wait for it
+        # rather than synthesizing it twice.
+        if prefetcher is not None and prefetcher.wait_running(key):
+            data = lookup_audio(key)
+            if data is not None:
+                prefetcher.note_hit(key)
+                return data, True
+
+        # Only misses are degraded: a full-quality line in the cache is free.
+        degraded = overload.degrade(engine, parsed)
+        if degraded is not None:
+            timer.degraded, engine, parsed = degraded
+            timer.engine = engine
+            key = audio_key(engine, parsed.voice, parsed.input_string, *parsed.variant)
+            data = lookup_audio(key)
+            if data is not None:
+                return data, True
+        return synthesize_audio(engine, parsed, timer, key), False
+
+
+def synthesize_audio(engine: str, parsed: AudioRequest, timer: StageTimer, key: str) -> bytes | memoryview:
+    wav_key = audio_key(engine, parsed.voice, parsed.input_string, *parsed.processing)
+    wav = lookup_audio(wav_key) if parsed.encoding else None
+    if wav is None:
+        wav = ENGINES[engine].synthesize(parsed, timer)
+        timer.audio_seconds = wav_duration(wav)
+        synthesis_cache.put(wav_key, wav)
+
+    if not parsed.encoding:
+        return wav
+
+    with timer.time("encode"):
+        data = encode_audio(wav, parsed.format, parsed.sample_rate)
+    synthesis_cache.put(key, data)
+    return data
+
+
+def render_vits(parsed: AudioRequest, timer: StageTimer) -> bytes | memoryview:
+    length_scale = FAST_LENGTH_SCALE if parsed.quality == "fast" else 1.0
+    with vits_residency.use():
+        return generate_wav(parsed.input_string, parsed.voice, timer,
+                            parsed.normalize, parsed.trim_silence, parsed.effects, length_scale)
+
+
+def render_robotic(parsed: AudioRequest, timer: StageTimer) -> bytes | memoryview:
+    # espeak phonemizes and synthesizes in one call.
+    with timer.time("inference"):
+        wav = generate_robotic_wav(parsed.input_string, parsed.voice).getvalue()
+    if parsed.processing:
+        with timer.time("postprocess"):
+            wav = reprocess_wav(wav, parsed.normalize, parsed.trim_silence, parsed.effects)
+    return wav
+
+
+@app.route("/generate-audio", methods=["POST"])
+def generate_audio():
+    start_time = time.perf_counter()
+    timer = StageTimer()
+
+    with timer.time("parse"):
+        try:
+            parsed = parse_audio_request(request.get_json(silent=True), negotiate_format(request.accept_mimetypes))
+            engine, parsed = route_request("vits", parsed)
+        except EngineLoading as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    try:
+        audio, cached = render_audio(engine, parsed, timer)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error generating audio: {str(e)}"}), 500
+
+    duration = time.perf_counter() - start_time
+    print(f"{'Served cached' if cached else 'Generated'} audio in {duration:.4f}s")
+
+    response = mark_degraded(audio_response(audio, parsed.format, "output"), timer.engine, timer.degraded)
+    return observe_response(response, timer, "/generate-audio", parsed.voice, parsed.input_string, cached, start_time)
+
+
+@app.route("/generate-audio/stream", methods=["POST"])
+def generate_audio_stream():
+    endpoint = "/generate-audio/stream"
+    start_time = time.perf_counter()
+    timer = StageTimer()
+
+    with timer.time("parse"):
+        try:
+            parsed = parse_audio_request(request.get_json(silent=True))
+            # Only VITS streams, so routes don't apply.
+            _, parsed = route_request("vits", parsed, reroute=False)
+        except EngineLoading as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if parsed.variant:
+            return jsonify({"error": "Streaming only supports wav at the model sample rate, "
+                                     "with peak normalization and no effects."}), 400
+
+    # A pre-rendered phrase is already complete, so it beats streaming.
+    banked = phrase_bank.get(audio_key("vits", parsed.voice, parsed.input_string)) if phrase_bank else None
+    if banked is not None:
+        response = Response([banked], mimetype="audio/wav", headers={"Content-Length": str(banked.nbytes)})
+        return observe_response(response, timer, endpoint, parsed.voice, parsed.input_string, True, start_time)
+
+    key = cache_key("generate-audio/stream", VITS_MODEL_ID, parsed.voice, parsed.input_string)
+    wav_bytes = synthesis_cache.get(key)
+    if wav_bytes is not None:
+        duration = time.perf_counter() - start_time
+        print(f"Served cached streamed audio in {duration:.4f}s")
+        response = Response(wav_bytes, mimetype="audio/wav")
+        return observe_response(response, timer, endpoint, parsed.voice, parsed.input_string, True, start_time)
+
+    def on_complete(data: bytes):
+        synthesis_cache.put(key, data)
+        duration = time.perf_counter() - start_time
+        timer.record(endpoint, parsed.voice, parsed.input_string, False, duration)
+        print(f"Streamed audio in {duration:.4f}s")
+
+    # No Content-Length, so waitress sends the body with chunked encoding as
+    # each piece is yielded.
+    return Response(stream_wav(parsed.input_string, parsed.voice, on_complete, timer), mimetype="audio/wav")
+
+
+@app.route("/generate_audio_robotic", methods=["POST"])
+def generate_audio_robotic():
+    start_time = time.perf_counter()
+    timer = StageTimer()
+
+    with timer.time("parse"):
+        try:
+            parsed = parse_audio_request(request.get_json(silent=True), negotiate_format(request.accept_mimetypes))
+            engine, parsed = route_request("robotic", parsed)
+        except EngineLoading as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    try:
+        audio, cached = render_audio(engine, parsed, timer)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error generating audio: {str(e)}"}), 500
+
+    duration = time.perf_counter() - start_time
+    print(f"{'Served cached' if cached else 'Generated'} robotic audio in {duration:.4f}s")
+
+    response = mark_degraded(audio_response(audio, parsed.format, "output_robotic"), timer.engine, timer.degraded)
+    return observe_response(response, timer, "/generate_audio_robotic", parsed.voice, parsed.input_string, cached,
+                            start_time)
+
+
+class Engine:
+    """A synthesis backend the routing layer can send lines to.
+
+    Each engine declares its voices, a nominal cost (compute seconds per
+    second of audio) and how many lines it may render at once (0 = no
+    limit; changeable at runtime). ``render`` returns the post-processed WAV
+    for a request and ``load`` readies the engine at startup.
+    """
+
+    def __init__(self, name: str, voices: Callable[[], Collection[str]],
+                 render: Callable[[AudioRequest, StageTimer], bytes | memoryview],
+                 load: Callable[[], None], cost: float, max_concurrency: int = 0):
+        self.name = name
+        self.voices = voices
+        self.render = render
+        self.load = load
+        self.cost = cost
+        self.max_concurrency = max(0, max_concurrency)
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.rendered = 0
+        self.render_seconds = 0.0
+        self.audio_seconds = 0.0
+        # (finished at, render seconds, audio seconds) of the latest renders.
+        self._recent: deque[tuple[float, float, float]] = deque(maxlen=256)
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            self.waiting += 1
+            try:
+                self._cond.wait_for(lambda: not self.max_concurrency or self.in_flight < self.max_concurrency)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify()
+
+    def set_max_concurrency(self, limit: int):
+        with self._cond:
+            self.max_concurrency = max(0, limit)
+            self._cond.notify_all()
+
+    def synthesize(self, parsed: AudioRequest, timer: StageTimer) -> bytes | memoryview:
+        waited = time.perf_counter()
+        with self.slot():
+            started = time.perf_counter()
+            timer.add("queue", started - waited)
+            wav = self.render(parsed, timer)
+        seconds, audio_seconds = time.perf_counter() - started, wav_duration(wav)
+        with self._cond:
+            self.rendered += 1
+            self.render_seconds += seconds
+            self.audio_seconds += audio_seconds
+            self._recent.append((time.monotonic(), seconds, audio_seconds))
+        return wav
+
+    def recent_rtf(self, window_s: float) -> float:
+        """Wall-clock real-time factor of the renders finished in the last ``window_s``."""
+        since = time.monotonic() - window_s
+        with self._cond:
+            recent = [(seconds, audio) for finished, seconds, audio in self._recent if finished >= since]
+        audio_seconds = sum(audio for _, audio in recent)
+        return sum(seconds for seconds, _ in recent) / audio_seconds if audio_seconds else 0.0
+
+    def substitute_voice(self, voice: str) -> str:
+        # A line rerouted from another engine keeps its voice where this
+        # engine has it; otherwise each voice maps to one stable stand-in.
+        voices = sorted(self.voices())
+        if voice in voices:
+            return voice
+        return voices[int(hashlib.sha256(voice.encode("utf-8")).hexdigest()[:8], 16) % len(voices)]
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            return {
+                "voices_count": len(self.voices()),
+                "cost": self.cost,
+                "observed_rtf": round(self.render_seconds / self.audio_seconds, 4) if self.audio_seconds else None,
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "rendered": self.rendered,
+            }
+
+
+def register_engine(engine: Engine):
+    ENGINES[engine.name] = engine
+    ENGINE_READY.setdefault(engine.name, threading.Event())
+
+
+class Router:
+    """Priority routes between engines, changeable at runtime.
+
+    ``routes[engine][priority]`` names the engine that renders lines asked of
+    ``engine`` at that priority instead, e.g. VITS chatter on espeak so VITS
+    capacity is kept for announcements.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes: dict[str, dict[str, str]] = {}
+        self.rerouted: dict[str, int] = {}
+
+    def update(self, routes: Any):
+        """Merge ``{engine: {priority: target or None}}``; None removes a route."""
+        if not isinstance(routes, dict):
+            raise ValueError("routes must be an object of {engine: {priority: engine}}.")
+        for source, by_priority in routes.items():
+            if source not in ENGINES:
+                raise ValueError(f"Unknown engine {source!r}; engines are: {list(ENGINES)}")
+            if not isinstance(by_priority, dict):
+                raise ValueError(f"routes[{source!r}] must be an object of {{priority: engine}}.")
+            for priority, target in by_priority.items():
+                parse_priority(priority)
+                if target is not None and (not isinstance(target, str) or target not in ENGINES):
+                    raise ValueError(f"Unknown engine {target!r}; engines are: {list(ENGINES)}")
+
+        with self._lock:
+            for source, by_priority in routes.items():
+                current = self.routes.setdefault(source, {})
+                for priority, target in by_priority.items():
+                    if target is None or target == source:
+                        current.pop(priority, None)
+                    else:
+                        current[priority] = target
+                if not current:
+                    del self.routes[source]
+
+    def target(self, engine: str, priority: str) -> str:
+        with self._lock:
+            return self.routes.get(engine, {}).get(priority, engine)
+
+    def count(self, source: str, target: str):
+        with self._lock:
+            name = f"{source}->{target}"
+            self.rerouted[name] = self.rerouted.get(name, 0) + 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "routes": {source: dict(by_priority) for source, by_priority in self.routes.items()},
+                "rerouted": dict(self.rerouted),
+            }
+
+
+def parse_routes(spec: str) -> dict[str, dict[str, str]]:
+    # "vits:chatter=robotic,vits:normal=robotic"
+    routes: dict[str, dict[str, str]] = {}
+    for rule in filter(None, (part.strip() for part in spec.split(","))):
+        source, _, rest = rule.partition(":")
+        priority, _, target = rest.partition("=")
+        if not source or not priority or not target:
+            raise RuntimeError(f"HONKTTS_ROUTES entries look like engine:priority=engine, got {rule!r}")
+        routes.setdefault(source.strip(), {})[priority.strip()] = target.strip()
+    return routes
+
+
+def route_request(engine: Any, parsed: AudioRequest, reroute: bool = True) -> tuple[str, AudioRequest]:
+    """Check the requested engine and voice, then apply the priority routes.
+
+    Returns the engine that will render the line and the request to render,
+    whose voice is substituted when the line was routed to another engine.
+    A route to an engine that is still loading is ignored.
+    """
+    if not isinstance(engine, str) or engine not in ENGINES:
+        raise ValueError(f"engine must be one of: {list(ENGINES)}")
+    voices = ENGINES[engine].voices()
+    if not voices:
+        # Some engines only know their voices once loaded.
+        require_engine(engine)
+    if parsed.voice not in voices:
+        raise ValueError(f"Invalid voice. Valid options are: {sorted(voices)}")
+
+    target = router.target(engine, parsed.priority) if reroute else engine
+    if target != engine and ENGINE_READY[target].is_set():
+        router.count(engine, target)
+        return target, replace(parsed, voice=ENGINES[target].substitute_voice(parsed.voice))
+    require_engine(engine)
+    return engine, parsed
+
+
+class OverloadController:
+    """Degrades VITS lines while the model is falling behind.
+
+    Pressure comes from two signals: segments waiting for the model (queued
+    in the batch scheduler or for a VITS slot) against ``queue_depth``, and
+    the wall-clock real-time factor of recent VITS renders against
+    ``rtf``. Each multiple of a threshold is one level, up to 2; a threshold
+    of 0 turns that signal off.
+
+    Under pressure a line steps down the ladder: full VITS, then VITS with
+    a shorter length scale (fewer decoder frames), then whatever VITS audio
+    is already cached, else espeak. Chatter steps down one level earlier
+    than normal lines and announcements one level later.
+    """
+
+    WINDOW_S = 10.0
+
+    def __init__(self, queue_depth: int, rtf: float):
+        self.queue_depth = max(0, queue_depth)
+        self.rtf = max(0.0, rtf)
+        self._lock = threading.Lock()
+        self.degraded = {"fast": 0, "robotic": 0}
+
+    def pressure(self) -> tuple[int, int, float]:
+        """(level, queued segments, recent real-time factor)."""
+        vits = ENGINES["vits"]
+        queued = synthesis_batcher.stats()["pending"] + vits.waiting if synthesis_batcher is not None else 0
+        rtf = vits.recent_rtf(self.WINDOW_S)
+        level = max(
+            queued // self.queue_depth if self.queue_depth else 0,
+            int(rtf / self.rtf) if self.rtf else 0,
+        )
+        return min(level, 2), queued, rtf
+
+    def degrade(self, engine: str, parsed: AudioRequest) -> tuple[str, str, AudioRequest] | None:
+        """(how, engine, request) to render instead, or None for full quality."""
+        if engine != "vits" or parsed.quality != "full" or not (self.queue_depth or self.rtf):
+            return None
+        level = self.pressure()[0]
+        steps = min(2, level + PRIORITIES[parsed.priority] - PRIORITIES["normal"]) if level else 0
+        if steps <= 0:
+            return None
+
+        fast = replace(parsed, quality="fast")
+        if steps >= 2 and ENGINE_READY["robotic"].is_set():
+            # The cache answers before espeak does.
+            if lookup_audio(audio_key("vits", fast.voice, fast.input_string, *fast.variant)) is None:
+                robotic = ENGINES["robotic"]
+                choice = ("robotic", "robotic", replace(parsed, voice=robotic.substitute_voice(parsed.voice)))
+            else:
+                choice = ("fast", "vits", fast)
+        else:
+            choice = ("fast", "vits", fast)
+
+        with self._lock:
+            self.degraded[choice[0]] += 1
+        return choice
+
+    def stats(self) -> dict[str, Any]:
+        level, queued, rtf = self.pressure()
+        with self._lock:
+            return {
+                "level": level,
+                "queued_segments": queued,
+                "recent_rtf": round(rtf, 4),
+                "queue_depth_threshold": self.queue_depth,
+                "rtf_threshold": self.rtf,
+                "degraded": dict(self.degraded),
+            }
+
+
+# Batch bundle: magic, u32 item count, then per item (in request order)
+# u16 status, u16 content-type length, content type, u32 payload length,
+# payload. Failed items carry a JSON {"error": ...} payload.
+BUNDLE_MAGIC = b"HTB1"
+BUNDLE_MIMETYPE = "application/x-honktts-bundle"
+
+
+def parse_batch_item(item: Any) -> tuple[str, AudioRequest]:
+    parsed = parse_audio_request(item)
+    return route_request(item.get("engine", "vits"), parsed)
+
+
+def bundle_part(status: int, content_type: str, payload: bytes | memoryview) -> list[bytes | memoryview]:
+    content_type_bytes = content_type.encode("ascii")
+    return [
+        struct.pack("<HH", status, len(content_type_bytes)) + content_type_bytes + struct.pack("<I", len(payload)),
+        payload,
+    ]
+
+
+@app.route("/generate-audio/batch", methods=["POST"])
+def generate_audio_batch():
+    endpoint = "/generate-audio/batch"
+    start_time = time.perf_counter()
+    timer = StageTimer()
+    parse_started = time.perf_counter()
+
+    payload = request.get_json(silent=True)
+    items = payload.get("items") if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items must be a non-empty list."}), 400
+    if len(items) > BATCH_REQUEST_MAX_ITEMS:
+        return jsonify({"error": f"A batch can hold at most {BATCH_REQUEST_MAX_ITEMS} items."}), 400
+
+    # Identical lines are rendered once; all unique lines are rendered
+    # concurrently so VITS items share forward passes in the scheduler.
+    results: list[tuple[int, str, bytes | memoryview]] = [(0, "", b"")] * len(items)
+    unique: dict[str, tuple[str, AudioRequest, list[int]]] = {}
+    for i, item in enumerate(items):
+        try:
+            engine, parsed = parse_batch_item(item)
+        except EngineLoading as e:
+            results[i] = (503, "application/json", json.dumps({"error": str(e)}).encode())
+            continue
+        except ValueError as e:
+            results[i] = (400, "application/json", json.dumps({"error": str(e)}).encode())
+            continue
+        key = audio_key(engine, parsed.voice, parsed.input_string, *parsed.variant)
+        unique.setdefault(key, (engine, parsed, []))[2].append(i)
+    timer.add("parse", time.perf_counter() - parse_started)
+
+    # Items report their own synthesis stages; parse and send are recorded
+    # once for the whole batch under an empty voice label.
+    item_timers = {key: StageTimer() for key in unique}
+    futures = {
+        key: render_executor.submit(render_audio, engine, parsed, item_timers[key])
+        for key, (engine, parsed, _) in unique.items()
+    }
+    for key, future in futures.items():
+        _, parsed, indices = unique[key]
+        try:
+            audio, cached = future.result()
+            item_timers[key].record(endpoint, parsed.voice, parsed.input_string, cached)
+            result = (200, item_content_type(parsed.format, item_timers[key].degraded), audio)
+        except ValueError as e:
+            result = (400, "application/json", json.dumps({"error": str(e)}).encode())
+        except Exception as e:
+            result = (500, "application/json", json.dumps({"error": f"Error generating audio: {str(e)}"}).encode())
+        for i in indices:
+            results[i] = result
+
+    body: list[bytes | memoryview] = [BUNDLE_MAGIC + struct.pack("<I", len(results))]
+    for status, content_type, data in results:
+        body.extend(bundle_part(status, content_type, data))
+
+    duration = time.perf_counter() - start_time
+    print(f"Generated batch of {len(items)} items ({len(unique)} unique) in {duration:.4f}s")
+
+    length = sum(len(part) if isinstance(part, bytes) else part.nbytes for part in body)
+    response = Response(body, mimetype=BUNDLE_MIMETYPE, headers={"Content-Length": str(length)})
+    return observe_response(response, timer, endpoint, "", "", False, start_time)
+
+
+@dataclass
+class Job:
+    id: str
+    engine: str
+    parsed: AudioRequest
+    priority: int
+    deadline: float | None
+    submitted_at: float = field(default_factory=time.monotonic)
+    status: str = "queued"
+    result: bytes | memoryview | None = None
+    error: str | None = None
+    error_status: int = 500
+    degraded: str | None = None
+    finished_at: float | None = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+    def finish(self, status: str):
+        self.status = status
+        self.finished_at = time.monotonic()
+        self.done.set()
+
+    def describe(self) -> dict[str, Any]:
+        return {"job_id": self.id, "status": self.status, "error": self.error}
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Bounded priority queue feeding a fixed set of job runner threads.
+
+    When the queue is full a new job displaces the lowest-priority queued
+    job if it outranks it, otherwise it is rejected. Jobs whose deadline has
+    passed by the time a runner picks them up are shed without synthesis.
+    """
+
+    def __init__(self, max_depth: int, runners: int, result_ttl_s: float):
+        self.max_depth = max_depth
+        self.result_ttl_s = result_ttl_s
+        self._heap: list[tuple[int, int, Job]] = []
+        self._jobs: dict[str, Job] = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._runners = [
+            threading.Thread(target=self._run, name=f"job-runner-{i}", daemon=True)
+            for i in range(max(1, runners))
+        ]
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.displaced = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.wait_ema_s = 0.0
+        self.max_wait_s = 0.0
+
+    def start(self):
+        for thread in self._runners:
+            thread.start()
+
+    def submit(self, job: Job):
+        with self._cond:
+            self._sweep()
+            if len(self._heap) >= self.max_depth:
+                self._prune()
+
+            if len(self._heap) >= self.max_depth:
+                lowest = max(self._heap)
+                if lowest[0] <= job.priority:
+                    self.rejected += 1
+                    raise QueueFull()
+                self._heap.remove(lowest)
+                heapq.heapify(self._heap)
+                lowest[2].error = "Displaced by a higher-priority job."
+                lowest[2].finish("shed")
+                self.displaced += 1
+
+            self._seq += 1
+            heapq.heappush(self._heap, (job.priority, self._seq, job))
+            self._jobs[job.id] = job
+            self._cond.notify()
+
+    def submit_finished(self, job: Job):
+        with self._cond:
+            self._sweep()
+            self._jobs[job.id] = job
+            self.completed += 1
+
+    def get(self, job_id: str) -> Job | None:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job | None:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status == "queued":
+                job.error = "Cancelled."
+                job.finish("cancelled")
+                self.cancelled += 1
+            return job
+
+    def _prune(self):
+        # Drop cancelled entries and shed expired ones before deciding the
+        # queue is really full.
+        now = time.monotonic()
+        kept = []
+        for entry in self._heap:
+            job = entry[2]
+            if job.status != "queued":
+                continue
+            if job.deadline is not None and now >= job.deadline:
+                job.error = "Deadline passed before synthesis started."
+                job.finish("expired")
+                self.expired += 1
+                continue
+            kept.append(entry)
+        heapq.heapify(kept)
+        self._heap = kept
+
+    def _sweep(self):
+        # Forget finished jobs nobody collected within the TTL.
+        now = time.monotonic()
+        stale = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.result_ttl_s
+        ]
+        for job_id in stale:
+            del self._jobs[job_id]
+
+    def _next(self) -> Job:
+        with self._cond:
+            while True:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._heap)
+                if job.status != "queued":
+                    continue  # cancelled or displaced while waiting
+
+                waited = time.monotonic() - job.submitted_at
+                self.wait_ema_s = waited if not self.max_wait_s else 0.9 * self.wait_ema_s + 0.1 * waited
+                self.max_wait_s = max(self.max_wait_s, waited)
+
+                if job.deadline is not None and time.monotonic() >= job.deadline:
+                    job.error = "Deadline passed before synthesis started."
+                    job.finish("expired")
+                    self.expired += 1
+                    continue
+
+                job.status = "running"
+                self.running += 1
+                return job
+
+    def _run(self):
+        while True:
+            job = self._next()
+            timer = StageTimer()
+            # Time spent in the job queue only; waiting for the engine is
+            # added by Engine.synthesize.
+            timer.add("queue", time.monotonic() - job.submitted_at)
+            try:
+                # submit_job already counted this line's cache miss.
+                job.result, cached = render_audio(job.engine, job.parsed, timer, count=False)
+                job.engine, job.degraded = timer.engine, timer.degraded
+                timer.record("/jobs", job.parsed.voice, job.parsed.input_string, cached,
+                             time.monotonic() - job.submitted_at)
+                status = "done"
+            except ValueError as e:
+                job.error, job.error_status, status = str(e), 400, "failed"
+            except Exception as e:
+                job.error, status = f"Error generating audio: {str(e)}", "failed"
+
+            with self._cond:
+                self.running -= 1
+                if status == "done":
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                job.finish(status)
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            queued = [entry[2] for entry in self._heap if entry[2].status == "queued"]
+            names = {value: name for name, value in PRIORITIES.items()}
+            by_priority = {name: 0 for name in PRIORITIES}
+            for job in queued:
+                by_priority[names[job.priority]] += 1
+            return {
+                "depth": len(queued),
+                "max_depth": self.max_depth,
+                "depth_by_priority": by_priority,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "shed_expired": self.expired,
+                "shed_displaced": self.displaced,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+                "wait_ema_ms": round(self.wait_ema_s * 1000, 3),
+                "max_wait_ms": round(self.max_wait_s * 1000, 3),
+            }
+
+
+def parse_job_options(payload: dict) -> tuple[int, float | None]:
+    priority_name = parse_priority(payload.get("priority", "normal"))
+
+    deadline_ms = payload.get("deadline_ms")
+    if deadline_ms is None:
+        return PRIORITIES[priority_name], None
+    if isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float)) or deadline_ms <= 0:
+        raise ValueError("deadline_ms must be a positive number.")
+    return PRIORITIES[priority_name], time.monotonic() + deadline_ms / 1000
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    payload = request.get_json(silent=True)
+    try:
+        engine, parsed = parse_batch_item(payload)
+        priority, deadline = parse_job_options(payload)
+    except EngineLoading as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    job = Job(id=uuid.uuid4().hex, engine=engine, parsed=parsed, priority=priority, deadline=deadline)
+
+    # Lines that are already rendered complete immediately without queueing.
+    cached = lookup_audio(audio_key(engine, parsed.voice, parsed.input_string, *parsed.variant))
+    try:
+        if cached is not None:
+            job.result = cached
+            job.finish("done")
+            job_queue.submit_finished(job)
+        else:
+            job_queue.submit(job)
+    except QueueFull:
+        return jsonify({"error": "Job queue is full."}), 429, {"Retry-After": "1"}
+
+    return jsonify(job.describe()), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job id."}), 404
+
+    # Long-poll: hold the request until the job finishes or `wait` runs out.
+    try:
+        wait = min(float(request.args.get("wait", 0)), JOB_MAX_WAIT_S)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds."}), 400
+    if wait > 0:
+        job.done.wait(wait)
+
+    if job.status == "done":
+        return mark_degraded(audio_response(job.result, job.parsed.format, "output"), job.engine, job.degraded)
+    if job.status in ("queued", "running"):
+        return jsonify(job.describe()), 202
+    if job.status == "failed":
+        return jsonify(job.describe()), job.error_status
+    return jsonify(job.describe()), 410
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id: str):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job id."}), 404
+    return jsonify(job.describe())
+
+
+@dataclass
+class Hint:
+    id: str
+    engine: str
+    parsed: AudioRequest
+    key: str
+
+
+class Prefetcher:
+    """Renders hinted lines into the synthesis cache while the server is idle.
+
+    Hints are queued oldest first and bounded; a full queue drops its oldest
+    hint. One background thread renders a hint only once the batch
+    scheduler and all foreground renders have been quiet for ``idle_s``, so
+    a foreground request waits at most for the forward pass already running.
+    """
+
+    def __init__(self, max_hints: int, idle_s: float):
+        self.max_hints = max(1, max_hints)
+        self.idle_s = idle_s
+        self._hints: OrderedDict[str, Hint] = OrderedDict()
+        self._ids_by_key: dict[str, str] = {}
+        self._running: dict[str, threading.Event] = {}
+        self._prefetched: OrderedDict[str, None] = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, name="prefetch", daemon=True)
+        self.hinted = 0
+        self.already_cached = 0
+        self.rendered = 0
+        self.cancelled = 0
+        self.dropped = 0
+        self.failed = 0
+        self.hits = 0
+
+    def start(self):
+        self._thread.start()
+
+    def hint(self, engine: str, parsed: AudioRequest) -> dict[str, str]:
+        key = audio_key(engine, parsed.voice, parsed.input_string, *parsed.variant)
+        # Hints are not requests for audio, so they stay out of the cache
+        # stats; the prefetcher's own counters track them.
+        if lookup_audio(key, count=False) is not None:
+            with self._cond:
+                self.already_cached += 1
+            return {"status": "cached"}
+
+        with self._cond:
+            self.hinted += 1
+            if key in self._running:
+                return {"status": "running"}
+            if key in self._ids_by_key:
+                return {"id": self._ids_by_key[key], "status": "queued"}
+
+            if len(self._hints) >= self.max_hints:
+                _, oldest = self._hints.popitem(last=False)
+                del self._ids_by_key[oldest.key]
+                self.dropped += 1
+            hint = Hint(id=uuid.uuid4().hex, engine=engine, parsed=parsed, key=key)
+            self._hints[hint.id] = hint
+            self._ids_by_key[key] = hint.id
+            self._cond.notify()
+            return {"id": hint.id, "status": "queued"}
+
+    def cancel(self, hint_id: str) -> bool:
+        with self._cond:
+            hint = self._hints.pop(hint_id, None)
+            if hint is None:
+                return False
+            del self._ids_by_key[hint.key]
+            self.cancelled += 1
+            return True
+
+    def wait_running(self, key: str) -> bool:
+        with self._cond:
+            done = self._running.get(key)
+        if done is None:
+            return False
+        done.wait()
+        return True
+
+    def note_hit(self, key: str):
+        # Counts the first foreground request served by each prefetched line.
+        with self._cond:
+            if key in self._prefetched:
+                del self._prefetched[key]
+                self.hits += 1
+
+    def _wait_for_idle(self):
+        while True:
+            quiet = min(synthesis_batcher.quiet_for(), foreground_activity.quiet_for())
+            if quiet >= self.idle_s:
+                return
+            time.sleep(max(0.005, self.idle_s - quiet))
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._hints:
+                    self._cond.wait()
+
+            self._wait_for_idle()
+            with self._cond:
+                if not self._hints:
+                    continue
+                _, hint = self._hints.popitem(last=False)
+                del self._ids_by_key[hint.key]
+                done = self._running[hint.key] = threading.Event()
+
+            try:
+                require_engine(hint.engine)
+                render_audio(hint.engine, hint.parsed, background=True, count=False)
+            except Exception as e:
+                print(f"Prefetch of {hint.engine}/{hint.parsed.voice} failed: {e}")
+                with self._cond:
+                    self.failed += 1
+            else:
+                with self._cond:
+                    self.rendered += 1
+                    self._prefetched[hint.key] = None
+                    while len(self._prefetched) > 4 * self.max_hints:
+                        self._prefetched.popitem(last=False)
+            finally:
+                with self._cond:
+                    del self._running[hint.key]
+                done.set()
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            return {
+                "queued": len(self._hints),
+                "running": len(self._running),
+                "max_hints": self.max_hints,
+                "idle_ms": round(self.idle_s * 1000, 3),
+                "hinted": self.hinted,
+                "already_cached": self.already_cached,
+                "rendered": self.rendered,
+                "cancelled": self.cancelled,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "hits": self.hits,
+            }
+
+
+@app.route("/prefetch", methods=["POST"])
+def prefetch():
+    payload = request.get_json(silent=True)
+    items = payload.get("items", [payload]) if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Body must be a hint object or {\"items\": [...]}."}), 400
+    if len(items) > BATCH_REQUEST_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_REQUEST_MAX_ITEMS} hints per request."}), 400
+
+    hints = []
+    for item in items:
+        try:
+            engine, parsed = parse_batch_item(item)
+        except (EngineLoading, ValueError) as e:
+            hints.append({"status": "rejected", "error": str(e)})
+            continue
+        hints.append(prefetcher.hint(engine, parsed))
+    return jsonify({"hints": hints}), 202
+
+
+@app.route("/prefetch/<hint_id>", methods=["DELETE"])
+def cancel_prefetch(hint_id: str):
+    if not prefetcher.cancel(hint_id):
+        return jsonify({"error": "Unknown hint id, or the hint already started."}), 404
+    return jsonify({"id": hint_id, "status": "cancelled"})
+
+
+class PipeServer:
+    """Persistent length-prefixed TCP channel for pipelined synthesis.
+
+    After the server's ``HTP1`` greeting, the client sends frames of a
+    little-endian ``u32`` length and a JSON object with the fields of a
+    ``/generate-audio/batch`` item plus a numeric ``id``. Each request is
+    rendered as soon as it arrives; answers are written in completion order
+    as frames of a ``u32`` length, then ``u32`` id, ``u16`` status, ``u16``
+    content-type length, the content type and the payload. A connection has
+    at most ``max_in_flight`` unanswered requests; beyond that the server
+    stops reading, which pushes back on the client through TCP.
+    """
+
+    MAGIC = b"HTP1"
+    NO_ID = 0xFFFFFFFF
+    MAX_FRAME = 64 * 1024
+
+    def __init__(self, host: str, port: int, max_in_flight: int):
+        self.max_in_flight = max(1, max_in_flight)
+        self._sock = socket.create_server((host, port))
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.open_connections = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.errors = 0
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, name="pipe-accept", daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError as e:
+                print(f"Pipe accept failed: {e}")
+                time.sleep(0.1)
+                continue
+            with self._lock:
+                self.connections += 1
+                self.open_connections += 1
+            threading.Thread(target=self._serve, args=(conn,), name="pipe-conn", daemon=True).start()
+
+    @staticmethod
+    def _recv_exact(conn: socket.socket, size: int) -> bytes | None:
+        data = bytearray()
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return bytes(data)
+
+    def _serve(self, conn: socket.socket):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+        outbox: queue.Queue = queue.Queue()
+        writer = threading.Thread(target=self._write_loop, args=(conn, outbox, slots), name="pipe-writer", daemon=True)
+        writer.start()
+
+        try:
+            conn.sendall(self.MAGIC)
+            while True:
+                header = self._recv_exact(conn, 4)
+                if header is None:
+                    break
+                length = struct.unpack("<I", header)[0]
+                if length > self.MAX_FRAME:
+                    print(f"Closing pipe connection: {length}-byte frame exceeds {self.MAX_FRAME}")
+                    break
+                body = self._recv_exact(conn, length)
+                if body is None:
+                    break
+                slots.acquire()
+                self._dispatch(body, outbox)
+        except OSError:
+            pass
+        finally:
+            # The client is done sending (or gone); let what is still in
+            # flight finish, so it is answered or at least accounted for.
+            for _ in range(self.max_in_flight):
+                slots.acquire()
+            outbox.put(None)
+            writer.join()
+            conn.close()
+            with self._lock:
+                self.open_connections -= 1
+
+    def _dispatch(self, body: bytes, outbox: queue.Queue):
+        started = time.perf_counter()
+        timer = StageTimer()
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+
+        def reply(request_id: int, status: int, content_type: str, payload: bytes | memoryview, record=None):
+            outbox.put((request_id, status, content_type, payload, record))
+
+        def error(request_id: int, status: int, message: str):
+            reply(request_id, status, "application/json", json.dumps({"error": message}).encode())
+
+        try:
+            item = json.loads(body)
+        except ValueError:
+            error(self.NO_ID, 400, "Frame is not valid JSON.")
+            return
+        request_id = item.get("id") if isinstance(item, dict) else None
+        if isinstance(request_id, bool) or not isinstance(request_id, int) or not 0 <= request_id < self.NO_ID:
+            error(self.NO_ID, 400, f"id must be an integer between 0 and {self.NO_ID - 1}.")
+            return
+
+        with timer.time("parse"):
+            try:
+                engine, parsed = parse_batch_item(item)
+            except EngineLoading as e:
+                error(request_id, 503, str(e))
+                return
+            except ValueError as e:
+                error(request_id, 400, str(e))
+                return
+            except Exception as e:
+                # Every request must be answered: the answer is what frees
+                # its in-flight slot.
+                error(request_id, 500, f"Error reading request: {str(e)}")
+                return
+
+        def done(future: Future):
+            try:
+                audio, cached = future.result()
+            except ValueError as e:
+                error(request_id, 400, str(e))
+            except Exception as e:
+                error(request_id, 500, f"Error generating audio: {str(e)}")
+            else:
+                reply(request_id, 200, item_content_type(parsed.format, timer.degraded), audio,
+                      (timer, parsed.voice, parsed.input_string, cached, started))
+
+        try:
+            render_executor.submit(render_audio, engine, parsed, timer).add_done_callback(done)
+        except Exception as e:
+            error(request_id, 500, f"Error generating audio: {str(e)}")
+
+    def _write_loop(self, conn: socket.socket, outbox: queue.Queue, slots: threading.BoundedSemaphore):
+        # One writer per connection, so a slow reader never stalls the
+        # render threads; after a send error the rest are drained unsent.
+        failed = False
+        while True:
+            frame = outbox.get()
+            if frame is None:
+                return
+            request_id, status, content_type, payload, record = frame
+            content_type_bytes = content_type.encode("ascii")
+            header = struct.pack("<IIHH", 8 + len(content_type_bytes) + len(payload), request_id, status,
+                                 len(content_type_bytes)) + content_type_bytes
+            sent = time.perf_counter()
+            if not failed:
+                try:
+                    conn.sendall(header)
+                    conn.sendall(payload)
+                except OSError:
+                    failed = True
+
+            with self._lock:
+                self.in_flight -= 1
+                if status != 200:
+                    self.errors += 1
+            if record is not None:
+                timer, voice, text, cached, started = record
+                finished = time.perf_counter()
+                timer.add("send", finished - sent)
+                timer.record("/pipe", voice, text, cached, finished - started)
+            slots.release()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "port": self._sock.getsockname()[1],
+                "connections": self.connections,
+                "open_connections": self.open_connections,
+                "requests": self.requests,
+                "in_flight": self.in_flight,
+                "errors": self.errors,
+            }
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+
+    # Snapshot counters the subsystems already keep for /health.
+    cache = synthesis_cache.stats()
+    batching = synthesis_batcher.stats()
+    jobs = job_queue.stats()
+    for name, kind, help_text, value in (
+        ("honktts_cache_memory_hits_total", "counter", "Synthesis cache hits served from memory.", cache["hits"]),
+        ("honktts_cache_disk_hits_total", "counter", "Synthesis cache hits served from disk.", cache["disk_hits"]),
+        ("honktts_cache_misses_total", "counter", "Synthesis cache misses.", cache["misses"]),
+        ("honktts_cache_evictions_total", "counter", "Entries evicted from the in-memory cache.", cache["evictions"]),
+        ("honktts_cache_bytes", "gauge", "Bytes held by the in-memory cache.", cache["bytes"]),
+        ("honktts_batch_pending", "gauge", "Sentences waiting for the batch scheduler.", batching["pending"]),
+        ("honktts_batches_total", "counter", "Model forward passes run by the batch scheduler.", batching["batches"]),
+        ("honktts_batch_items_total", "counter", "Sentences synthesized by the batch scheduler.", batching["items"]),
+        ("honktts_job_queue_depth", "gauge", "Jobs waiting in the job queue.", jobs["depth"]),
+        ("honktts_jobs_running", "gauge", "Jobs currently being rendered.", jobs["running"]),
+        ("honktts_jobs_shed_total", "counter", "Jobs dropped for missing their deadline or being displaced.",
+         jobs["shed_expired"] + jobs["shed_displaced"]),
+        ("honktts_model_resident", "gauge", "1 while the VITS model is loaded.", int(vits_residency.resident)),
+        ("honktts_model_unloads_total", "counter", "Idle unloads of the VITS model.", vits_residency.unloads),
+        ("honktts_overload_level", "gauge", "Current overload level (0 = full quality).", overload.pressure()[0]),
+        ("honktts_degraded_responses_total", "counter", "Lines degraded by the overload controller.",
+         sum(overload.degraded.values())),
+    ):
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value:g}"])
+
+    return Response("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class ProcessMemoryCounters(ctypes.Structure):
+    _fields_ = [
+        ("cb", ctypes.c_ulong),
+        ("PageFaultCount", ctypes.c_ulong),
+        ("PeakWorkingSetSize", ctypes.c_size_t),
+        ("WorkingSetSize", ctypes.c_size_t),
+        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+        ("PagefileUsage", ctypes.c_size_t),
+        ("PeakPagefileUsage", ctypes.c_size_t),
+    ]
+
+
+def process_memory(pid: int | None = None) -> dict[str, int | None]:
+    """Resident set size and its peak in bytes, where the platform reports them.
+
+    ``pid`` (another process) is only supported on Linux.
+    """
+    status = f"/proc/{pid or 'self'}/status"
+    if os.path.exists(status):
+        fields = {}
+        try:
+            with open(status) as f:
+                for line in f:
+                    name, _, value = line.partition(":")
+                    if name in ("VmRSS", "VmHWM"):
+                        fields[name] = int(value.split()[0]) * 1024
+        except OSError:
+            pass
+        return {"rss_bytes": fields.get("VmRSS"), "peak_rss_bytes": fields.get("VmHWM")}
+    if pid is not None:
+        return {"rss_bytes": None, "peak_rss_bytes": None}
+
+    if sys.platform == "win32":
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+        if kernel32.K32GetProcessMemoryInfo(
+                ctypes.c_void_p(kernel32.GetCurrentProcess()), ctypes.byref(counters), counters.cb):
+            return {"rss_bytes": counters.WorkingSetSize, "peak_rss_bytes": counters.PeakWorkingSetSize}
+        return {"rss_bytes": None, "peak_rss_bytes": None}
+
+    import resource
+
+    # macOS reports the peak in bytes and has no cheap current RSS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"rss_bytes": None, "peak_rss_bytes": peak if sys.platform == "darwin" else peak * 1024}
+
+
+def engine_states() -> dict[str, dict[str, Any]]:
+    return {
+        name: {"ready": ENGINE_READY[name].is_set(), "load_seconds": ENGINE_LOAD_SECONDS.get(name), **engine.stats()}
+        for name, engine in ENGINES.items()
+    }
+
+
+@app.route("/health/live", methods=["GET"])
+def health_live():
+    # Answers as soon as the port is bound, before any engine has loaded.
+    return jsonify({"status": "alive"})
+
+
+@app.route("/health/ready", methods=["GET"])
+def health_ready():
+    """200 once every engine (or just ?engine=<name>) can serve requests, else 503."""
+    engines = engine_states()
+    engine = request.args.get("engine")
+    if engine is not None:
+        if engine not in engines:
+            return jsonify({"error": f"engine must be one of: {list(ENGINES)}"}), 400
+        engines = {engine: engines[engine]}
+
+    ready = all(state["ready"] for state in engines.values())
+    return jsonify({"status": "ready" if ready else "loading", "engines": engines}), 200 if ready else 503
+
+
+@app.route("/engines", methods=["GET"])
+def list_engines():
+    return jsonify({"engines": engine_states(), **router.stats()})
+
+
+@app.route("/engines", methods=["PATCH"])
+def update_engines():
+    """Change routes and concurrency limits without a restart.
+
+    Takes ``{"routes": {engine: {priority: engine or null}}}`` and/or
+    ``{"max_concurrency": {engine: n}}``.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not payload.keys() & {"routes", "max_concurrency"}:
+        return jsonify({"error": "Body must set routes and/or max_concurrency."}), 400
+
+    limits = payload.get("max_concurrency", {})
+    if not isinstance(limits, dict):
+        return jsonify({"error": "max_concurrency must be an object of {engine: n}."}), 400
+    for name, limit in limits.items():
+        if name not in ENGINES:
+            return jsonify({"error": f"Unknown engine {name!r}; engines are: {list(ENGINES)}"}), 400
+        if isinstance(limit, bool) or not isinstance(limit, int) or limit < 0:
+            return jsonify({"error": "max_concurrency values must be integers >= 0 (0 = no limit)."}), 400
+
+    try:
+        router.update(payload.get("routes", {}))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    for name, limit in limits.items():
+        ENGINES[name].set_max_concurrency(limit)
+    return list_engines()
+
+
+def build_static_health() -> tuple[bytes, str]:
+    """Serialize the parts of /health that only change when an engine loads.
+
+    Returns the JSON bytes and their ETag. Rebuilt by refresh_static_health()
+    after each engine load, never per poll.
+    """
+    static = {
+        "espeak_binary": (shutil.which(ESPEAK_BINARY) or ESPEAK_BINARY) if ESPEAK_BINARY is not None else None,
+        "espeak_version": ESPEAK_VERSION,
+        "espeak_library": ESPEAK_LIBRARY.library_path if ESPEAK_LIBRARY is not None else None,
+        "espeak_data_path": os.environ.get("ESPEAK_DATA_PATH", "not set"),
+        "python_executable": sys.executable,
+        "pid": os.getpid(),
+        "tts_model": VITS_MODEL_ID,
+        "voices": sorted(VOICES.keys()),
+        "voices_count": len(VOICES),
+        "variant_voices": sorted(VARIANT_VOICES),
+        "variant_voices_count": len(VARIANT_VOICES),
+        "threads": THREAD_SETTINGS,
+    }
+    body = json.dumps(static, sort_keys=True, separators=(",", ":")).encode()
+    return body, hashlib.sha256(body).hexdigest()[:32]
+
+
+def refresh_static_health() -> tuple[bytes, str]:
+    global static_health
+    static_health = build_static_health()
+    return static_health
+
+
+@app.route("/health/static", methods=["GET"])
+def health_static():
+    """The static /health fields; revalidate with If-None-Match for a 304."""
+    body, etag = static_health or refresh_static_health()
+    response = Response(body, mimetype="application/json", headers={"Cache-Control": "no-cache"})
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    # Runtime stats come from in-memory counters; the static fields are
+    # spliced in from their pre-serialized bytes.
+    engines = engine_states()
+    dynamic = json.dumps({
+        "status": "ok" if all(state["ready"] for state in engines.values()) else "loading",
+        "engines": engines,
+        "routing": router.stats(),
+        "overload": overload.stats(),
+        "inference_backend": (vits_backend.stats() if vits_backend is not None
+                              else {"name": "fake" if FAKE_MODEL else "torch"}),
+        "model": vits_residency.stats(),
+        "memory": process_memory(),
+        "cache": synthesis_cache.stats(),
+        "segment_cache": segment_cache.stats(),
+        "phoneme_cache": phoneme_stats(),
+        "batching": synthesis_batcher.stats(),
+        "workers": worker_pool.stats() if worker_pool is not None else [],
+        "phrase_bank": phrase_bank.stats() if phrase_bank is not None else None,
+        "jobs": job_queue.stats(),
+        "prefetch": prefetcher.stats(),
+        "pipe": pipe_server.stats() if pipe_server is not None else None,
+    }, separators=(",", ":")).encode()
+    body, etag = static_health or refresh_static_health()
+    return Response(dynamic[:-1] + b"," + body[1:], mimetype="application/json",
+                    headers={"X-HonkTTS-Static-ETag": f'"{etag}"'})
+
+
+# Front-end mode (`tts_server.py router`): several server processes on one
+# machine, each with its own model and cache, behind one port. Lines are
+# consistent-hashed on (voice, text) so a popular line is only ever rendered
+# and cached by one backend.
+router_app = Flask("honktts_router")
+
+# Hop-by-hop headers are never forwarded; http.client and waitress set Host and
+# the framing themselves.
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers",
+    "transfer-encoding", "upgrade", "host", "content-length",
+}
+# Backend answers that mean "not here, not now": the next sibling is tried.
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class Upstream:
+    """One backend server, with a small pool of keep-alive connections."""
+
+    def __init__(self, url: str, timeout_s: float):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme != "http" or not parsed.hostname:
+            raise ValueError(f"Backend URL must look like http://host:port, got {url!r}")
+        self.url = url.rstrip("/")
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout_s = timeout_s
+        self._idle: queue.LifoQueue[http.client.HTTPConnection] = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # Out of the ring until its first successful probe.
+        self.healthy = False
+        self.last_error: str | None = None
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+    def request(self, method: str, path: str, body: bytes | None,
+                headers: dict[str, str]) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """Send a request and return once the status line and headers are in.
+
+        The caller reads the body, then hands the connection back with
+        ``release``. A stale keep-alive connection is retried once on a new one.
+        """
+        for attempt in range(2):
+            try:
+                conn = self._idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout_s)
+                reused = False
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if not reused or attempt:
+                    raise
+        raise AssertionError("unreachable")
+
+    def release(self, conn: http.client.HTTPConnection, response: http.client.HTTPResponse):
+        if response.will_close or not response.isclosed():
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    def mark(self, healthy: bool, error: str | None = None):
+        with self._lock:
+            if self.healthy and not healthy:
+                self.ejections += 1
+                print(f"Ejected backend {self.url}: {error}")
+            elif healthy and not self.healthy:
+                print(f"Backend {self.url} is ready and in the ring")
+            self.healthy = healthy
+            self.last_error = error
+
+    def count(self, failed: bool = False):
+        with self._lock:
+            self.requests += 1
+            self.failures += failed
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "healthy": self.healthy,
+                "last_error": self.last_error,
+                "requests": self.requests,
+                "failures": self.failures,
+                "ejections": self.ejections,
+            }
+
+
+class UpstreamPool:
+    """Consistent-hash ring over the backends, with health-based ejection.
+
+    Each backend owns ``VIRTUAL_NODES`` points on the ring. A line goes to the
+    backend owning the first point after its hash; if that backend is ejected
+    the walk continues to the next one, so only the ejected backend's lines
+    move and they move back once it recovers. Backends are ejected when a
+    request to them fails or when ``/health/ready`` stops answering 200, and
+    rejoin after a successful probe.
+    """
+
+    VIRTUAL_NODES = 128
+
+    def __init__(self, urls: list[str], check_interval_s: float, retries: int, timeout_s: float):
+        if not urls:
+            raise ValueError("At least one backend URL is required.")
+        self.upstreams = [Upstream(url, timeout_s) for url in dict.fromkeys(urls)]
+        self.check_interval_s = check_interval_s
+        self.retries = retries
+        self.retried = 0
+        self.unrouted = 0
+        self._lock = threading.Lock()
+        points = sorted(
+            (self.hash(f"{upstream.url}#{i}"), index)
+            for index, upstream in enumerate(self.upstreams) for i in range(self.VIRTUAL_NODES))
+        self._ring = [point for point, _ in points]
+        self._owners = [index for _, index in points]
+        # Job and hint ids live on the backend that issued them.
+        self._affinity: OrderedDict[str, Upstream] = OrderedDict()
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+
+    def candidates(self, key: str) -> list[Upstream]:
+        """Healthy backends in ring order from the owner of ``key``."""
+        start = bisect.bisect(self._ring, self.hash(key))
+        order: list[Upstream] = []
+        for offset in range(len(self._ring)):
+            upstream = self.upstreams[self._owners[(start + offset) % len(self._ring)]]
+            if upstream not in order:
+                order.append(upstream)
+                if len(order) == len(self.upstreams):
+                    break
+        return [upstream for upstream in order if upstream.healthy]
+
+    def remember(self, object_id: str, upstream: Upstream):
+        with self._lock:
+            self._affinity[object_id] = upstream
+            while len(self._affinity) > ROUTER_AFFINITY_ENTRIES:
+                self._affinity.popitem(last=False)
+
+    def owner_of(self, object_id: str) -> Upstream | None:
+        with self._lock:
+            return self._affinity.get(object_id)
+
+    def count_retry(self):
+        with self._lock:
+            self.retried += 1
+
+    def count_unrouted(self):
+        with self._lock:
+            self.unrouted += 1
+
+    def probe(self, upstream: Upstream):
+        try:
+            conn, response = upstream.request("GET", "/health/ready", None, {})
+            response.read()
+            upstream.release(conn, response)
+        except (OSError, http.client.HTTPException) as e:
+            upstream.mark(False, str(e) or type(e).__name__)
+            return
+        upstream.mark(response.status == 200, None if response.status == 200 else f"not ready ({response.status})")
+
+    def _loop(self):
+        while True:
+            for upstream in self.upstreams:
+                self.probe(upstream)
+            time.sleep(self.check_interval_s)
+
+    def start(self):
+        threading.Thread(target=self._loop, name="upstream-health", daemon=True).start()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            retried, unrouted, affinity = self.retried, self.unrouted, len(self._affinity)
+        return {
+            "backends": {upstream.url: upstream.stats() for upstream in self.upstreams},
+            "healthy": sum(upstream.healthy for upstream in self.upstreams),
+            "virtual_nodes": self.VIRTUAL_NODES,
+            "retries": self.retries,
+            "retried": retried,
+            "unrouted": unrouted,
+            "tracked_ids": affinity,
+        }
+
+
+def line_key(item: Any) -> str | None:
+    """The routing key of a request body: its voice and text."""
+    if not isinstance(item, dict):
+        return None
+    return f"{item.get('voice')}\0{item.get('input_string')}"
+
+
+def forward(upstreams: list[Upstream], path: str, body: bytes | None = None) -> Response:
+    """Send the current request to the first backend that takes it.
+
+    Connection failures eject the backend; both they and RETRY_STATUSES move
+    on to the next sibling, up to ``retries`` times. The body is streamed
+    back, so a failure after the first byte is not retried.
+    """
+    if not upstreams:
+        upstream_pool.count_unrouted()
+        return router_app.make_response((jsonify({"error": "No healthy backend."}), 503, {"Retry-After": "1"}))
+
+    headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+    body = request.get_data() if body is None else body
+    attempts = upstreams[:upstream_pool.retries + 1]
+    for attempt, upstream in enumerate(attempts):
+        if attempt:
+            upstream_pool.count_retry()
+        try:
+            conn, response = upstream.request(request.method, path, body, headers)
+        except (OSError, http.client.HTTPException) as e:
+            upstream.count(failed=True)
+            upstream.mark(False, str(e) or type(e).__name__)
+            if attempt == len(attempts) - 1:
+                return router_app.make_response((jsonify({"error": f"Backend {upstream.url} failed: {e}"}), 502))
+            continue
+
+        upstream.count()
+        if response.status in RETRY_STATUSES and attempt < len(attempts) - 1:
+            response.read()
+            upstream.release(conn, response)
+            continue
+        return relay(upstream, conn, response)
+    raise AssertionError("unreachable")
+
+
+def relay(upstream: Upstream, conn: http.client.HTTPConnection, response: http.client.HTTPResponse) -> Response:
+    headers = [(name, value) for name, value in response.getheaders() if name.lower() not in HOP_BY_HOP_HEADERS]
+    headers.append(("X-HonkTTS-Backend", upstream.url))
+    length = response.getheader("Content-Length")
+    if length is not None:
+        data = response.read()
+        upstream.release(conn, response)
+        return Response(data, status=response.status, headers=headers)
+
+    def chunks():
+        # Streamed (chunked) answers are passed on piece by piece.
+        try:
+            while chunk := response.read1(64 * 1024):
+                yield chunk
+        finally:
+            upstream.release(conn, response)
+
+    return Response(chunks(), status=response.status, headers=headers)
+
+
+@router_app.route("/generate-audio", methods=["POST"])
+@router_app.route("/generate-audio/stream", methods=["POST"])
+@router_app.route("/generate_audio_robotic", methods=["POST"])
+@router_app.route("/generate-audio/batch", methods=["POST"])
+def route_line():
+    payload = request.get_json(silent=True)
+    if request.path == "/generate-audio/batch" and isinstance(payload, dict):
+        # A batch stays together (it is answered as one bundle) and goes where
+        # its first line lives.
+        items = payload.get("items")
+        payload = items[0] if isinstance(items, list) and items else None
+    key = line_key(payload)
+    if key is None:
+        # Let a backend produce the usual 400.
+        return forward([upstream for upstream in upstream_pool.upstreams if upstream.healthy], request.path)
+    return forward(upstream_pool.candidates(key), request.path)
+
+
+@router_app.route("/jobs", methods=["POST"])
+def route_job():
+    key = line_key(request.get_json(silent=True)) or ""
+    response = forward(upstream_pool.candidates(key), request.path)
+    if response.status_code == 202:
+        upstream_pool.remember(response.get_json()["job_id"], owner(response))
+    return response
+
+
+@router_app.route("/prefetch", methods=["POST"])
+def route_prefetch():
+    payload = request.get_json(silent=True)
+    items = payload.get("items", [payload]) if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Body must be a hint object or {\"items\": [...]}."}), 400
+    if len(items) > BATCH_REQUEST_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_REQUEST_MAX_ITEMS} hints per request."}), 400
+
+    # Each hint warms the backend that will later be asked for its line.
+    groups: dict[str, list[int]] = {}
+    for index, item in enumerate(items):
+        candidates = upstream_pool.candidates(line_key(item) or "")
+        groups.setdefault(candidates[0].url if candidates else "", []).append(index)
+
+    hints: list[Any] = [None] * len(items)
+    for url, indexes in groups.items():
+        upstream = next((upstream for upstream in upstream_pool.upstreams if upstream.url == url), None)
+        body = json.dumps({"items": [items[index] for index in indexes]}).encode()
+        response = forward([upstream] if upstream is not None else [], request.path, body)
+        answer = response.get_json(silent=True) or {}
+        for position, index in enumerate(indexes):
+            if response.status_code != 202:
+                message = answer.get("error", f"Backend answered {response.status}")
+                hints[index] = {"status": "rejected", "error": message}
+                continue
+            hints[index] = answer["hints"][position]
+            if "id" in hints[index]:
+                upstream_pool.remember(hints[index]["id"], upstream)
+    return jsonify({"hints": hints}), 202
+
+
+@router_app.route("/jobs/<object_id>", methods=["GET", "DELETE"])
+@router_app.route("/prefetch/<object_id>", methods=["DELETE"])
+def route_by_id(object_id: str):
+    upstream = upstream_pool.owner_of(object_id)
+    if upstream is None:
+        return jsonify({"error": "Unknown or expired id."}), 404
+    return forward([upstream], request.full_path if request.query_string else request.path)
+
+
+@router_app.route("/engines", methods=["GET", "PATCH"])
+def route_engines():
+    # Reads come from any healthy backend; changes go to all of them.
+    healthy = [upstream for upstream in upstream_pool.upstreams if upstream.healthy]
+    if request.method == "GET" or not healthy:
+        return forward(healthy, request.path)
+    responses = [forward([upstream], request.path) for upstream in healthy]
+    failed = [response for response in responses if response.status_code != 200]
+    return failed[0] if failed else responses[0]
+
+
+def owner(response: Response) -> Upstream:
+    url = response.headers["X-HonkTTS-Backend"]
+    return next(upstream for upstream in upstream_pool.upstreams if upstream.url == url)
+
+
+@router_app.route("/health/live", methods=["GET"])
+def router_health_live():
+    return jsonify({"status": "alive"})
+
+
+@router_app.route("/health/ready", methods=["GET"])
+def router_health_ready():
+    """200 while at least one backend is ready, else 503."""
+    healthy = sum(upstream.healthy for upstream in upstream_pool.upstreams)
+    body = {"ready": healthy > 0, "healthy_backends": healthy, "backends": len(upstream_pool.upstreams)}
+    if not healthy:
+        return jsonify(body), 503, {"Retry-After": "1"}
+    return jsonify(body)
+
+
+@router_app.route("/health", methods=["GET"])
+def router_health():
+    return jsonify({"status": "healthy", "mode": "router", "python_executable": sys.executable, "pid": os.getpid(),
+                    "routing": upstream_pool.stats()})
+
+
+@router_app.route("/metrics", methods=["GET"])
+def router_metrics():
+    stats = upstream_pool.stats()
+    lines = []
+    for name, kind, help_text, field_name in (
+        ("honktts_backend_healthy", "gauge", "1 while the backend is in the hash ring.", "healthy"),
+        ("honktts_backend_requests_total", "counter", "Requests forwarded to the backend.", "requests"),
+        ("honktts_backend_failures_total", "counter", "Forwarded requests that failed to connect.", "failures"),
+        ("honktts_backend_ejections_total", "counter", "Times the backend was ejected.", "ejections"),
+    ):
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+        for url, backend in stats["backends"].items():
+            lines.append(f'{name}{{backend="{url}"}} {int(backend[field_name])}')
+    for name, help_text, value in (
+        ("honktts_router_retries_total", "Requests retried on a sibling backend.", stats["retried"]),
+        ("honktts_router_unrouted_total", "Requests refused because no backend was healthy.", stats["unrouted"]),
+    ):
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {value}"])
+    return Response("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        raise RuntimeError(f"{name} must be an integer, got {raw!r}") from None
+
+
+TTS_MODEL = "tts_models/en/vctk/vits"
+HOST = "127.0.0.1"
+PORT = env_int("HONKTTS_PORT", 5234)
+
+# Persistent pipelined protocol (see PipeServer): its port (0, the default,
+# disables it) and how many unanswered requests one connection may have.
+PIPE_PORT = env_int("HONKTTS_PIPE_PORT", 0)
+PIPE_MAX_IN_FLIGHT = env_int("HONKTTS_PIPE_MAX_IN_FLIGHT", 64)
+
+# Synthesis cache: in-memory byte budget, an optional directory for the
+# persistent tier (unset = memory only) and that tier's byte budget (0 = no
+# limit).
+CACHE_MAX_BYTES = env_int("HONKTTS_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+CACHE_DIR = os.environ.get("HONKTTS_CACHE_DIR") or None
+CACHE_DISK_MAX_BYTES = env_int("HONKTTS_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024)
+
+# Micro-batching: how long the scheduler waits for more requests after the
+# first one arrives, and the largest batch it will run in one forward pass.
+BATCH_WINDOW_MS = env_int("HONKTTS_BATCH_WINDOW_MS", 15)
+BATCH_MAX_ITEMS = env_int("HONKTTS_BATCH_MAX_ITEMS", 8)
+
+# Worker-pool mode: number of synthesis processes (0 = synthesize in the
+# server process) and torch intra-op threads given to each of them.
+WORKER_PROCESSES = env_int("HONKTTS_WORKERS", 0)
+THREADS_PER_WORKER = env_int("HONKTTS_THREADS_PER_WORKER", 1)
+# How long a worker may take per line of a batch before it is presumed hung
+# and replaced.
+WORKER_TIMEOUT_MS = env_int("HONKTTS_WORKER_TIMEOUT_MS", 30000)
+
+# Phonemes memoized per punctuation-free segment (0 disables the cache).
+PHONEME_CACHE_ENTRIES = env_int("HONKTTS_PHONEME_CACHE_ENTRIES", 8192)
+
+# Text front end: longest accepted input after normalization, longest
+# segment sent to the model in one piece, the crossfade used where a long
+# sentence was split, and the byte budget of the per-segment audio cache.
+MAX_INPUT_CHARS = env_int("HONKTTS_MAX_INPUT_CHARS", 1000)
+SEGMENT_MAX_CHARS = env_int("HONKTTS_SEGMENT_MAX_CHARS", 160)
+SEGMENT_CROSSFADE_MS = 10
+SEGMENT_CACHE_MAX_BYTES = env_int("HONKTTS_SEGMENT_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+
+# Silence appended after each sentence, matching Coqui's Synthesizer.tts.
+SENTENCE_GAP_SAMPLES = 10000
+
+# Streaming: sentences longer than this are split at clause punctuation.
+STREAM_CLAUSE_CHARS = env_int("HONKTTS_STREAM_CLAUSE_CHARS", 60)
+
+# /generate-audio/batch: most items accepted per request, and how many
+# lines are rendered concurrently (this is what lets them batch).
+BATCH_REQUEST_MAX_ITEMS = env_int("HONKTTS_BATCH_REQUEST_MAX_ITEMS", 64)
+RENDER_THREADS = env_int("HONKTTS_RENDER_THREADS", 8)
+
+# Async job API: queue bound, runner threads, how long finished results are
+# kept for polling, and the longest a GET /jobs/<id>?wait= may block.
+JOB_QUEUE_MAX = env_int("HONKTTS_JOB_QUEUE_MAX", 256)
+JOB_RUNNERS = env_int("HONKTTS_JOB_RUNNERS", 4)
+JOB_RESULT_TTL_S = env_int("HONKTTS_JOB_RESULT_TTL_S", 60)
+JOB_MAX_WAIT_S = 8.0
+
+# Prefetch hints: most queued at once, and how long the model and foreground
+# requests must have been quiet before a hint is rendered.
+PREFETCH_MAX_HINTS = env_int("HONKTTS_PREFETCH_MAX_HINTS", 256)
+PREFETCH_IDLE_MS = env_int("HONKTTS_PREFETCH_IDLE_MS", 50)
+
+# Engine registry: lines each engine may render at once (0 = no limit), and
+# priority routes between engines ("vits:chatter=robotic"). Both can be
+# changed at runtime with PATCH /engines.
+VITS_MAX_CONCURRENCY = env_int("HONKTTS_VITS_MAX_CONCURRENCY", 0)
+ROBOTIC_MAX_CONCURRENCY = env_int("HONKTTS_ROBOTIC_MAX_CONCURRENCY", 0)
+ROUTES = os.environ.get("HONKTTS_ROUTES", "")
+
+# Overload controller: VITS lines are degraded one level per this many
+# segments waiting for the model, or per this real-time factor (in percent)
+# of recent renders; 0 turns a signal off. Degraded lines are rendered with
+# FAST_LENGTH_SCALE, or by espeak.
+OVERLOAD_QUEUE_DEPTH = env_int("HONKTTS_OVERLOAD_QUEUE_DEPTH", 16)
+OVERLOAD_RTF_PCT = env_int("HONKTTS_OVERLOAD_RTF_PCT", 200)
+FAST_LENGTH_SCALE = 0.85
+
+# Unload the VITS model after this many minutes without a request (0 keeps it
+# resident); the next request reloads it. Weights are memory-mapped from the
+# checkpoint, which makes reloads cheap, unless HONKTTS_MMAP_WEIGHTS=0.
+IDLE_UNLOAD_MINUTES = env_int("HONKTTS_IDLE_UNLOAD_MINUTES", 0)
+MMAP_WEIGHTS = env_int("HONKTTS_MMAP_WEIGHTS", 1) > 0
+
+# Pre-rendered phrase bank directory built with `tts_server.py build-phrase-bank`.
+PHRASE_BANK_DIR = os.environ.get("HONKTTS_PHRASE_BANK") or None
+
+# Front-end mode (`router`): backend URLs (comma-separated; the command line
+# takes precedence), how often each backend's /health/ready is probed, how
+# many siblings a failed request moves on to, the backend response timeout,
+# and how many job/hint ids are remembered for their follow-up requests.
+UPSTREAMS = os.environ.get("HONKTTS_UPSTREAMS", "")
+ROUTER_CHECK_MS = env_int("HONKTTS_ROUTER_CHECK_MS", 1000)
+ROUTER_RETRIES = env_int("HONKTTS_ROUTER_RETRIES", 2)
+ROUTER_TIMEOUT_S = env_int("HONKTTS_ROUTER_TIMEOUT_S", 120)
+ROUTER_AFFINITY_ENTRIES = 65536
+
+# Threading and CPU use (0 = picked by tune_threads() from the core count):
+# torch intra-/inter-op threads for in-process inference, HTTP serving
+# threads, an optional CPU list the inference threads (or worker processes)
+# are pinned to, and a nice increment that runs the server below normal
+# priority (any value > 0 means "below normal" on Windows).
+TORCH_THREADS = env_int("HONKTTS_TORCH_THREADS", 0)
+TORCH_INTEROP_THREADS = env_int("HONKTTS_TORCH_INTEROP_THREADS", 0)
+SERVE_THREADS = env_int("HONKTTS_SERVE_THREADS", 0)
+INFERENCE_CPUS = os.environ.get("HONKTTS_INFERENCE_CPUS", "")
+NICE = env_int("HONKTTS_NICE", 0)
+BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+# Filled in by configure_threads() at startup.
+THREAD_SETTINGS: dict[str, Any] = {}
+
+# Fake model for offline benchmarking: VITS requests are answered with tones
+# after a simulated inference cost (milliseconds per second of audio).
+FAKE_MODEL = env_int("HONKTTS_FAKE_MODEL", 0) > 0
+FAKE_MODEL_COST_MS = env_int("HONKTTS_FAKE_MODEL_COST_MS", 100)
+FAKE_SECONDS_PER_CHAR = 0.065
+# Model id in cache keys and phrase bank indexes, so fake tones never
+# share entries with the real model.
+VITS_MODEL_ID = "fake" if FAKE_MODEL else TTS_MODEL
+
+# VITS inference backend: "torch", or "onnx" for ONNX Runtime (exported once
+# and cached next to the model), optionally with int8 weights. Thread counts
+# of 0 leave the choice to ONNX Runtime.
+BACKENDS = ("torch", "onnx")
+INFERENCE_BACKEND = os.environ.get("HONKTTS_BACKEND", "").strip().lower() or "torch"
+ONNX_QUANTIZE = env_int("HONKTTS_ONNX_QUANTIZE", 0) > 0
+ONNX_INTRA_THREADS = env_int("HONKTTS_ONNX_INTRA_THREADS", 0)
+ONNX_INTER_THREADS = env_int("HONKTTS_ONNX_INTER_THREADS", 1)
+
+# Startup parity check of the ONNX generator against torch (noise disabled):
+# the largest relative RMS error accepted before falling back to torch.
+ONNX_PARITY_TEXTS = (
+    "The emergency shuttle has been called.",
+    "Security, report to the bridge.",
+)
+ONNX_PARITY_MAX_ERROR = 0.001
+ONNX_PARITY_MAX_ERROR_INT8 = 0.1
+
+tts: "TTS | FakeTTS | None" = None
+ESPEAK_BINARY: str | None = None
+ESPEAK_LIBRARY: EspeakLibrary | None = None
+ESPEAK_VERSION: str | None = None
+VARIANT_VOICES: set[str] = set()
+synthesis_cache: SynthesisCache | None = None
+segment_cache: SynthesisCache | None = None
+phoneme_cache: PhonemeCache | None = None
+SPEAKER_IDS: dict[str, int] = {}
+synthesis_batcher: BatchScheduler | None = None
+worker_pool: SynthesisWorkerPool | None = None
+phrase_bank: PhraseBank | None = None
+render_executor: ThreadPoolExecutor | None = None
+job_queue: JobQueue | None = None
+pipe_server: PipeServer | None = None
+prefetcher: Prefetcher | None = None
+vits_residency: ModelResidency | None = None
+vits_backend: OnnxVitsBackend | None = None
+upstream_pool: UpstreamPool | None = None
+# Pre-serialized static /health fields and their ETag; built at startup and
+# after each engine load, never at import.
+static_health: tuple[bytes, str] | None = None
+
+# Set by load_engines() once each engine can serve requests.
+ENGINE_READY: dict[str, threading.Event] = {"vits": threading.Event(), "robotic": threading.Event()}
+ENGINE_LOAD_SECONDS: dict[str, float] = {}
+ENGINE_ERRORS: dict[str, str] = {}
+
+
+def load_vits():
+    vits_residency.load()
+    synthesis_batcher.start()
+    vits_residency.start()
+
+
+def load_vits_model():
+    global tts, vits_backend
+    if not FAKE_MODEL:
+        apply_torch_threads(THREAD_SETTINGS["torch_threads"], THREAD_SETTINGS["torch_interop_threads"])
+    tts = load_tts()
+    if not FAKE_MODEL:
+        SPEAKER_IDS.update(resolve_speaker_ids())
+    if INFERENCE_BACKEND == "onnx" and not FAKE_MODEL:
+        try:
+            vits_backend = load_onnx_backend(
+                ONNX_INTRA_THREADS or THREAD_SETTINGS["torch_threads"], ONNX_INTER_THREADS, ONNX_QUANTIZE)
+        except Exception as e:
+            print(f"ONNX backend unavailable, using torch: {e}")
+    if worker_pool is not None:
+        # The forked workers only run synthesize_batch, which never takes a
+        # lock the server's threads could be holding at fork time (respawned
+        # workers already rely on this).
+        worker_pool.start()
+
+
+def unload_vits_model():
+    global tts, vits_backend
+    if worker_pool is not None:
+        worker_pool.stop()
+    tts = None
+    vits_backend = None
+
+
+def load_espeak():
+    global ESPEAK_BINARY, ESPEAK_LIBRARY, ESPEAK_VERSION, VARIANT_VOICES
+    binary = get_espeak_binary()
+    library = load_espeak_library(binary)
+    VARIANT_VOICES = load_variant_voices(binary)
+    if library is not None:
+        ESPEAK_VERSION = library.version
+    else:
+        version_proc = subprocess.run([binary, "--version"], capture_output=True, text=True, check=False)
+        ESPEAK_VERSION = version_proc.stdout.strip() or version_proc.stderr.strip() or "unknown"
+    ESPEAK_LIBRARY = library
+    ESPEAK_BINARY = binary
+
+
+# Built-in engines; another backend plugs in by registering an Engine with its
+# own voices, renderer and loader before load_engines() runs.
+ENGINES: dict[str, Engine] = {}
+register_engine(Engine("vits", lambda: VOICES, render_vits, load_vits, cost=0.3,
+                       max_concurrency=VITS_MAX_CONCURRENCY))
+register_engine(Engine("robotic", lambda: VARIANT_VOICES, render_robotic, load_espeak, cost=0.01,
+                       max_concurrency=ROBOTIC_MAX_CONCURRENCY))
+router = Router()
+overload = OverloadController(OVERLOAD_QUEUE_DEPTH, OVERLOAD_RTF_PCT / 100)
+
+
+def _load_engine(engine: str, loader: Callable[[], None], exit_on_failure: bool):
+    started = time.perf_counter()
+    try:
+        loader()
+    except Exception as e:
+        ENGINE_ERRORS[engine] = str(e)
+        print(f"Failed to load the {engine} engine: {e}", flush=True)
+        if exit_on_failure:
+            # Fail the whole server, as a synchronous startup would have.
+            os._exit(1)
+        return
+
+    ENGINE_LOAD_SECONDS[engine] = round(time.perf_counter() - started, 3)
+    refresh_static_health()
+    ENGINE_READY[engine].set()
+    print(f"The {engine} engine is ready after {ENGINE_LOAD_SECONDS[engine]:.2f}s")
+
+
+def load_engines(wait: bool = True):
+    """Create the shared services, then load the engines concurrently.
+
+    Each engine serves requests as soon as its own ``ENGINE_READY`` event is
+    set. With ``wait=False`` this returns immediately, so the caller can
+    start serving while the model loads.
+    """
+    global synthesis_cache, segment_cache, phoneme_cache, synthesis_batcher, worker_pool, render_executor, job_queue
+    global prefetcher, vits_residency
+    configure_threads()
+    try:
+        router.update(parse_routes(ROUTES))
+    except ValueError as e:
+        raise RuntimeError(f"HONKTTS_ROUTES: {e}") from None
+    synthesis_cache = SynthesisCache(CACHE_MAX_BYTES, CACHE_DIR, CACHE_DISK_MAX_BYTES)
+    segment_cache = SynthesisCache(SEGMENT_CACHE_MAX_BYTES)
+    phoneme_cache = PhonemeCache(PHONEME_CACHE_ENTRIES)
+    if WORKER_PROCESSES > 0:
+        worker_pool = SynthesisWorkerPool(WORKER_PROCESSES, THREADS_PER_WORKER, THREAD_SETTINGS["inference_cpus"],
+                                          WORKER_TIMEOUT_MS / 1000)
+        synthesis_batcher = BatchScheduler(
+            worker_pool.run_batch, BATCH_WINDOW_MS / 1000, BATCH_MAX_ITEMS, concurrency=WORKER_PROCESSES)
+    else:
+        synthesis_batcher = BatchScheduler(synthesize_batch, BATCH_WINDOW_MS / 1000, BATCH_MAX_ITEMS,
+                                           cpus=THREAD_SETTINGS["inference_cpus"])
+    render_executor = ThreadPoolExecutor(max_workers=max(1, RENDER_THREADS), thread_name_prefix="render")
+    job_queue = JobQueue(JOB_QUEUE_MAX, JOB_RUNNERS, JOB_RESULT_TTL_S)
+    job_queue.start()
+    prefetcher = Prefetcher(PREFETCH_MAX_HINTS, PREFETCH_IDLE_MS / 1000)
+    prefetcher.start()
+    vits_residency = ModelResidency(load_vits_model, unload_vits_model, IDLE_UNLOAD_MINUTES * 60)
+
+    loaders = [
+        threading.Thread(target=_load_engine, args=(engine, loader, not wait), name=f"load-{engine}", daemon=True)
+        for engine, loader in ((engine.name, engine.load) for engine in ENGINES.values())
+    ]
+    for thread in loaders:
+        thread.start()
+    if not wait:
+        return
+
+    for thread in loaders:
+        thread.join()
+    if ENGINE_ERRORS:
+        raise RuntimeError("; ".join(f"{engine}: {error}" for engine, error in ENGINE_ERRORS.items()))
+
+
+def select_backend(backend: str | None):
+    global INFERENCE_BACKEND
+    INFERENCE_BACKEND = backend or INFERENCE_BACKEND
+    if INFERENCE_BACKEND not in BACKENDS:
+        raise RuntimeError(f"HONKTTS_BACKEND must be one of {list(BACKENDS)}, got {INFERENCE_BACKEND!r}")
+
+
+def configure_threads():
+    # Runs at startup rather than import, so a bad HONKTTS_INFERENCE_CPUS is
+    # a startup error and importing this module (as test_server.py does)
+    # never fails on it.
+    global THREAD_SETTINGS
+    if not THREAD_SETTINGS:
+        THREAD_SETTINGS = tune_threads()
+
+
+def start(backend: str | None = None):
+    """Serve the API. ``backend`` overrides HONKTTS_BACKEND ("torch" or "onnx")."""
+    global phrase_bank, pipe_server
+    select_backend(backend)
+    configure_threads()
+    refresh_static_health()
+    lower_priority(NICE)
+    print("Threads: " + ", ".join(f"{name} {value}" for name, value in THREAD_SETTINGS.items() if name != "auto"))
+    if PHRASE_BANK_DIR:
+        phrase_bank = PhraseBank(PHRASE_BANK_DIR)
+        print(f"Loaded {len(phrase_bank.entries)} phrase bank entries from {PHRASE_BANK_DIR}")
+
+    # Bind before loading anything so /health/live answers straight away;
+    # /health/ready reports when the engines can serve.
+    server = create_server(app, host=HOST, port=PORT, threads=THREAD_SETTINGS["serve_threads"], backlog=8,
+                           connection_limit=24, channel_timeout=10)
+    print(f"Listening on http://{HOST}:{PORT}")
+    if PIPE_PORT > 0:
+        try:
+            pipe_server = PipeServer(HOST, PIPE_PORT, PIPE_MAX_IN_FLIGHT)
+            print(f"Pipelined protocol listening on {HOST}:{PIPE_PORT}")
+        except OSError as e:
+            # HTTP is already up; serve without the pipe rather than exit.
+            print(f"Pipelined protocol disabled, could not listen on {HOST}:{PIPE_PORT}: {e}")
+    load_engines(wait=False)
+    if pipe_server is not None:
+        pipe_server.start()
+    server.run()
+
+
+def start_router(urls: list[str], spawn: int, backend: str | None = None):
+    """Serve the front-end on PORT, optionally spawning ``spawn`` local backends.
+
+    Spawned backends listen on PORT+1, PORT+2, ... with the pipelined
+    protocol disabled, and are stopped with the front-end.
+    """
+    global upstream_pool
+    children = []
+    for i in range(spawn):
+        port = PORT + 1 + i
+        env = {**os.environ, "HONKTTS_PORT": str(port), "HONKTTS_PIPE_PORT": "0"}
+        command = [sys.executable, os.path.abspath(__file__)] + (["--backend", backend] if backend else [])
+        children.append(subprocess.Popen(command, env=env))
+        urls.append(f"http://{HOST}:{port}")
+
+    # Turn SIGTERM into SystemExit so the backends are stopped too.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        upstream_pool = UpstreamPool(urls, ROUTER_CHECK_MS / 1000, ROUTER_RETRIES, ROUTER_TIMEOUT_S)
+        upstream_pool.start()
+        # Streams and job long-polls hold a thread each, so the front-end
+        # gets the serving capacity of all its backends.
+        server = create_server(router_app, host=HOST, port=PORT, threads=4 * len(urls), backlog=8 * len(urls),
+                               connection_limit=24 * len(urls), channel_timeout=10)
+        print(f"Routing http://{HOST}:{PORT} to {', '.join(upstream.url for upstream in upstream_pool.upstreams)}")
+        server.run()
+    finally:
+        for child in children:
+            child.terminate()
+        for child in children:
+            child.wait()
+
+
+def main():
+    global tts
+    parser = argparse.ArgumentParser(description="HonkTTS server")
+    parser.add_argument("--backend", choices=BACKENDS,
+                        help="VITS inference backend (default: HONKTTS_BACKEND or torch)")
+    subparsers = parser.add_subparsers(dest="command")
+
+    build = subparsers.add_parser(
+        "build-phrase-bank", help="Pre-render a manifest of (voice, text) lines into a phrase bank")
+    build.add_argument("manifest", help="JSON list of {voice, input_string, engine} or a 'voice|text' file")
+    build.add_argument("output", help="Phrase bank directory (rebuilt incrementally if it exists)")
+    build.add_argument("--jobs", type=int, default=8, help="Lines rendered concurrently (default: 8)")
+
+    export = subparsers.add_parser(
+        "export-onnx", help="Export the VITS generator to ONNX next to the model and check it against torch")
+    export.add_argument("--quantize", action="store_true", help="Also write int8-quantized weights")
+
+    front_end = subparsers.add_parser(
+        "router", help="Consistent-hash requests on (voice, text) across several HonkTTS servers")
+    front_end.add_argument("backends", nargs="*", help="Backend URLs, e.g. http://127.0.0.1:5240 "
+                                                        "(default: HONKTTS_UPSTREAMS)")
+    front_end.add_argument("--spawn", type=int, default=0,
+                           help="Also start this many local backends on the ports after PORT")
+
+    args = parser.parse_args()
+    if args.command == "export-onnx":
+        if FAKE_MODEL:
+            raise RuntimeError("export-onnx needs the real model; unset HONKTTS_FAKE_MODEL")
+        tts = load_tts()
+        SPEAKER_IDS.update(resolve_speaker_ids())
+        backend = load_onnx_backend(ONNX_INTRA_THREADS, ONNX_INTER_THREADS, args.quantize)
+        print(json.dumps(backend.stats(), indent=2))
+        return
+
+    if args.command == "build-phrase-bank":
+        select_backend(args.backend)
+        load_engines()
+        build_phrase_bank(args.manifest, args.output, args.jobs)
+        return
+
+    if args.command == "router":
+        urls = args.backends or [url.strip() for url in UPSTREAMS.split(",") if url.strip()]
+        if not urls and args.spawn <= 0:
+            parser.error("router needs backend URLs, HONKTTS_UPSTREAMS or --spawn")
+        start_router(urls, args.spawn, args.backend)
+        return
 
-def start():
-    global tts, ESPEAK_BINARY, VARIANT_VOICES
-    tts = TTS(TTS_MODEL, progress_bar=False, gpu=False)
-    ESPEAK_BINARY = get_espeak_binary()
-    VARIANT_VOICES = load_variant_voices(ESPEAK_BINARY)
-    serve(app, host=HOST, port=PORT, threads=4, backlog=8, connection_limit=24, channel_timeout=10)
+    start(args.backend)
 
 
 if __name__ == "__main__":
-    start()
+    main()